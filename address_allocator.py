@@ -0,0 +1,156 @@
+import asyncio
+import hashlib
+import logging
+import math
+import string
+from config import DOMAIN, ADDRESS_BLOCK_SIZE, ADDRESS_FILTER_CAPACITY, ADDRESS_FILTER_ERROR_RATE
+
+logger = logging.getLogger(__name__)
+
+ADDRESS_LOAD_CHUNK = 50000
+ALPHABET = string.ascii_lowercase
+LOCAL_PART_LENGTH = 8
+ADDRESS_SPACE = len(ALPHABET) ** LOCAL_PART_LENGTH  # ~2.1e11 local parts
+
+def encode_local_part(value, length=LOCAL_PART_LENGTH):
+    """Fixed-length base-26 encoding of value into lowercase letters"""
+    letters = []
+    for _ in range(length):
+        value, digit = divmod(value, len(ALPHABET))
+        letters.append(ALPHABET[digit])
+    return ''.join(reversed(letters))
+
+class FeistelPermutation:
+    """Keyed bijection on range(size).
+
+    A balanced Feistel network permutes the enclosing power-of-two range;
+    cycle walking re-applies it until the result lands inside range(size),
+    which keeps the mapping a bijection on range(size) itself.
+    """
+
+    def __init__(self, size, key, rounds=4):
+        self.size = size
+        self.key = key
+        self.rounds = rounds
+        self.half_bits = (max(size - 1, 1).bit_length() + 1) // 2
+        self.half_mask = (1 << self.half_bits) - 1
+
+    def _round(self, value, round_number):
+        digest = hashlib.blake2b(
+            value.to_bytes(8, 'big'), digest_size=8, key=self.key, salt=round_number.to_bytes(16, 'big')
+        ).digest()
+        return int.from_bytes(digest, 'big') & self.half_mask
+
+    def _encrypt(self, value):
+        left, right = value >> self.half_bits, value & self.half_mask
+        for round_number in range(self.rounds):
+            left, right = right, left ^ self._round(right, round_number)
+        return (left << self.half_bits) | right
+
+    def __call__(self, value):
+        if not 0 <= value < self.size:
+            raise ValueError(f"{value} is outside the permutation domain")
+        value = self._encrypt(value)
+        while value >= self.size:
+            value = self._encrypt(value)
+        return value
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings; no false negatives"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.bits = max(8, int(-self.capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.bits / self.capacity * math.log(2)))
+        self.array = bytearray((self.bits + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self.array[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+class AddressAllocator:
+    """Hands out unique addresses without probing the database.
+
+    Addresses are a keyed permutation of a persistent sequence, so two
+    allocations can never produce the same local part. Sequence numbers are
+    reserved from the database in blocks of block_size, so only one write
+    happens per block. Older randomly generated addresses, those up to the
+    id recorded when the sequence was introduced, are loaded into a Bloom
+    filter; a candidate that might match one of them is skipped, which costs
+    one sequence number and no query. Permuted addresses never need the
+    filter, so startup cost is fixed rather than growing with every address.
+    """
+
+    def __init__(self, db, domain=DOMAIN, block_size=ADDRESS_BLOCK_SIZE,
+                 filter_capacity=ADDRESS_FILTER_CAPACITY, filter_error_rate=ADDRESS_FILTER_ERROR_RATE):
+        self.db = db
+        self.domain = domain
+        self.block_size = block_size
+        self.filter_capacity = filter_capacity
+        self.filter_error_rate = filter_error_rate
+        self.permutation = None
+        self.filter = None
+        self.skipped = 0
+        self._next = 0
+        self._end = 0
+        self._lock = asyncio.Lock()
+
+    async def load(self):
+        """Build the membership filter from the addresses issued before the allocator"""
+        async with self._lock:
+            if self.filter is None:
+                await self._load()
+
+    async def _load(self):
+        # fake_emails ids come from AUTOINCREMENT, so the bound also bounds the row count
+        legacy_max_id = await self.db.get_legacy_address_bound()
+        self.filter = BloomFilter(max(self.filter_capacity, legacy_max_id), self.filter_error_rate)
+        last_id = 0
+        while True:
+            rows = await self.db.get_email_addresses_after(last_id, legacy_max_id, ADDRESS_LOAD_CHUNK)
+            if not rows:
+                break
+            for _, address in rows:
+                self.filter.add(address)
+            last_id = rows[-1][0]
+        self.permutation = FeistelPermutation(ADDRESS_SPACE, await self.db.get_address_key())
+        logger.info(f"Address allocator loaded {self.filter.count} addresses from before the sequence")
+
+    async def _reserve(self):
+        self._next = await self.db.reserve_address_block(self.block_size)
+        self._end = self._next + self.block_size
+
+    async def allocate(self):
+        """Return a fresh address that is not yet taken"""
+        return (await self.allocate_many(1))[0]
+
+    async def allocate_many(self, count):
+        async with self._lock:
+            if self.filter is None:
+                await self._load()
+
+            addresses = []
+            while len(addresses) < count:
+                if self._next >= self._end:
+                    await self._reserve()
+                if self._next >= ADDRESS_SPACE:
+                    raise RuntimeError("Address space exhausted")
+                value, self._next = self._next, self._next + 1
+
+                address = f"{encode_local_part(self.permutation(value))}@{self.domain}"
+                if address in self.filter:
+                    self.skipped += 1
+                    continue
+                addresses.append(address)
+            return addresses
@@ -0,0 +1,212 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from database import Database
+from metrics import REGISTRY
+from config import DATABASE_NAME, DB_POOL_SIZE, METRICS_ENABLED, PREMIUM_CODE_DAYS
+
+class AsyncDatabase:
+    """Awaitable access to Database that never blocks the event loop.
+
+    Queries run on a bounded thread pool where every worker owns its own
+    SQLite connection, so concurrent handlers read in parallel and only
+    writers serialize (inside SQLite, not on the event loop).
+    """
+
+    def __init__(self, path=DATABASE_NAME, pool_size=DB_POOL_SIZE, instrument=METRICS_ENABLED,
+                 open_database=Database):
+        self.path = path
+        self.pool_size = pool_size
+        self.open_database = open_database
+        # Chosen once so uninstrumented calls pay nothing per query
+        self._dispatch = self._timed_call if instrument else self._call
+        self._local = threading.local()
+        self._workers = []
+        self._workers_lock = threading.Lock()
+
+        # Schema setup runs once here instead of once per worker connection
+        open_database(path).close()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size,
+            thread_name_prefix='db',
+            initializer=self._open_worker
+        )
+
+    def _open_worker(self):
+        db = self.open_database(self.path, init_schema=False)
+        self._local.db = db
+        with self._workers_lock:
+            self._workers.append(db)
+
+    def _call(self, method, args, kwargs):
+        db = self._local.db
+        try:
+            return getattr(db, method)(*args, **kwargs)
+        except Exception:
+            self._abandon_transaction(db)
+            raise
+
+    def _timed_call(self, method, args, kwargs):
+        db = self._local.db
+        try:
+            return REGISTRY.timed_call(method, functools.partial(getattr(db, method), *args, **kwargs))
+        except Exception:
+            self._abandon_transaction(db)
+            raise
+
+    @staticmethod
+    def _abandon_transaction(db):
+        # The worker's connection outlives the call: a transaction left open by a
+        # failed method would hold the write lock and be committed by the next write
+        if db.conn.in_transaction:
+            db.conn.rollback()
+
+    async def run(self, method, *args, **kwargs):
+        """Run a Database method by name on a pool worker"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, functools.partial(self._dispatch, method, args, kwargs)
+        )
+
+    def close(self):
+        """Wait for queued queries and close every worker connection.
+
+        The last connection to close checkpoints the WAL, so the database
+        file is complete and the WAL empty once this returns.
+        """
+        self._executor.shutdown(wait=True)
+        with self._workers_lock:
+            for index, db in enumerate(self._workers, 1):
+                db.close(checkpoint=index == len(self._workers))
+            self._workers.clear()
+
+    # Query plan inspection
+    async def explain_query_plan(self, sql, params=()):
+        return await self.run('explain_query_plan', sql, params)
+
+    async def find_table_scans(self, queries=None):
+        return await self.run('find_table_scans', queries)
+
+    # User management methods
+    async def get_user(self, user_id):
+        return await self.run('get_user', user_id)
+
+    async def create_user(self, user_id, username):
+        return await self.run('create_user', user_id, username)
+
+    async def get_quota_state(self, user_id):
+        return await self.run('get_quota_state', user_id)
+
+    async def get_premium_expiries(self):
+        return await self.run('get_premium_expiries')
+
+    async def expire_premium(self, user_ids, cutoff):
+        return await self.run('expire_premium', user_ids, cutoff)
+
+    # Fake email management methods
+    async def create_fake_email(self, user_id, email_address, password):
+        return await self.run('create_fake_email', user_id, email_address, password)
+
+    async def create_fake_emails(self, user_id, addresses):
+        return await self.run('create_fake_emails', user_id, addresses)
+
+    async def get_user_emails(self, user_id):
+        return await self.run('get_user_emails', user_id)
+
+    async def get_email_page(self, user_id, cursor=None, limit=10, newer=False):
+        return await self.run('get_email_page', user_id, cursor, limit, newer)
+
+    async def get_email_count(self, user_id):
+        return await self.run('get_email_count', user_id)
+
+    async def delete_fake_email(self, email_id, user_id):
+        return await self.run('delete_fake_email', email_id, user_id)
+
+    async def get_email_addresses_after(self, after_id, through_id, limit):
+        return await self.run('get_email_addresses_after', after_id, through_id, limit)
+
+    # Address allocator sequence
+    async def get_address_key(self):
+        return await self.run('get_address_key')
+
+    async def get_legacy_address_bound(self):
+        return await self.run('get_legacy_address_bound')
+
+    async def reserve_address_block(self, size):
+        return await self.run('reserve_address_block', size)
+
+    async def get_active_addresses(self):
+        return await self.run('get_active_addresses')
+
+    # Premium code management methods
+    async def create_premium_code(self, code, created_by, duration_days=PREMIUM_CODE_DAYS):
+        return await self.run('create_premium_code', code, created_by, duration_days)
+
+    async def create_premium_codes(self, codes, created_by, duration_days=PREMIUM_CODE_DAYS):
+        return await self.run('create_premium_codes', codes, created_by, duration_days)
+
+    async def redeem_premium_code(self, code, user_id):
+        return await self.run('redeem_premium_code', code, user_id)
+
+    async def get_premium_code(self, code):
+        return await self.run('get_premium_code', code)
+
+    # Inbox management methods
+    async def add_inbox_message(self, email_address, sender, subject, body):
+        return await self.run('add_inbox_message', email_address, sender, subject, body)
+
+    async def add_inbox_messages(self, messages):
+        return await self.run('add_inbox_messages', messages)
+
+    async def get_body_storage_report(self):
+        return await self.run('get_body_storage_report')
+
+    async def get_inbox_messages(self, email_address):
+        return await self.run('get_inbox_messages', email_address)
+
+    async def get_all_user_inbox(self, user_id):
+        return await self.run('get_all_user_inbox', user_id)
+
+    async def get_inbox_page(self, user_id, cursor=None, limit=10, newer=False):
+        return await self.run('get_inbox_page', user_id, cursor, limit, newer)
+
+    async def get_inbox_message(self, message_id, user_id):
+        return await self.run('get_inbox_message', message_id, user_id)
+
+    # Attachment methods
+    async def get_message_attachments(self, message_id):
+        return await self.run('get_message_attachments', message_id)
+
+    async def get_attachment(self, attachment_id, user_id):
+        return await self.run('get_attachment', attachment_id, user_id)
+
+    async def get_referenced_attachments(self, hashes):
+        return await self.run('get_referenced_attachments', hashes)
+
+    # Full-text search methods
+    async def search_inbox(self, user_id, terms, limit=10, offset=0, with_rank=False):
+        return await self.run('search_inbox', user_id, terms, limit, offset, with_rank)
+
+    async def rebuild_search_index(self):
+        return await self.run('rebuild_search_index')
+
+    # Retention methods
+    async def purge_deactivated_messages(self, limit):
+        return await self.run('purge_deactivated_messages', limit)
+
+    async def get_purge_queue(self, limit):
+        return await self.run('get_purge_queue', limit)
+
+    async def delete_address_messages(self, email_address, limit):
+        return await self.run('delete_address_messages', email_address, limit)
+
+    async def dequeue_purge(self, email_address):
+        return await self.run('dequeue_purge', email_address)
+
+    async def delete_expired_messages(self, after, free_cutoff, premium_cutoff, limit):
+        return await self.run('delete_expired_messages', after, free_cutoff, premium_cutoff, limit)
+
+    async def incremental_vacuum(self, max_pages):
+        return await self.run('incremental_vacuum', max_pages)
@@ -0,0 +1,140 @@
+"""Content-addressed files for message attachments.
+
+Attachments are decoded into a temporary file while a message arrives and
+then renamed to <directory>/<sha256[:2]>/<sha256>, so equal attachments are
+stored once however many messages carry them. The database records which
+messages refer to which file; files nothing refers to any more are removed
+by the retention sweeper.
+"""
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from config import ATTACHMENT_SPOOL_DIR, ATTACHMENT_MAX_SIZE, ATTACHMENT_BUFFER_SIZE
+
+class SpoolFile:
+    """An attachment being written; commit() moves it to its content address.
+
+    write() only hashes and buffers in memory, so it is safe to call on the
+    event loop. Once `full`, flush() writes the buffer out on a worker
+    thread; flush(), commit() and discard() are the only methods touching
+    the disk, and they never block the loop. An attachment that fits in the
+    buffer is written once, at commit, or not at all when already stored.
+    """
+
+    def __init__(self, spool, max_size, buffer_size=ATTACHMENT_BUFFER_SIZE):
+        self.spool = spool
+        self.max_size = max_size
+        self.buffer_size = buffer_size
+        self.size = 0
+        self.oversized = False
+        self._digest = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+        self._temp_path = None
+
+    @property
+    def full(self):
+        return len(self._buffer) >= self.buffer_size
+
+    def write(self, data):
+        if self.oversized:
+            return
+        self.size += len(data)
+        if self.size > self.max_size:
+            self.oversized = True
+            self._buffer = bytearray()
+            return
+        self._digest.update(data)
+        self._buffer += data
+
+    async def flush(self):
+        if self._buffer and not self.oversized:
+            data, self._buffer = self._buffer, bytearray()
+            await asyncio.to_thread(self._write_out, data)
+
+    async def commit(self):
+        """Store the file; returns its SHA-256, or None if it was too big"""
+        if self.oversized:
+            await self.discard()
+            return None
+        data, self._buffer = self._buffer, bytearray()
+        digest = self._digest.hexdigest()
+        await asyncio.to_thread(self._store, data, digest)
+        return digest
+
+    async def discard(self):
+        self._buffer = bytearray()
+        if self._file is not None:
+            await asyncio.to_thread(self._remove_temp)
+
+    def _write_out(self, data):
+        if self._file is None:
+            fd, self._temp_path = tempfile.mkstemp(dir=self.spool.temp_dir)
+            self._file = os.fdopen(fd, 'wb')
+        self._file.write(data)
+
+    def _store(self, data, digest):
+        path = self.spool.path_for(digest)
+        if os.path.exists(path):
+            self._remove_temp()
+            # Fresh mtime keeps the garbage collector off it until the message commits
+            os.utime(path)
+            return
+        self._write_out(data)
+        self._file.close()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(self._temp_path, path)
+
+    def _remove_temp(self):
+        if self._file is None:
+            return
+        self._file.close()
+        try:
+            os.unlink(self._temp_path)
+        except FileNotFoundError:
+            pass
+
+class AttachmentSpool:
+    def __init__(self, directory=ATTACHMENT_SPOOL_DIR, max_size=ATTACHMENT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.temp_dir = os.path.join(directory, 'tmp')
+        os.makedirs(self.temp_dir, exist_ok=True)
+
+    def create(self):
+        return SpoolFile(self, self.max_size)
+
+    def path_for(self, digest):
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def read(self, digest):
+        with open(self.path_for(digest), 'rb') as f:
+            return f.read()
+
+    def remove(self, digests):
+        for digest in digests:
+            try:
+                os.unlink(self.path_for(digest))
+            except FileNotFoundError:
+                pass
+
+    def collectable(self, min_age):
+        """Digests of stored files untouched for min_age seconds.
+
+        Temporary files that old were left by an interrupted delivery and
+        are deleted on the way.
+        """
+        cutoff = time.time() - min_age
+        digests = []
+        for entry in os.scandir(self.temp_dir):
+            if entry.stat().st_mtime < cutoff:
+                os.unlink(entry.path)
+        for prefix in os.scandir(self.directory):
+            if not prefix.is_dir() or prefix.path == self.temp_dir:
+                continue
+            for entry in os.scandir(prefix.path):
+                if entry.stat().st_mtime < cutoff:
+                    digests.append(entry.name)
+        return digests
@@ -0,0 +1 @@
+"""Standalone benchmarks; run a module with `python -m benchmarks.<name>`."""
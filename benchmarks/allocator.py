@@ -0,0 +1,62 @@
+"""Allocation rate of AddressAllocator with N addresses already issued.
+
+    python -m benchmarks.allocator --existing 1000000 10000000 --allocations 100000
+
+Existing addresses are random 6-10 letter local parts, like the ones the old
+random generator produced, loaded straight into the membership filter.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import tempfile
+import time
+from async_database import AsyncDatabase
+from address_allocator import AddressAllocator, BloomFilter, FeistelPermutation, ADDRESS_SPACE
+from config import DOMAIN, ADDRESS_FILTER_ERROR_RATE
+
+def random_address():
+    length = random.randint(6, 10)
+    return ''.join(random.choices(string.ascii_lowercase, k=length)) + f'@{DOMAIN}'
+
+async def run(existing, allocations, db):
+    allocator = AddressAllocator(db)
+    started = time.perf_counter()
+    allocator.filter = BloomFilter(max(allocator.filter_capacity, existing), ADDRESS_FILTER_ERROR_RATE)
+    for _ in range(existing):
+        allocator.filter.add(random_address())
+    allocator.permutation = FeistelPermutation(ADDRESS_SPACE, await db.get_address_key())
+    load_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(allocations):
+        await allocator.allocate()
+    seconds = time.perf_counter() - started
+
+    return {
+        'existing': existing,
+        'allocations': allocations,
+        'filter_load_seconds': round(load_seconds, 3),
+        'filter_bytes': len(allocator.filter.array),
+        'allocations_per_second': round(allocations / seconds),
+        'skipped_candidates': allocator.skipped,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--existing', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    parser.add_argument('--allocations', type=int, default=100_000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = AsyncDatabase(os.path.join(directory, 'bench.db'))
+        try:
+            for existing in args.existing:
+                print(json.dumps(await run(existing, args.allocations, db)))
+        finally:
+            db.close()
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,107 @@
+"""Populate a database with synthetic users, addresses, mail and premium codes.
+
+    python -m benchmarks.seed bench.db --users 10000 --addresses 5 --messages 20
+
+--addresses is per user and --messages per address. Words in bodies and
+search terms follow a Zipf distribution over a few thousand words, so
+bodies compress and search like real mail, and a share of them are
+identical newsletters so deduplication is exercised.
+Messages are spread over the last --days days.
+"""
+import argparse
+import itertools
+import json
+import random
+import time
+from database import Database
+from config import DOMAIN
+
+WORDS = (
+    'account verify password invoice order shipping delivery receipt welcome newsletter '
+    'offer discount code confirm security alert login subscription payment update team '
+    'support ticket reset download report weekly summary meeting schedule project review'
+).split()
+SYLLABLES = 'ba ce di fo gu ka le mi no pu ra se ti vo zu'.split()
+# Common words first, then rarer made-up ones; word k is drawn with weight 1/k
+VOCABULARY = WORDS + [a + b + c for a, b, c in itertools.product(SYLLABLES, repeat=3)]
+CUM_WEIGHTS = list(itertools.accumulate(1 / rank for rank in range(1, len(VOCABULARY) + 1)))
+NEWSLETTERS = [
+    ' '.join(random.Random(n).choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=400)) for n in range(20)
+]
+CHUNK = 5000
+
+def user_id_for(n):
+    return 100_000 + n
+
+def address_for(n):
+    return f'seed{n}@{DOMAIN}'
+
+def premium_code_for(n):
+    return f'BENCH{n:08d}'
+
+def random_words(rng, k):
+    return ' '.join(rng.choices(VOCABULARY, cum_weights=CUM_WEIGHTS, k=k))
+
+def random_body(rng):
+    if rng.random() < 0.3:
+        return rng.choice(NEWSLETTERS)
+    return random_words(rng, rng.randint(20, 300))
+
+def seed(path, users, addresses, messages, codes=0, days=7, rng_seed=1):
+    """Fill the database at `path`; returns counts and the seconds it took"""
+    rng = random.Random(rng_seed)
+    started = time.perf_counter()
+    db = Database(path)
+    conn = db.conn
+    try:
+        conn.executemany(
+            'INSERT OR IGNORE INTO users (user_id, username, active_email_count) VALUES (?, ?, ?)',
+            ((user_id_for(n), f'user{n}', addresses) for n in range(users))
+        )
+        conn.executemany(
+            'INSERT INTO fake_emails (user_id, email_address, password) VALUES (?, ?, ?)',
+            ((user_id_for(n // addresses), address_for(n), 'password')
+             for n in range(users * addresses))
+        )
+        conn.executemany(
+            'INSERT INTO premium_codes (code, created_by) VALUES (?, ?)',
+            ((premium_code_for(n), 0) for n in range(codes))
+        )
+        conn.commit()
+
+        total = users * addresses * messages
+        for start in range(0, total, CHUNK):
+            db.add_inbox_messages([
+                (address_for(n // messages), f'sender{rng.randrange(1000)}@example.com',
+                 random_words(rng, 5), random_body(rng))
+                for n in range(start, min(start + CHUNK, total))
+            ])
+        conn.execute(
+            "UPDATE inbox_messages SET received_at = datetime('now', printf('-%d seconds', abs(random()) % ?))",
+            (days * 86400,)
+        )
+        conn.commit()
+    finally:
+        db.close()
+
+    return {
+        'users': users,
+        'addresses': users * addresses,
+        'messages': users * addresses * messages,
+        'premium_codes': codes,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('database')
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--addresses', type=int, default=5, help="per user")
+    parser.add_argument('--messages', type=int, default=20, help="per address")
+    parser.add_argument('--codes', type=int, default=0, help="unused premium codes")
+    parser.add_argument('--days', type=int, default=7)
+    args = parser.parse_args()
+    print(json.dumps(seed(args.database, args.users, args.addresses, args.messages, args.codes, args.days)))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Inbound mail throughput for different inbox shard counts.
+
+    python -m benchmarks.shard_ingest --messages 50000 --shards 0 1 2 4 8
+
+Feeds --messages generated messages through InboxWriter from --senders
+concurrent tasks, each waiting for its message to commit the way an SMTP
+session does, into a fresh database in a temporary directory. Shard count
+0 is the unsharded AsyncDatabase. Prints one JSON line per shard count.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+from async_database import AsyncDatabase
+from benchmarks.seed import address_for, random_body, random_words
+from inbox_writer import InboxWriter, percentile
+from sharded_database import ShardedAsyncDatabase
+
+async def run(shards, messages, senders, addresses):
+    rng = random.Random(1)
+    mail = [(address_for(rng.randrange(addresses)), f'sender{rng.randrange(1000)}@example.com',
+             random_words(rng, 5), random_body(rng)) for _ in range(messages)]
+
+    db = ShardedAsyncDatabase(shard_count=shards, instrument=False) if shards else AsyncDatabase(instrument=False)
+    writer = InboxWriter(db)
+    await writer.start()
+    latencies = []
+    numbers = iter(range(messages))
+
+    async def sender():
+        for n in numbers:
+            started = time.perf_counter()
+            await writer.submit(*mail[n])
+            latencies.append(time.perf_counter() - started)
+
+    try:
+        started = time.perf_counter()
+        await asyncio.gather(*(sender() for _ in range(senders)))
+        seconds = time.perf_counter() - started
+    finally:
+        await writer.stop()
+        db.close()
+
+    return {
+        'shards': shards,
+        'messages': messages,
+        'senders': senders,
+        'messages_per_second': round(messages / seconds, 1),
+        'commit_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'commit_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'batches': writer.batches,
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=20_000)
+    parser.add_argument('--senders', type=int, default=500, help="concurrent SMTP-like submitters")
+    parser.add_argument('--addresses', type=int, default=10_000)
+    parser.add_argument('--shards', type=int, nargs='+', default=[0, 1, 2, 4, 8])
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    for shards in args.shards:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                print(json.dumps(await run(shards, args.messages, args.senders, args.addresses)))
+            finally:
+                os.chdir(cwd)
+
+if __name__ == '__main__':
+    asyncio.run(main())
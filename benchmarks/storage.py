@@ -0,0 +1,139 @@
+"""Storage startup, per-query overhead and shutdown of a FakeMailBot.
+
+    python -m benchmarks.storage --rounds 20 --queries 20000 --concurrency 1 8
+
+Seeds a fresh database in a temporary directory (see benchmarks.seed), then
+--rounds times builds a FakeMailBot, opens every pooled connection and shuts
+it down again, timing each phase. Connections opened and schema setups run
+are counted by wrapping database.connect and Database.create_tables; the
+time spent in them, summed over threads, is reported as storage_setup_ms. Per-query overhead is measured on one bot
+with --queries small indexed reads (quota state, address list, first inbox
+page) issued the way handlers issue them, through bot.db and
+bot.mail_manager.db, from each --concurrency of concurrent tasks.
+Prints one JSON document.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+import database
+from benchmarks.seed import seed, user_id_for
+from benchmarks.stub_api import StubRequest
+from config import DATABASE_NAME
+
+class StorageCounter:
+    """Counts and times connections opened and schema setups run"""
+
+    def __init__(self):
+        self.connections = 0
+        self.schema_setups = 0
+        self.seconds = 0.0
+
+    def wrap(self, function, counter):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - started
+                setattr(self, counter, getattr(self, counter) + 1)
+        return wrapper
+
+    def install(self):
+        database.connect = self.wrap(database.connect, 'connections')
+        database.Database.create_tables = self.wrap(database.Database.create_tables, 'schema_setups')
+
+def storage_handles(bot):
+    """The distinct AsyncDatabase objects the bot and its components use"""
+    return list({id(db): db for db in (bot.db, bot.mail_manager.db)}.values())
+
+async def open_bot():
+    from bot import FakeMailBot
+    from rate_limit import UserRateLimiter
+    bot = FakeMailBot(request=StubRequest(), rate_limiter=UserRateLimiter(budgets={}))
+    # Pool workers connect lazily; make every one of them connect now
+    for db in storage_handles(bot):
+        await asyncio.gather(*(db.get_quota_state(0) for _ in range(db.pool_size * 4)))
+    return bot
+
+async def close_bot(bot):
+    await bot.on_shutdown(bot.application)
+
+async def measure_startup(rounds):
+    counter = StorageCounter()
+    counter.install()
+    startup, shutdown = [], []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        bot = await open_bot()
+        startup.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        await close_bot(bot)
+        shutdown.append(time.perf_counter() - started)
+    wal = DATABASE_NAME + '-wal'
+    return {
+        'startup_ms': round(statistics.median(startup) * 1000, 2),
+        'storage_setup_ms': round(counter.seconds / rounds * 1000, 2),
+        'shutdown_ms': round(statistics.median(shutdown) * 1000, 2),
+        'connections_per_startup': counter.connections / rounds,
+        'schema_setups_per_startup': counter.schema_setups / rounds,
+        'storage_handles': len(storage_handles(bot)),
+        'wal_bytes_after_shutdown': os.path.getsize(wal) if os.path.exists(wal) else 0,
+    }
+
+async def measure_queries(bot, queries, concurrency, users):
+    rng = random.Random(1)
+    user_ids = [user_id_for(rng.randrange(users)) for _ in range(queries)]
+    numbers = iter(range(queries))
+
+    async def worker():
+        for n in numbers:
+            user_id = user_ids[n]
+            if n % 3 == 0:
+                await bot.db.get_quota_state(user_id)
+            elif n % 3 == 1:
+                await bot.mail_manager.db.get_user_emails(user_id)
+            else:
+                await bot.db.get_inbox_page(user_id)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    return {
+        'concurrency': concurrency,
+        'queries_per_second': round(queries / seconds),
+        'microseconds_per_query': round(seconds / queries * 1e6, 1),
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--queries', type=int, default=20_000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8])
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            seed(DATABASE_NAME, args.users, 3, 5)
+            result = await measure_startup(args.rounds)
+            bot = await open_bot()
+            try:
+                result['queries'] = [await measure_queries(bot, args.queries, concurrency, args.users)
+                                     for concurrency in args.concurrency]
+            finally:
+                await close_bot(bot)
+        finally:
+            os.chdir(cwd)
+    print(json.dumps(result, indent=2))
+
+if __name__ == '__main__':
+    asyncio.run(main())
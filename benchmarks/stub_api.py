@@ -0,0 +1,111 @@
+"""In-process stand-in for the Telegram Bot API, plus synthetic updates.
+
+StubRequest plugs into Application.builder().request() and answers the API
+methods the bot calls with canned results, so handlers run end to end
+without network access. Callers can wait for the next reply sent to a chat
+to measure how long an update took to handle.
+"""
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+from telegram.request import BaseRequest
+
+BOT_USER = {
+    'id': 1, 'is_bot': True, 'first_name': 'Fake Mail Bot', 'username': 'fake_mail_bot',
+    'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': False,
+}
+
+def user_json(user_id):
+    return {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}', 'username': f'user{user_id}'}
+
+def chat_json(chat_id):
+    return {'id': chat_id, 'type': 'private'}
+
+def message_json(message_id, user_id, text, from_bot=False):
+    message = {
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': chat_json(user_id),
+        'from': BOT_USER if from_bot else user_json(user_id),
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return message
+
+def command_update(update_id, user_id, text):
+    """An Update for a private-chat message such as "/start" or "/redeem CODE" """
+    return {'update_id': update_id, 'message': message_json(update_id, user_id, text)}
+
+def callback_update(update_id, user_id, data, message_id=1):
+    """An Update for a click on an inline button carrying callback `data`"""
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            # Starts with the chat, so StubRequest can tell who an answer is for
+            'id': f'{user_id}:{update_id}',
+            'from': user_json(user_id),
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': message_json(message_id, user_id, '🤖 Fake Mail Bot', from_bot=True),
+        },
+    }
+
+class StubRequest(BaseRequest):
+    """Answers Bot API calls locally after `latency` seconds.
+
+    Messages sent or edited count as replies to their chat, and so does an
+    answerCallbackQuery carrying text, which is all a throttled click gets.
+    """
+
+    REPLY_METHODS = ('sendMessage', 'editMessageText', 'sendDocument')
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1000)
+        self._waiters = {}  # chat_id -> futures resolved by the next reply to that chat
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    def expect_reply(self, chat_id):
+        """Future resolved with the method name of the next reply sent to chat_id"""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append(future)
+        return future
+
+    def _resolve(self, chat_id, api_method):
+        for future in self._waiters.pop(chat_id, ()):
+            if not future.done():
+                future.set_result(api_method)
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        self.calls[api_method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        parameters = request_data.parameters if request_data else {}
+
+        if api_method == 'getMe':
+            result = BOT_USER
+        elif api_method in self.REPLY_METHODS:
+            chat_id = int(parameters.get('chat_id', 0))
+            result = message_json(next(self._message_ids), chat_id, parameters.get('text', ''), from_bot=True)
+            self._resolve(chat_id, api_method)
+        elif api_method == 'answerCallbackQuery' and parameters.get('text'):
+            # A click answered only with a notice, e.g. when rate limited
+            self._resolve(int(parameters['callback_query_id'].split(':')[0]), api_method)
+            result = True
+        else:
+            # answerCallbackQuery, setWebhook, deleteWebhook, ...
+            result = True
+
+        return 200, json.dumps({'ok': True, 'result': result}).encode('utf-8')
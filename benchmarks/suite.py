@@ -0,0 +1,209 @@
+"""Throughput and latency of bot handlers and storage, checked against a baseline.
+
+    python -m benchmarks.suite                                  # compare with benchmarks/baseline.json
+    python -m benchmarks.suite --save-baseline benchmarks/baseline.json
+    python -m benchmarks.suite --only handler. --ops 5000 --concurrency 8
+
+Seeds a fresh database in a temporary directory (see benchmarks.seed), then
+runs every scenario --ops times from --concurrency concurrent tasks:
+
+- handler.*: FakeMailBot handlers called with synthetic Update and
+  CallbackQuery objects; Bot API calls go to StubRequest. Per-user rate
+  limits are off, so every call runs the handler itself
+- database.*, mail_manager.*: AsyncDatabase and MailManager called directly
+
+Prints one JSON document with ops/s and p50/p95/p99 latency per scenario.
+With a baseline, a scenario regresses when its ops/s falls or its p99
+rises by more than --tolerance, and the exit status is 1. Baselines are
+machine specific; regenerate one on the machine that runs the comparison.
+INFO logging is switched off while measuring.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from telegram import Update
+from telegram.ext import CallbackContext
+from benchmarks.seed import seed, user_id_for, premium_code_for, random_words
+from benchmarks.stub_api import StubRequest, command_update, callback_update
+from inbox_writer import percentile
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+class Suite:
+    """Scenarios as async callables taking the operation number"""
+
+    def __init__(self, bot, users, rng):
+        self.bot = bot
+        self.application = bot.application
+        self.users = users
+        self.rng = rng
+        self.update_ids = itertools.count(1)
+        self.scenarios = {
+            'handler.start': self.start,
+            'handler.create_mail': self.button('create_mail'),
+            'handler.check_inbox': self.button('check_inbox'),
+            'handler.show_stats': self.button('show_stats'),
+            'handler.redeem_premium': self.redeem_premium,
+            'database.get_inbox_page': self.get_inbox_page,
+            'database.search_inbox': self.search_inbox,
+            'database.get_user_emails': self.get_user_emails,
+            'database.add_inbox_message': self.add_inbox_message,
+            'mail_manager.create_fake_email': self.create_fake_email,
+            'mail_manager.get_user_stats': self.get_user_stats,
+        }
+
+    def user(self, n):
+        return user_id_for(n % self.users)
+
+    def command(self, user_id, text):
+        update = Update.de_json(command_update(next(self.update_ids), user_id, text), self.application.bot)
+        context = CallbackContext.from_update(update, self.application)
+        context.args = text.split()[1:]
+        return update, context
+
+    def callback(self, user_id, data):
+        update = Update.de_json(callback_update(next(self.update_ids), user_id, data), self.application.bot)
+        return update, CallbackContext.from_update(update, self.application)
+
+    async def start(self, n):
+        await self.bot.start(*self.command(self.user(n), '/start'))
+
+    def button(self, data):
+        async def press(n):
+            await self.bot.button_handler(*self.callback(self.user(n), data))
+        return press
+
+    async def redeem_premium(self, n):
+        # Every operation redeems its own seeded code
+        await self.bot.redeem_premium(*self.command(self.user(n), f'/redeem {premium_code_for(n)}'))
+
+    async def get_inbox_page(self, n):
+        await self.bot.db.get_inbox_page(self.user(n))
+
+    async def search_inbox(self, n):
+        await self.bot.db.search_inbox(self.user(n), random_words(self.rng, 2))
+
+    async def get_user_emails(self, n):
+        await self.bot.db.get_user_emails(self.user(n))
+
+    async def add_inbox_message(self, n):
+        await self.bot.db.add_inbox_message(
+            f'seed{n % self.users}@bench.invalid', 'sender@example.com', 'Benchmark', random_words(self.rng, 50)
+        )
+
+    async def create_fake_email(self, n):
+        await self.bot.mail_manager.create_fake_email(self.user(n))
+
+    async def get_user_stats(self, n):
+        await self.bot.mail_manager.get_user_stats(self.user(n))
+
+async def measure(operation, ops, concurrency):
+    latencies = []
+    numbers = iter(range(ops))
+
+    async def worker():
+        for n in numbers:
+            started = time.perf_counter()
+            await operation(n)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - started
+    return {
+        'ops': ops,
+        'ops_per_second': round(ops / seconds, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+def compare(results, baseline, tolerance):
+    """Scenarios whose throughput fell or p99 rose by more than tolerance"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        if result['ops_per_second'] < base['ops_per_second'] * (1 - tolerance):
+            regressions.append({'scenario': name, 'metric': 'ops_per_second',
+                                'baseline': base['ops_per_second'], 'current': result['ops_per_second']})
+        if result['p99_ms'] > base['p99_ms'] * (1 + tolerance):
+            regressions.append({'scenario': name, 'metric': 'p99_ms',
+                                'baseline': base['p99_ms'], 'current': result['p99_ms']})
+    return regressions
+
+async def run(args):
+    settings = {
+        'users': args.users, 'addresses': args.addresses, 'messages': args.messages,
+        'ops': args.ops, 'concurrency': args.concurrency,
+    }
+    seeded = seed('fake_mail_bot.db', args.users, args.addresses, args.messages, codes=args.ops)
+
+    # Imported here so bot.log lands in the working directory
+    from bot import FakeMailBot
+    from rate_limit import UserRateLimiter
+    logging.disable(logging.INFO)
+
+    bot = FakeMailBot(request=StubRequest(), rate_limiter=UserRateLimiter(budgets={}))
+    await bot.application.initialize()
+    await bot.mail_manager.allocator.load()
+    suite = Suite(bot, args.users, random.Random(1))
+    results = {}
+    try:
+        for name, operation in suite.scenarios.items():
+            if args.only and not any(name.startswith(prefix) for prefix in args.only):
+                continue
+            results[name] = await measure(operation, args.ops, args.concurrency)
+    finally:
+        await bot.on_shutdown(bot.application)
+        await bot.application.shutdown()
+    return {'settings': settings, 'seed_seconds': seeded['seconds'], 'results': results}
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--addresses', type=int, default=5, help="seeded per user")
+    parser.add_argument('--messages', type=int, default=20, help="seeded per address")
+    parser.add_argument('--ops', type=int, default=2000, help="operations per scenario")
+    parser.add_argument('--concurrency', type=int, default=1)
+    parser.add_argument('--only', nargs='+', help="scenario name prefixes to run")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--save-baseline', metavar='PATH')
+    args = parser.parse_args()
+    for name in ('baseline', 'save_baseline'):
+        if getattr(args, name):
+            setattr(args, name, os.path.abspath(getattr(args, name)))
+
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        try:
+            report = await run(args)
+        finally:
+            os.chdir(cwd)
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+            f.write('\n')
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['baseline_settings_match'] = baseline['settings'] == report['settings']
+        report['regressions'] = compare(report['results'], baseline['results'], args.tolerance)
+
+    print(json.dumps(report, indent=2))
+    if report.get('regressions'):
+        sys.exit(1)
+
+if __name__ == '__main__':
+    asyncio.run(main())
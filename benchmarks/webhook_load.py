@@ -0,0 +1,147 @@
+"""Webhook throughput and latency under concurrent users.
+
+    python -m benchmarks.webhook_load --users 200 --duration 20 --concurrency 1 64
+
+Runs the real bot (handlers, database, allocator) against a fresh database
+in a temporary directory, with the Bot API replaced by StubRequest. Each
+virtual user POSTs a synthetic update to the webhook, waits for the bot's
+reply to its chat, then sends the next one: /start, then a cycle of
+Create Fake Mail, Check Inbox and Statistics clicks. Latency is measured
+from the POST until the reply reaches the stub API.
+
+Per-user rate limits are off unless --rate-limited is given; with them on,
+a throttled click's answerCallbackQuery notice counts as its reply.
+
+Each virtual user keeps one raw keep-alive HTTP/1.1 connection; a pooled
+HTTP client costs more CPU per request than the bot itself and would end
+up measuring the load generator.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import tempfile
+import time
+from benchmarks.stub_api import StubRequest, command_update, callback_update
+from inbox_writer import percentile
+
+ACTIONS = ('create_mail', 'check_inbox', 'show_stats')
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+async def post_json(reader, writer, port, path, payload):
+    body = json.dumps(payload).encode('utf-8')
+    writer.write(
+        f'POST /{path} HTTP/1.1\r\nHost: 127.0.0.1:{port}\r\n'
+        f'Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n'.encode('ascii') + body
+    )
+    status = await reader.readline()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    if length:
+        await reader.readexactly(length)
+    return int(status.split()[1])
+
+async def virtual_user(port, path, stub, user_id, update_ids, deadline, latencies, timeouts):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        for action in itertools.chain([None], itertools.cycle(ACTIONS)):
+            if time.perf_counter() >= deadline:
+                return
+            update_id = next(update_ids)
+            if action is None:
+                update = command_update(update_id, user_id, '/start')
+            else:
+                update = callback_update(update_id, user_id, action)
+            reply = stub.expect_reply(user_id)
+            started = time.perf_counter()
+            await post_json(reader, writer, port, path, update)
+            try:
+                await asyncio.wait_for(reply, 30)
+            except asyncio.TimeoutError:
+                timeouts.append(update_id)
+                continue
+            latencies.append(time.perf_counter() - started)
+    finally:
+        writer.close()
+
+async def run(users, duration, concurrency, api_latency, rate_limited=False):
+    # Imported here so bot.log and the database land in the working directory
+    from bot import FakeMailBot
+    from config import WEBHOOK_PATH
+    from rate_limit import UserRateLimiter
+
+    stub = StubRequest(latency=api_latency)
+    rate_limiter = None if rate_limited else UserRateLimiter(budgets={})
+    bot = FakeMailBot(request=stub, concurrent_updates=concurrency, rate_limiter=rate_limiter)
+    application = bot.application
+    port = free_port()
+    await application.initialize()
+    await bot.mail_manager.allocator.load()
+    await application.start()
+    await application.updater.start_webhook(listen='127.0.0.1', port=port, url_path=WEBHOOK_PATH)
+
+    latencies, timeouts = [], []
+    update_ids = itertools.count(1)
+    try:
+        started = time.perf_counter()
+        deadline = started + duration
+        await asyncio.gather(*(
+            virtual_user(port, WEBHOOK_PATH, stub, 10_000 + n, update_ids, deadline, latencies, timeouts)
+            for n in range(users)
+        ))
+        seconds = time.perf_counter() - started
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await bot.on_shutdown(application)
+        await application.shutdown()
+
+    return {
+        'users': users,
+        'concurrency': concurrency,
+        'api_latency_ms': api_latency * 1000,
+        'rate_limited': rate_limited,
+        'updates': len(latencies),
+        'timeouts': len(timeouts),
+        'updates_per_second': round(len(latencies) / seconds, 1),
+        'latency_p50_ms': round(percentile(latencies, 0.50) * 1000, 2),
+        'latency_p99_ms': round(percentile(latencies, 0.99) * 1000, 2),
+        'api_calls': dict(stub.calls),
+    }
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds per run")
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 64],
+                        help="max concurrent updates; 1 matches sequential processing")
+    parser.add_argument('--api-latency', type=float, default=0.05,
+                        help="simulated Bot API round trip in seconds")
+    parser.add_argument('--rate-limited', action='store_true', help="apply the configured RATE_LIMITS")
+    args = parser.parse_args()
+
+    cwd = os.getcwd()
+    for concurrency in args.concurrency:
+        with tempfile.TemporaryDirectory() as directory:
+            os.chdir(directory)
+            try:
+                print(json.dumps(await run(
+                    args.users, args.duration, concurrency, args.api_latency, args.rate_limited
+                )))
+            finally:
+                os.chdir(cwd)
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,74 @@
+"""Compressed, content-addressed storage format for message bodies.
+
+Bodies are stored once per distinct content in message_bodies, keyed by
+the SHA-256 of their UTF-8 text, and compressed with a pluggable codec.
+Each row records its codec name, so the default can change at any time
+without rewriting existing rows.
+"""
+import hashlib
+import zlib
+from config import BODY_CODEC, BODY_COMPRESS_MIN_SIZE
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+class IdentityCodec:
+    name = 'none'
+
+    def compress(self, data):
+        return data
+
+    def decompress(self, data):
+        return data
+
+class ZlibCodec:
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.level = level
+
+    def compress(self, data):
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data):
+        return zlib.decompress(data)
+
+class ZstdCodec:
+    name = 'zstd'
+
+    def __init__(self, level=3):
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.decompressor = zstandard.ZstdDecompressor()
+
+    def compress(self, data):
+        return self.compressor.compress(data)
+
+    def decompress(self, data):
+        return self.decompressor.decompress(data)
+
+CODECS = {codec.name: codec for codec in (IdentityCodec(), ZlibCodec())}
+if zstandard is not None:
+    CODECS[ZstdCodec.name] = ZstdCodec()
+
+def register_codec(codec):
+    CODECS[codec.name] = codec
+
+def encode_body(body, codec=BODY_CODEC):
+    """Return (hash, codec name, stored bytes, raw size) for a body string"""
+    raw = (body or '').encode('utf-8')
+    digest = hashlib.sha256(raw).hexdigest()
+    if len(raw) < BODY_COMPRESS_MIN_SIZE:
+        codec = IdentityCodec.name
+    data = CODECS[codec].compress(raw)
+    # Keep whichever is smaller; incompressible bodies are stored as-is
+    if len(data) >= len(raw):
+        codec, data = IdentityCodec.name, raw
+    return digest, codec, data, len(raw)
+
+def decode_body(codec, data):
+    """Inverse of encode_body; also registered as the body_text() SQL function"""
+    if data is None:
+        return None
+    return CODECS[codec].decompress(data).decode('utf-8')
@@ -1,10 +1,31 @@
+import argparse
+import asyncio
+import functools
+import io
 import logging
+import math
 import sys
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
-from database import Database
+from telegram.helpers import escape_markdown
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
+from async_database import AsyncDatabase
+from attachment_spool import AttachmentSpool
+from sharded_database import ShardedAsyncDatabase
 from mail_manager import MailManager
-from config import BOT_TOKEN, ADMIN_IDS
+from inbox_writer import InboxWriter
+from smtp_server import MailServer
+from retention import RetentionSweeper
+from premium_expiry import PremiumExpiryScheduler
+from rate_limit import UserRateLimiter
+from notifications import NotificationDispatcher
+from update_processor import PerUserUpdateProcessor
+from metrics import REGISTRY, MetricsServer
+from config import (
+    BOT_TOKEN, ADMIN_IDS, FREE_USER_MAIL_LIMIT, PREMIUM_USER_MAIL_LIMIT, SMTP_ENABLED,
+    INBOX_PAGE_SIZE, ADDRESS_PAGE_SIZE, MESSAGE_BODY_PREVIEW, FREE_RETENTION_DAYS, PREMIUM_RETENTION_DAYS, NOTIFY_ENABLED,
+    BOT_MODE, MAX_CONCURRENT_UPDATES, WEBHOOK_URL, WEBHOOK_LISTEN, WEBHOOK_PATH, WEBHOOK_SECRET_TOKEN, PORT,
+    METRICS_ENABLED, INBOX_SHARDS, PREMIUM_CODE_DAYS, PREMIUM_CODE_MAX_DAYS, PREMIUM_CODE_BATCH_MAX
+)
 
 # Set up logging
 logging.basicConfig(
@@ -18,40 +39,125 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+def parse_days(args):
+    """Optional premium duration argument; None when it is not a valid number of days"""
+    if not args:
+        return PREMIUM_CODE_DAYS
+    if not args[0].isdigit() or not 1 <= int(args[0]) <= PREMIUM_CODE_MAX_DAYS:
+        return None
+    return int(args[0])
+
+# Rate-limited action of each button, by callback_data prefix; static screens are free
+CALLBACK_ACTIONS = {
+    'create_mail': 'create_mail',
+    'del': 'delete_mail',
+    'check_inbox': 'check_inbox',
+    'inbox': 'check_inbox',
+    'msg': 'check_inbox',
+    'att': 'download',
+    'search': 'search',
+    'addr': 'browse',
+    'show_stats': 'browse',
+}
+
+def throttle_notice(wait):
+    return f"⏳ Too many requests. Try again in {math.ceil(wait)}s."
+
+def format_size(size):
+    if size < 1024:
+        return f"{size} B"
+    if size < 1024 * 1024:
+        return f"{size / 1024:.1f} KB"
+    return f"{size / (1024 * 1024):.1f} MB"
+
 class FakeMailBot:
-    def __init__(self):
+    def __init__(self, request=None, concurrent_updates=MAX_CONCURRENT_UPDATES, rate_limiter=None):
         try:
-            self.db = Database()
-            self.mail_manager = MailManager()
-            self.application = Application.builder().token(BOT_TOKEN).build()
+            self.db = ShardedAsyncDatabase() if INBOX_SHARDS else AsyncDatabase()
+            self.recipients = {}
+            self.mail_manager = MailManager(self.db, recipients=self.recipients)
+            self.inbox_writer = InboxWriter(self.db, on_commit=self.notify_new_mail)
+            self.attachment_spool = AttachmentSpool()
+            self.mail_server = MailServer(self.db, self.inbox_writer, self.recipients, self.attachment_spool)
+            self.retention_sweeper = RetentionSweeper(self.db, self.attachment_spool)
+            self.premium_expiry = PremiumExpiryScheduler(self.db, on_expired=self.premium_expired)
+            # Load tests pass a relaxed one, e.g. UserRateLimiter(budgets={}) for none at all
+            self.rate_limiter = rate_limiter if rate_limiter is not None else UserRateLimiter()
+            self._background_tasks = set()
+            builder = (
+                Application.builder()
+                .token(BOT_TOKEN)
+                .concurrent_updates(PerUserUpdateProcessor(concurrent_updates))
+                .post_init(self.on_startup)
+                .post_shutdown(self.on_shutdown)
+            )
+            if request is not None:
+                # Alternative transport for the Bot API, e.g. a stub in load tests
+                builder = builder.request(request)
+            self.application = builder.build()
+            self.notifications = NotificationDispatcher(self.application.bot)
+            self.metrics_server = MetricsServer() if METRICS_ENABLED else None
+            if METRICS_ENABLED:
+                REGISTRY.register_collector('inbox_writer', self.inbox_writer.metrics)
+                REGISTRY.register_collector('notifications', self.notifications.metrics)
+                REGISTRY.register_collector('retention', lambda: self.retention_sweeper.last_cycle)
+                REGISTRY.register_collector('premium_expiry', self.premium_expiry.metrics)
+                REGISTRY.register_collector('rate_limit', self.rate_limiter.metrics)
+                REGISTRY.register_collector('quota_cache', lambda: {'entries': len(self.mail_manager.quota_cache)})
             self.setup_handlers()
             logger.info("FakeMailBot initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize bot: {e}")
             raise
 
+    def instrumented(self, callback, label_of=None):
+        """Wrap a handler callback with latency and error metrics when enabled"""
+        if not METRICS_ENABLED:
+            return callback
+        return REGISTRY.instrument_handler(callback.__name__, callback, label_of)
+
+    def check_rate_limit(self, user_id, action):
+        """0 if the user may go ahead, else seconds to wait; never queries the database"""
+        # Premium users whose quota is not cached get the free budget until it is
+        quota = self.mail_manager.quota_cache.get(user_id)
+        return self.rate_limiter.check(user_id, action, premium=quota is not None and quota.is_premium)
+
+    def rate_limited(self, callback, action):
+        """Wrap a command callback so it only runs within the user's budget for action"""
+        @functools.wraps(callback)
+        async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            wait = self.check_rate_limit(update.effective_user.id, action)
+            if not wait:
+                return await callback(update, context)
+            try:
+                await update.message.reply_text(throttle_notice(wait))
+            except Exception as e:
+                logger.error(f"Error replying to throttled {callback.__name__}: {e}")
+        return wrapper
+
     def setup_handlers(self):
-        # Command handlers
-        self.application.add_handler(CommandHandler("start", self.start))
-        self.application.add_handler(CommandHandler("id", self.show_id))
-        self.application.add_handler(CommandHandler("create", self.create_premium_code))
-        self.application.add_handler(CommandHandler("redeem", self.redeem_premium))
-        self.application.add_handler(CommandHandler("stats", self.show_stats))
-        self.application.add_handler(CommandHandler("inbox", self.show_inbox))
-        self.application.add_handler(CommandHandler("help", self.help_command))
-        
-        # Message handlers for delete commands
-        self.application.add_handler(MessageHandler(
-            filters.Regex(r'^/delete_\d+$'), self.delete_email
-        ))
+        # Command handlers; admin-only commands and static text are not rate limited
+        self.application.add_handler(CommandHandler("start", self.instrumented(self.rate_limited(self.start, 'browse'))))
+        self.application.add_handler(CommandHandler("id", self.instrumented(self.rate_limited(self.show_id, 'browse'))))
+        self.application.add_handler(CommandHandler("create", self.instrumented(self.create_premium_code)))
+        self.application.add_handler(CommandHandler("create_batch", self.instrumented(self.create_premium_batch)))
+        self.application.add_handler(CommandHandler("redeem", self.instrumented(self.rate_limited(self.redeem_premium, 'redeem'))))
+        self.application.add_handler(CommandHandler("bulk", self.instrumented(self.rate_limited(self.bulk_create, 'bulk'))))
+        self.application.add_handler(CommandHandler("stats", self.instrumented(self.rate_limited(self.show_stats, 'browse'))))
+        self.application.add_handler(CommandHandler("inbox", self.instrumented(self.rate_limited(self.show_inbox, 'check_inbox'))))
+        self.application.add_handler(CommandHandler("search", self.instrumented(self.rate_limited(self.search_inbox, 'search'))))
+        self.application.add_handler(CommandHandler("help", self.instrumented(self.help_command)))
         
-        # Callback query handlers
-        self.application.add_handler(CallbackQueryHandler(self.button_handler))
+        # Callback query handlers, labelled by button action (e.g. "button_handler:create_mail")
+        self.application.add_handler(CallbackQueryHandler(self.instrumented(
+            self.button_handler,
+            lambda update: f"button_handler:{(update.callback_query.data or '').split('|')[0]}"
+        )))
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             user = update.effective_user
-            self.db.create_user(user.id, user.username)
+            await self.db.create_user(user.id, user.username)
             
             welcome_text = """
 🤖 **Welcome to Fake Mail Bot!**
@@ -63,6 +169,7 @@ class FakeMailBot:
 **Commands:**
 /id - Show your fake emails
 /inbox - Check all inbox messages
+/search - Search your messages
 /stats - Show your statistics
 /redeem - Redeem premium code
 /help - Show help message
@@ -76,6 +183,7 @@ class FakeMailBot:
             
             keyboard = [
                 [InlineKeyboardButton("📧 Create Fake Mail", callback_data="create_mail")],
+                [InlineKeyboardButton("📋 My Emails", callback_data="addr")],
                 [InlineKeyboardButton("📨 Check Inbox", callback_data="check_inbox")],
                 [InlineKeyboardButton("📊 Statistics", callback_data="show_stats")],
                 [InlineKeyboardButton("💎 Premium Info", callback_data="premium_info")],
@@ -98,12 +206,14 @@ class FakeMailBot:
 /start - Start the bot
 /id - List your fake emails
 /inbox - Check received messages
+/search <terms> - Search received messages
+/bulk <n> - Create n emails at once (sent as a file)
 /stats - Show your account statistics
 /redeem <code> - Redeem premium code
 
 **Email Management:**
 • Use buttons below to create new emails
-• Click on delete links to remove emails
+• Use 🗑 buttons under /id to remove emails
 • All emails use @wizard.com domain
 
 **Premium Features:**
@@ -116,6 +226,34 @@ Contact admin for support with premium codes or issues.
         """
         await update.message.reply_text(help_text, parse_mode='Markdown')
 
+    async def bulk_create(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            user_id = update.effective_user.id
+            
+            if not context.args or not context.args[0].isdigit() or not 1 <= int(context.args[0]) <= PREMIUM_USER_MAIL_LIMIT:
+                await update.message.reply_text(
+                    f"Usage: /bulk <count>\nExample: /bulk 50 (1-{PREMIUM_USER_MAIL_LIMIT})"
+                )
+                return
+            
+            count = int(context.args[0])
+            created, error = await self.mail_manager.create_fake_emails(user_id, count)
+            if not created:
+                await update.message.reply_text(f"❌ {error}")
+                return
+            
+            document = io.BytesIO("".join(f"{email}:{password}\n" for email, password in created).encode('utf-8'))
+            await update.message.reply_document(
+                document=document,
+                filename=f"fake_emails_{count}.txt",
+                caption=f"✅ Created {count} fake emails (email:password per line)."
+            )
+            logger.info(f"User {user_id} bulk created {count} emails")
+            
+        except Exception as e:
+            logger.error(f"Error in bulk_create: {e}")
+            await update.message.reply_text("❌ An error occurred while creating emails.")
+
     async def create_premium_code(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             user_id = update.effective_user.id
@@ -124,8 +262,12 @@ Contact admin for support with premium codes or issues.
                 await update.message.reply_text("❌ This command is for admins only.")
                 return
             
-            if not context.args:
-                await update.message.reply_text("Usage: /create <premium_code>\nExample: /create WIZARD123")
+            days = parse_days(context.args[1:])
+            if not context.args or days is None:
+                await update.message.reply_text(
+                    f"Usage: /create <premium_code> [days]\nExample: /create WIZARD123 "
+                    f"(default {PREMIUM_CODE_DAYS} days, at most {PREMIUM_CODE_MAX_DAYS})"
+                )
                 return
             
             code = context.args[0].upper()
@@ -133,15 +275,16 @@ Contact admin for support with premium codes or issues.
                 await update.message.reply_text("❌ Premium code must be at least 4 characters long.")
                 return
             
-            if self.db.create_premium_code(code, user_id):
+            if await self.db.create_premium_code(code, user_id, days):
                 await update.message.reply_text(
                     f"✅ Premium code created successfully!\n\n"
                     f"**Code:** `{code}`\n"
+                    f"**Grants:** {days} days\n"
                     f"**Usage:** `/redeem {code}`\n\n"
                     f"Share this code with users to grant premium access.", 
                     parse_mode='Markdown'
                 )
-                logger.info(f"Admin {user_id} created premium code: {code}")
+                logger.info(f"Admin {user_id} created premium code: {code} ({days} days)")
             else:
                 await update.message.reply_text("❌ Failed to create premium code. It might already exist.")
                 
@@ -149,6 +292,41 @@ Contact admin for support with premium codes or issues.
             logger.error(f"Error in create_premium_code: {e}")
             await update.message.reply_text("❌ An error occurred while creating premium code.")
 
+    async def create_premium_batch(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            user_id = update.effective_user.id
+
+            if user_id not in ADMIN_IDS:
+                await update.message.reply_text("❌ This command is for admins only.")
+                return
+
+            days = parse_days(context.args[1:])
+            if (not context.args or not context.args[0].isdigit()
+                    or not 1 <= int(context.args[0]) <= PREMIUM_CODE_BATCH_MAX or days is None):
+                await update.message.reply_text(
+                    f"Usage: /create_batch <count> [days]\nExample: /create_batch 1000 90 "
+                    f"(1-{PREMIUM_CODE_BATCH_MAX} codes, default {PREMIUM_CODE_DAYS} days)"
+                )
+                return
+
+            count = int(context.args[0])
+            codes = await self.mail_manager.create_premium_codes(user_id, count, days)
+            if not codes:
+                await update.message.reply_text("❌ Failed to create premium codes. Please try again.")
+                return
+
+            document = io.BytesIO("".join(f"{code}\n" for code in codes).encode('utf-8'))
+            await update.message.reply_document(
+                document=document,
+                filename=f"premium_codes_{count}x{days}d.txt",
+                caption=f"✅ Created {count} premium codes, {days} days each (one per line)."
+            )
+            logger.info(f"Admin {user_id} created {count} premium codes ({days} days)")
+
+        except Exception as e:
+            logger.error(f"Error in create_premium_batch: {e}")
+            await update.message.reply_text("❌ An error occurred while creating premium codes.")
+
     async def redeem_premium(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             user_id = update.effective_user.id
@@ -158,47 +336,279 @@ Contact admin for support with premium codes or issues.
                 return
             
             code = context.args[0].upper()
-            premium_code = self.db.get_premium_code(code)
-            
-            if not premium_code:
-                await update.message.reply_text("❌ Invalid premium code.")
-                return
+            redeemed = await self.mail_manager.redeem_premium_code(user_id, code)
             
-            if premium_code[2]:  # Check if already used
-                await update.message.reply_text("❌ This premium code has already been used.")
+            if not redeemed:
+                # Only failures pay for a second lookup to explain themselves
+                if await self.db.get_premium_code(code):
+                    await update.message.reply_text("❌ This premium code has already been used.")
+                else:
+                    await update.message.reply_text("❌ Invalid premium code.")
                 return
             
-            if self.db.use_premium_code(code, user_id):
-                self.db.update_user_premium(user_id, True, 30)  # 30 days premium
-                await update.message.reply_text(
-                    "🎉 **Premium activated successfully!**\n\n"
-                    "✨ **You now have:**\n"
-                    "• 30 days of premium access\n"
-                    "• 500 email limit (instead of 100)\n"
-                    "• Priority processing\n\n"
-                    "Thank you for upgrading!",
-                    parse_mode='Markdown'
-                )
-                logger.info(f"User {user_id} redeemed premium code: {code}")
-            else:
-                await update.message.reply_text("❌ Failed to redeem premium code.")
+            days, expiry = redeemed
+            self.premium_expiry.schedule(user_id, expiry.timestamp())
+            await update.message.reply_text(
+                "🎉 **Premium activated successfully!**\n\n"
+                "✨ **You now have:**\n"
+                f"• {days} days of premium access (until {expiry:%Y-%m-%d})\n"
+                f"• {PREMIUM_USER_MAIL_LIMIT} email limit (instead of {FREE_USER_MAIL_LIMIT})\n"
+                "• Priority processing\n\n"
+                "Thank you for upgrading!",
+                parse_mode='Markdown'
+            )
+            logger.info(f"User {user_id} redeemed premium code: {code}")
                 
         except Exception as e:
             logger.error(f"Error in redeem_premium: {e}")
             await update.message.reply_text("❌ An error occurred while redeeming premium code.")
 
-    # ... (other methods remain the same as previous version)
+    async def show_id(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            address_text, reply_markup = await self.render_address_page(update.effective_user.id)
+            await update.message.reply_text(address_text, parse_mode='Markdown', reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Error in show_id: {e}")
+            await update.message.reply_text("❌ An error occurred. Please try again.")
+
+    async def render_address_page(self, user_id, cursor=None, newer=False):
+        """Render one keyset page of addresses with delete and navigation buttons"""
+        page = self.mail_manager.address_pages.get(user_id, (cursor, newer))
+        if page is None:
+            page = await self._render_address_page(user_id, cursor, newer)
+            self.mail_manager.address_pages.put(user_id, (cursor, newer), page)
+        return page
+
+    async def _render_address_page(self, user_id, cursor, newer):
+        # One extra row tells us whether another page exists in that direction
+        emails = await self.mail_manager.get_address_page(user_id, cursor, ADDRESS_PAGE_SIZE + 1, newer)
+        if newer:
+            has_newer, has_older = len(emails) > ADDRESS_PAGE_SIZE, True
+            emails = emails[-ADDRESS_PAGE_SIZE:]
+        else:
+            has_newer, has_older = cursor is not None, len(emails) > ADDRESS_PAGE_SIZE
+            emails = emails[:ADDRESS_PAGE_SIZE]
+
+        if not emails:
+            if cursor is not None:
+                return await self._render_address_page(user_id, None, False)
+            keyboard = [[InlineKeyboardButton("📧 Create Fake Mail", callback_data="create_mail")]]
+            return "📭 **No fake emails created yet.**", InlineKeyboardMarkup(keyboard)
+
+        quota = await self.mail_manager.get_quota(user_id)
+        lines = [f"📋 **Your Fake Emails** ({quota.count}/{quota.limit})\n"]
+        lines.extend(f"{i}. `{email[1]}`" for i, email in enumerate(emails, 1))
+
+        # Delete buttons come back to this same page, so they carry its cursor
+        page = f"|{'n' if newer else 'o'}|{cursor}" if cursor is not None else ""
+        delete_buttons = [
+            InlineKeyboardButton(f"🗑 {i}", callback_data=f"del|{email[0]}{page}")
+            for i, email in enumerate(emails, 1)
+        ]
+        keyboard = [delete_buttons[i:i + 5] for i in range(0, len(delete_buttons), 5)]
+
+        navigation = []
+        if has_newer:
+            first = emails[0]
+            navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"addr|n|{first[0]}"))
+        if has_older:
+            last = emails[-1]
+            navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f"addr|o|{last[0]}"))
+        if navigation:
+            keyboard.append(navigation)
+        keyboard.append([InlineKeyboardButton("📧 Create Fake Mail", callback_data="create_mail")])
+
+        return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+    async def show_addresses_for_query(self, query, user_id, cursor=None, newer=False, notice=None):
+        address_text, reply_markup = await self.render_address_page(user_id, cursor, newer)
+        if notice:
+            address_text = f"{notice}\n\n{address_text}"
+        await query.edit_message_text(address_text, parse_mode='Markdown', reply_markup=reply_markup)
+
+    async def show_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            stats_text = await self.get_stats_text(update.effective_user.id)
+            await update.message.reply_text(stats_text, parse_mode='Markdown')
+        except Exception as e:
+            logger.error(f"Error in show_stats: {e}")
+            await update.message.reply_text("❌ An error occurred. Please try again.")
+
+    async def get_stats_text(self, user_id):
+        stats = await self.mail_manager.get_user_stats(user_id)
+        premium_status = "✅ Premium User" if stats['is_premium'] else "❌ Free User"
+        if not stats['is_premium']:
+            premium_expiry = "Not active"
+        elif stats['premium_expiry']:
+            premium_expiry = str(stats['premium_expiry'])[:16]
+        else:
+            premium_expiry = "Lifetime"
+
+        return f"""
+**📊 Your Statistics**
+
+**Account Status:** {premium_status}
+**Premium Expiry:** {premium_expiry}
+**Fake Emails Created:** {stats['email_count']}
+**Email Limit:** {stats['limit']}
+**Remaining:** {stats['remaining']}
+
+{'⭐ Enjoy your premium benefits!' if stats['is_premium'] else '💎 Use /redeem to upgrade to premium!'}
+        """
+
+    async def show_inbox(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            inbox_text, reply_markup = await self.render_inbox_page(update.effective_user.id)
+            await update.message.reply_text(inbox_text, parse_mode='Markdown', reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Error in show_inbox: {e}")
+            await update.message.reply_text("❌ An error occurred while loading your inbox.")
+
+    async def show_inbox_for_query(self, query, user_id, cursor=None, newer=False):
+        inbox_text, reply_markup = await self.render_inbox_page(user_id, cursor, newer)
+        await query.edit_message_text(inbox_text, parse_mode='Markdown', reply_markup=reply_markup)
+
+    async def render_inbox_page(self, user_id, cursor=None, newer=False):
+        """Render one keyset page of message headers with navigation buttons"""
+        # One extra row tells us whether another page exists in that direction
+        messages = await self.db.get_inbox_page(user_id, cursor, INBOX_PAGE_SIZE + 1, newer)
+        if newer:
+            has_newer, has_older = len(messages) > INBOX_PAGE_SIZE, True
+            messages = messages[-INBOX_PAGE_SIZE:]
+        else:
+            has_newer, has_older = cursor is not None, len(messages) > INBOX_PAGE_SIZE
+            messages = messages[:INBOX_PAGE_SIZE]
+
+        if not messages:
+            if cursor is not None:
+                return await self.render_inbox_page(user_id)
+            return "📭 **Your inbox is empty.**\n\nMessages sent to your fake emails will appear here.", None
+
+        lines, keyboard = self.render_message_headers(messages)
+        lines.insert(0, "📨 **Your Inbox**\n")
+
+        navigation = []
+        if has_newer:
+            first = messages[0]
+            navigation.append(InlineKeyboardButton("⬅️ Newer", callback_data=f"inbox|n|{first[4]}|{first[0]}"))
+        if has_older:
+            last = messages[-1]
+            navigation.append(InlineKeyboardButton("Older ➡️", callback_data=f"inbox|o|{last[4]}|{last[0]}"))
+        if navigation:
+            keyboard.append(navigation)
+
+        return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+    def render_message_headers(self, messages):
+        """Format header rows as numbered text lines plus rows of open buttons"""
+        lines = []
+        for i, message in enumerate(messages, 1):
+            message_id, email_address, sender, subject, received_at, is_read = message
+            lines.append(
+                f"{i}. {'' if is_read else '🆕 '}**{escape_markdown(subject or '(no subject)')}**\n"
+                f"👤 {escape_markdown(sender or 'unknown')} → `{email_address}`\n"
+                f"🕒 {received_at}\n"
+            )
+
+        open_buttons = [
+            InlineKeyboardButton(f"📖 {i}", callback_data=f"msg|{message[0]}")
+            for i, message in enumerate(messages, 1)
+        ]
+        keyboard = [open_buttons[i:i + 5] for i in range(0, len(open_buttons), 5)]
+        return lines, keyboard
+
+    async def search_inbox(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        try:
+            if not context.args:
+                await update.message.reply_text("Usage: /search <terms>\nExample: /search invoice march")
+                return
+
+            # Terms can be longer than callback_data allows, so pages refer back to them here
+            context.user_data['search_terms'] = ' '.join(context.args)
+            search_text, reply_markup = await self.render_search_page(
+                update.effective_user.id, context.user_data['search_terms']
+            )
+            await update.message.reply_text(search_text, parse_mode='Markdown', reply_markup=reply_markup)
+        except Exception as e:
+            logger.error(f"Error in search_inbox: {e}")
+            await update.message.reply_text("❌ An error occurred while searching your inbox.")
+
+    async def render_search_page(self, user_id, terms, page=0):
+        messages = await self.db.search_inbox(user_id, terms, INBOX_PAGE_SIZE + 1, page * INBOX_PAGE_SIZE)
+        has_next = len(messages) > INBOX_PAGE_SIZE
+        messages = messages[:INBOX_PAGE_SIZE]
+
+        if not messages:
+            return f"🔍 No messages match **{escape_markdown(terms)}**.", None
+
+        lines, keyboard = self.render_message_headers(messages)
+        lines.insert(0, f"🔍 **Results for** {escape_markdown(terms)} (page {page + 1})\n")
+
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"search|{page - 1}"))
+        if has_next:
+            navigation.append(InlineKeyboardButton("Next ➡️", callback_data=f"search|{page + 1}"))
+        if navigation:
+            keyboard.append(navigation)
+
+        return "\n".join(lines), InlineKeyboardMarkup(keyboard)
+
+    async def show_message_for_query(self, query, user_id, message_id):
+        message = await self.db.get_inbox_message(message_id, user_id)
+        keyboard = [[InlineKeyboardButton("⬅️ Back to Inbox", callback_data="check_inbox")]]
+        if not message:
+            await query.edit_message_text("❌ Message not found.", reply_markup=InlineKeyboardMarkup(keyboard))
+            return
+
+        for attachment_id, filename, _, size in await self.db.get_message_attachments(message_id):
+            keyboard.insert(-1, [InlineKeyboardButton(
+                f"📎 {filename} ({format_size(size)})", callback_data=f"att|{attachment_id}"
+            )])
+
+        body = message[4] or ''
+        if len(body) > MESSAGE_BODY_PREVIEW:
+            body = body[:MESSAGE_BODY_PREVIEW] + '\n…'
+        message_text = (
+            f"📧 **To:** `{message[1]}`\n"
+            f"👤 **From:** {escape_markdown(message[2] or 'unknown')}\n"
+            f"📝 **Subject:** {escape_markdown(message[3] or '(no subject)')}\n"
+            f"🕒 {message[5]}\n\n"
+            f"{escape_markdown(body)}"
+        )
+        await query.edit_message_text(message_text, parse_mode='Markdown', reply_markup=InlineKeyboardMarkup(keyboard))
+
+    async def send_attachment_for_query(self, query, user_id, attachment_id):
+        attachment = await self.db.get_attachment(attachment_id, user_id)
+        if not attachment:
+            await query.message.reply_text("❌ Attachment not found.")
+            return
+
+        filename, _, _, digest = attachment
+        try:
+            content = await asyncio.to_thread(self.attachment_spool.read, digest)
+        except FileNotFoundError:
+            logger.error(f"Attachment {attachment_id} is missing from the spool ({digest})")
+            await query.message.reply_text("❌ Attachment is no longer available.")
+            return
+        await query.message.reply_document(document=content, filename=filename)
 
     async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         try:
             query = update.callback_query
-            await query.answer()
-            
             user_id = query.from_user.id
             data = query.data
+
+            action = CALLBACK_ACTIONS.get((data or "").split("|")[0])
+            wait = action and self.check_rate_limit(user_id, action)
+            if wait:
+                # The answer every click needs anyway, so a throttled click costs nothing extra
+                await query.answer(throttle_notice(wait))
+                return
+            await query.answer()
             
             if data == "create_mail":
-                email, password = self.mail_manager.create_fake_email(user_id)
+                email, password = await self.mail_manager.create_fake_email(user_id)
                 
                 if email:
                     response = f"""
@@ -210,13 +620,10 @@ Contact admin for support with premium codes or issues.
 💡 Use this email to sign up for services. All received emails will appear in your inbox.
                     """
                     
-                    # Update email list
-                    email_list = self.mail_manager.get_user_emails_list(user_id)
-                    response += f"\n\n**Your Fake Emails:**\n\n{email_list}"
-                    
                     # Add create another button
                     keyboard = [
                         [InlineKeyboardButton("📧 Create Another", callback_data="create_mail")],
+                        [InlineKeyboardButton("📋 My Emails", callback_data="addr")],
                         [InlineKeyboardButton("📨 Check Inbox", callback_data="check_inbox")],
                         [InlineKeyboardButton("📊 Statistics", callback_data="show_stats")]
                     ]
@@ -229,33 +636,57 @@ Contact admin for support with premium codes or issues.
                 
             elif data == "check_inbox":
                 await self.show_inbox_for_query(query, user_id)
-                
-            elif data == "show_stats":
-                stats = self.mail_manager.get_user_stats(user_id)
-                premium_status = "✅ Premium User" if stats['is_premium'] else "❌ Free User"
-                premium_expiry = "Lifetime" if stats['is_premium'] else "Not active"
-                
-                stats_text = f"""
-**📊 Your Statistics**
 
-**Account Status:** {premium_status}
-**Premium Expiry:** {premium_expiry}
-**Fake Emails Created:** {stats['email_count']}
-**Email Limit:** {stats['limit']}
-**Remaining:** {stats['remaining']}
+            elif data == "addr":
+                await self.show_addresses_for_query(query, user_id)
 
-{'⭐ Enjoy your premium benefits!' if stats['is_premium'] else '💎 Use /redeem to upgrade to premium!'}
-                """
+            elif data.startswith("addr|"):
+                _, direction, email_id = data.split("|")
+                await self.show_addresses_for_query(query, user_id, int(email_id), direction == "n")
+
+            elif data.startswith("del|"):
+                parts = data.split("|")
+                email_id = int(parts[1])
+                cursor, newer = None, False
+                if len(parts) == 4:
+                    cursor, newer = int(parts[3]), parts[2] == "n"
+                if await self.mail_manager.delete_email(email_id, user_id):
+                    logger.info(f"User {user_id} deleted email {email_id}")
+                    notice = "✅ Email deleted."
+                else:
+                    notice = "❌ Email not found."
+                await self.show_addresses_for_query(query, user_id, cursor, newer, notice)
+
+            elif data.startswith("inbox|"):
+                _, direction, received_at, message_id = data.split("|")
+                await self.show_inbox_for_query(query, user_id, (received_at, int(message_id)), direction == "n")
+
+            elif data.startswith("search|"):
+                terms = context.user_data.get('search_terms')
+                if not terms:
+                    await query.edit_message_text("🔍 Search expired. Send /search <terms> again.")
+                else:
+                    search_text, reply_markup = await self.render_search_page(user_id, terms, int(data.split("|")[1]))
+                    await query.edit_message_text(search_text, parse_mode='Markdown', reply_markup=reply_markup)
+
+            elif data.startswith("msg|"):
+                await self.show_message_for_query(query, user_id, int(data.split("|")[1]))
+
+            elif data.startswith("att|"):
+                await self.send_attachment_for_query(query, user_id, int(data.split("|")[1]))
+                
+            elif data == "show_stats":
+                stats_text = await self.get_stats_text(user_id)
                 await query.edit_message_text(stats_text, parse_mode='Markdown')
                 
             elif data == "premium_info":
-                premium_text = """
+                premium_text = f"""
 💎 **Premium Features**
 
 ✨ **Benefits:**
 • Create up to 500 fake emails (Free: 100)
 • Priority email processing
-• Extended email retention
+• Extended email retention ({PREMIUM_RETENTION_DAYS} days, Free: {FREE_RETENTION_DAYS})
 • Premium support
 
 🔑 **How to get premium?**
@@ -279,7 +710,7 @@ Contact @admin for available codes
 
 **Quick Actions:**
 • Use buttons to create emails and check inbox
-• Click delete links to remove emails
+• Use 🗑 buttons in My Emails to remove emails
 • Check stats to see your limits
 
 **Need Premium?**
@@ -287,19 +718,78 @@ Contact admin for premium codes that give you 500 email limit!
         """
         await query.edit_message_text(help_text, parse_mode='Markdown')
 
-    def run(self):
-        """Start the bot"""
+    def notify_new_mail(self, messages):
+        """Queue a push notice for the owner of every address that just got mail"""
+        if not NOTIFY_ENABLED:
+            return
+        for message in messages:
+            user_id = self.recipients.get(message[0])
+            if user_id is not None:
+                self.notifications.notify(user_id)
+
+    def premium_expired(self, user_ids):
+        """Drop cached quotas of downgraded users and tell them"""
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("💎 Premium Info", callback_data="premium_info")]])
+        for user_id in user_ids:
+            self.mail_manager.invalidate_user(user_id)
+            task = asyncio.create_task(self.notifications.send_notice(
+                user_id,
+                f"⌛ Your premium access has expired.\n\n"
+                f"Your email limit is back to {FREE_USER_MAIL_LIMIT}; existing emails keep working. "
+                f"Use /redeem <code> to renew.",
+                keyboard
+            ))
+            self._background_tasks.add(task)
+            task.add_done_callback(self._background_tasks.discard)
+
+    async def on_startup(self, application):
+        await self.mail_manager.allocator.load()
+        await self.premium_expiry.start()
+        if SMTP_ENABLED:
+            await self.inbox_writer.start()
+            await self.mail_server.start()
+        await self.retention_sweeper.start()
+        if NOTIFY_ENABLED:
+            await self.notifications.start()
+        if self.metrics_server:
+            self.metrics_server.start()
+
+    async def on_shutdown(self, application):
+        if self.metrics_server:
+            self.metrics_server.stop()
+        await self.retention_sweeper.stop()
+        await self.premium_expiry.stop()
+        await self.notifications.stop()
+        await self.mail_server.stop()
+        await self.inbox_writer.stop()
+        self.db.close()
+
+    def run(self, mode=BOT_MODE):
+        """Start the bot, receiving updates by long polling or through a webhook"""
         logger.info("🤖 Fake Mail Bot is starting...")
         logger.info(f"📧 Domain: wizard.com")
         logger.info(f"💎 Admin ID: {ADMIN_IDS[0]}")
         logger.info(f"🔑 Free limit: {FREE_USER_MAIL_LIMIT}")
         logger.info(f"⭐ Premium limit: {PREMIUM_USER_MAIL_LIMIT}")
+        logger.info(f"📡 Mode: {mode}, up to {MAX_CONCURRENT_UPDATES} concurrent updates")
         
         try:
-            self.application.run_polling()
+            if mode == "webhook":
+                self.application.run_webhook(
+                    listen=WEBHOOK_LISTEN,
+                    port=PORT,
+                    url_path=WEBHOOK_PATH,
+                    webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+                    secret_token=WEBHOOK_SECRET_TOKEN
+                )
+            else:
+                self.application.run_polling()
         except Exception as e:
             logger.error(f"Bot stopped with error: {e}")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Mail Bot")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=BOT_MODE)
+    args = parser.parse_args()
     bot = FakeMailBot()
-    bot.run()
\ No newline at end of file
+    bot.run(args.mode)
\ No newline at end of file
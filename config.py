@@ -11,7 +11,106 @@ DATABASE_NAME = "fake_mail_bot.db"
 DOMAIN = "wizard.com"
 FREE_USER_MAIL_LIMIT = 100
 PREMIUM_USER_MAIL_LIMIT = 500
+PREMIUM_CODE_DAYS = 30  # premium time a code grants unless /create or /create_batch says otherwise
+PREMIUM_CODE_MAX_DAYS = 3650
+PREMIUM_CODE_BATCH_MAX = 10_000  # codes minted by one /create_batch
+PREMIUM_EXPIRY_MAX_SLEEP = 300  # seconds; the expiry heap is re-checked at least this often
+ADDRESS_BLOCK_SIZE = 1000  # sequence numbers reserved per database write
+ADDRESS_FILTER_CAPACITY = 1_000_000  # minimum Bloom filter size for existing addresses
+ADDRESS_FILTER_ERROR_RATE = 0.001
 
 # Server Configuration (for receiving emails)
 WEBHOOK_URL = "https://your-domain.com"  # Optional for production
-PORT = 5000
\ No newline at end of file
+PORT = 5000
+
+# Update delivery
+BOT_MODE = os.environ.get("BOT_MODE", "polling")  # "polling" or "webhook"
+MAX_CONCURRENT_UPDATES = 64  # updates handled at once; one user's updates still run in order
+WEBHOOK_LISTEN = "0.0.0.0"
+WEBHOOK_PATH = "telegram"  # Telegram posts to WEBHOOK_URL/WEBHOOK_PATH
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN")  # checked on every webhook request when set
+
+# Database tuning
+DB_POOL_SIZE = 4  # Worker threads (one SQLite connection each) shared by every component
+DB_STATEMENT_CACHE_SIZE = 128  # Prepared statements kept per connection; the fixed query set is about 60
+DB_ANALYSIS_LIMIT = 400  # Rows sampled per index by PRAGMA optimize when a connection closes
+DB_BUSY_TIMEOUT_MS = 5000
+DB_SYNCHRONOUS = "NORMAL"  # Safe with WAL; FULL fsyncs on every commit
+BODY_CODEC = "zlib"  # "zlib", or "zstd" when the zstandard package is installed
+BODY_COMPRESS_MIN_SIZE = 64  # bytes; shorter bodies are stored uncompressed
+INBOX_SHARDS = 0  # 0 keeps mail in DATABASE_NAME; N spreads it over N files (fixed once mail is stored)
+INBOX_SHARD_POOL_SIZE = 2  # Worker threads per shard file
+
+
+# SMTP ingest server (receives mail for DOMAIN)
+SMTP_ENABLED = True
+SMTP_HOST = "0.0.0.0"
+SMTP_PORT = 2525
+SMTP_MAX_MESSAGE_SIZE = 10 * 1024 * 1024  # bytes
+SMTP_IDLE_TIMEOUT = 300  # seconds
+INBOX_WRITER_MAX_BATCH = 500  # messages per group commit
+INBOX_WRITER_FLUSH_INTERVAL = 0.05  # max seconds a message waits before its batch commits
+INBOX_WRITER_MAX_PENDING = 10000  # queued messages before submitters are made to wait
+MAIL_HEADER_MAX_SIZE = 64 * 1024  # bytes of headers parsed per MIME part; the rest are ignored
+MAIL_BODY_MAX_SIZE = 256 * 1024  # bytes of text kept as the message body; the rest is cut off
+
+
+# Attachments (decoded to files while mail arrives, one file per distinct content)
+ATTACHMENT_SPOOL_DIR = "attachments"
+ATTACHMENT_MAX_SIZE = 10 * 1024 * 1024  # bytes per attachment; larger ones are dropped (bots may send up to 50 MB)
+ATTACHMENT_BUFFER_SIZE = 256 * 1024  # bytes of an attachment held in memory before a write to the spool
+ATTACHMENT_MAX_COUNT = 20  # attachments kept per message
+ATTACHMENT_ORPHAN_AGE = 3600  # seconds before a spool file no message refers to is removed
+
+
+# Bot display
+INBOX_PAGE_SIZE = 10  # message headers per inbox page
+ADDRESS_PAGE_SIZE = 10  # addresses per page of the address list
+MESSAGE_BODY_PREVIEW = 3500  # characters of a body shown in chat (Telegram caps messages at 4096)
+
+
+# Caches
+QUOTA_CACHE_SIZE = 100_000  # users whose quota state is kept in memory
+ADDRESS_PAGE_CACHE_USERS = 10_000  # users whose rendered address pages are kept
+ADDRESS_PAGE_CACHE_PAGES = 20  # pages kept per user
+
+
+# Per-user rate limits: action -> (actions per minute, burst) for free users
+RATE_LIMITS = {
+    'create_mail': (10, 5),
+    'delete_mail': (30, 10),
+    'bulk': (2, 1),
+    'redeem': (5, 3),  # also slows down guessing codes
+    'check_inbox': (30, 10),  # inbox pages and messages
+    'download': (10, 5),  # attachments
+    'search': (10, 5),
+    'browse': (60, 20),  # /start, address pages, statistics
+}
+RATE_LIMIT_PREMIUM_MULTIPLIER = 3  # premium users get this many times both rate and burst
+RATE_LIMIT_IDLE_SECONDS = 600  # unused buckets are forgotten after this long
+
+
+# Retention
+FREE_RETENTION_DAYS = 7
+PREMIUM_RETENTION_DAYS = 30
+RETENTION_SWEEP_INTERVAL = 600  # seconds between sweeps
+RETENTION_CHUNK_SIZE = 500  # rows examined per delete transaction
+RETENTION_CYCLE_BUDGET = 5.0  # seconds of deleting per sweep; the rest waits for the next one
+RETENTION_VACUUM_PAGES = 2000  # free pages returned to the OS per sweep
+
+
+# New-mail notifications (Telegram allows ~30 msg/s overall, ~1 msg/s per chat)
+NOTIFY_ENABLED = True
+NOTIFY_GLOBAL_RATE = 25  # messages per second across all chats
+NOTIFY_CHAT_INTERVAL = 1.0  # minimum seconds between notices to one chat
+NOTIFY_COALESCE_DELAY = 2.0  # seconds to gather a burst into one notice
+NOTIFY_WORKERS = 4  # concurrent sends
+NOTIFY_MAX_RETRIES = 5
+
+
+# Metrics (Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics)
+METRICS_ENABLED = True  # when False, handlers and queries run unwrapped
+METRICS_HOST = "127.0.0.1"
+METRICS_PORT = 9108
+METRICS_SLOW_QUERY_MS = 100  # database calls slower than this are logged
+METRICS_PROFILER_ENABLED = False  # serve /debug/profile?seconds=N (sampled stacks of every thread)
@@ -1,11 +1,188 @@
+import re
 import sqlite3
 import datetime
-from config import DATABASE_NAME
+import logging
+from config import (
+    DATABASE_NAME, DB_BUSY_TIMEOUT_MS, DB_SYNCHRONOUS, DB_STATEMENT_CACHE_SIZE, DB_ANALYSIS_LIMIT,
+    PREMIUM_CODE_DAYS
+)
+from migrations import apply_migrations
+from body_store import encode_body, decode_body
+
+logger = logging.getLogger(__name__)
+
+# Queries on the request path, with representative parameters. Every one of
+# them must be answered through an index; see Database.find_table_scans.
+USER_EMAILS_SQL = 'SELECT * FROM fake_emails WHERE user_id = ? AND is_active = 1 ORDER BY created_at DESC'
+EMAIL_COUNT_SQL = 'SELECT COUNT(*) FROM fake_emails WHERE user_id = ? AND is_active = 1'
+# Keyset pages of a user's active addresses, newest first. ids are
+# AUTOINCREMENT, so they order addresses by creation and a page is a
+# range read off idx_fake_emails_user_active_id without any sorting.
+EMAIL_PAGE_SQL = '''
+    SELECT id, email_address FROM fake_emails
+    WHERE user_id = ? AND is_active = 1 AND id {op} ?
+    ORDER BY id {order} LIMIT ?
+'''
+OLDER_EMAIL_PAGE_SQL = EMAIL_PAGE_SQL.format(op='<', order='DESC')
+NEWER_EMAIL_PAGE_SQL = EMAIL_PAGE_SQL.format(op='>', order='ASC')
+# Greater than every rowid, so it starts the first page
+NEWEST_EMAIL_ID = 2 ** 63 - 1
+# Full message rows keep their original shape:
+# (id, email_address, sender, subject, body, received_at, is_read)
+FULL_MESSAGE_COLUMNS = '''
+    im.id, im.email_address, im.sender, im.subject,
+    (SELECT body_text(mb.codec, mb.data) FROM message_bodies mb WHERE mb.hash = im.body_hash) AS body,
+    im.received_at, im.is_read
+'''
+INBOX_MESSAGES_SQL = f'''
+    SELECT {FULL_MESSAGE_COLUMNS} FROM inbox_messages im
+    WHERE im.email_address = ? ORDER BY im.received_at DESC
+'''
+ALL_USER_INBOX_SQL = f'''
+    SELECT {FULL_MESSAGE_COLUMNS} FROM inbox_messages im
+    JOIN fake_emails fe ON im.email_address = fe.email_address
+    WHERE fe.user_id = ? AND fe.is_active = 1
+    ORDER BY im.received_at DESC
+'''
+
+# Keyset pages of message headers across a user's active addresses. The
+# correlated subquery takes at most `limit` ids per address straight off
+# idx_inbox_messages_address_received and rows are then fetched by id, so a
+# page costs O(addresses * limit) no matter how many messages are stored.
+INBOX_PAGE_SQL = '''
+    SELECT im.id, im.email_address, im.sender, im.subject, im.received_at, im.is_read
+    FROM fake_emails fe, inbox_messages im
+    WHERE fe.user_id = ? AND fe.is_active = 1 AND im.id IN (
+        SELECT id FROM inbox_messages
+        WHERE email_address = fe.email_address AND (received_at, id) {op} (?, ?)
+        ORDER BY received_at {order}, id {order} LIMIT ?
+    )
+    ORDER BY im.received_at {order}, im.id {order} LIMIT ?
+'''
+OLDER_INBOX_PAGE_SQL = INBOX_PAGE_SQL.format(op='<', order='DESC')
+NEWER_INBOX_PAGE_SQL = INBOX_PAGE_SQL.format(op='>', order='ASC')
+# Sorts after every CURRENT_TIMESTAMP value, so it starts the first page
+NEWEST_CURSOR = ('9999-12-31 23:59:59', 0)
+
+INBOX_MESSAGE_SQL = f'''
+    SELECT {FULL_MESSAGE_COLUMNS} FROM inbox_messages im
+    JOIN fake_emails fe ON im.email_address = fe.email_address
+    WHERE im.id = ? AND fe.user_id = ?
+'''
+
+# Ranked full-text matches limited to the caller's active addresses. The
+# terms in the MATCH expression (see build_match_query) carry the caller's
+# id, so FTS5 only reads and ranks the caller's messages.
+SEARCH_INBOX_SQL = '''
+    SELECT im.id, im.email_address, im.sender, im.subject, im.received_at, im.is_read, inbox_fts.rank
+    FROM inbox_fts
+    JOIN inbox_messages im ON im.id = inbox_fts.rowid
+    JOIN fake_emails fe ON fe.email_address = im.email_address
+    WHERE inbox_fts MATCH ? AND fe.user_id = ? AND fe.is_active = 1
+    ORDER BY inbox_fts.rank
+    LIMIT ? OFFSET ?
+'''
+
+# The owner is looked up once at delivery, for the search index
+INSERT_MESSAGE_SQL = '''
+    INSERT INTO inbox_messages (email_address, user_id, sender, subject, body_hash)
+    VALUES (?, (SELECT user_id FROM fake_emails WHERE email_address = ?), ?, ?, ?)
+'''
+
+MESSAGE_ATTACHMENTS_SQL = '''
+    SELECT id, filename, content_type, size FROM message_attachments WHERE message_id = ? ORDER BY id
+'''
+ATTACHMENT_SQL = '''
+    SELECT ma.filename, ma.content_type, ma.size, ma.hash
+    FROM message_attachments ma
+    JOIN inbox_messages im ON im.id = ma.message_id
+    JOIN fake_emails fe ON fe.email_address = im.email_address
+    WHERE ma.id = ? AND fe.user_id = ?
+'''
+
+# Words as unicode61 tokenizes them, near enough that owned_text() output
+# stays one FTS5 token per word
+SEARCH_WORD = re.compile(r'[^\W_]+')
+
+def owned_text(owner, text):
+    """Prefix each word with the owner's user id ("42xinvoice").
+
+    Registered as the owned_text() SQL function that feeds the search
+    index, so an indexed term never mixes different users' messages.
+    """
+    if owner is None or text is None:
+        return None
+    prefix = f'{owner}x'.replace('-', 'n')
+    return ' '.join(prefix + word for word in SEARCH_WORD.findall(text))
+
+def build_match_query(terms, user_id):
+    """FTS5 query matching every term in user_id's messages; empty without terms.
+
+    Each user-supplied term becomes a quoted phrase, so FTS5 operators in
+    it are matched literally.
+    """
+    phrases = (owned_text(user_id, term) for term in terms.split())
+    return ' '.join(f'"{phrase}"' for phrase in phrases if phrase)
+
+HOT_QUERIES = {
+    'get_user': ('SELECT * FROM users WHERE user_id = ?', (0,)),
+    'get_user_emails': (USER_EMAILS_SQL, (0,)),
+    'get_email_count': (EMAIL_COUNT_SQL, (0,)),
+    'get_email_page': (OLDER_EMAIL_PAGE_SQL, (0, 0, 10)),
+    'get_email_page_newer': (NEWER_EMAIL_PAGE_SQL, (0, 0, 10)),
+    'get_premium_code': ('SELECT * FROM premium_codes WHERE code = ?', ('',)),
+    'get_inbox_messages': (INBOX_MESSAGES_SQL, ('',)),
+    'get_all_user_inbox': (ALL_USER_INBOX_SQL, (0,)),
+    'get_inbox_page': (OLDER_INBOX_PAGE_SQL, (0, '', 0, 10, 10)),
+    'get_inbox_page_newer': (NEWER_INBOX_PAGE_SQL, (0, '', 0, 10, 10)),
+    'get_inbox_message': (INBOX_MESSAGE_SQL, (0, 0)),
+    'search_inbox': (SEARCH_INBOX_SQL, (build_match_query('term', 0), 0, 10, 0)),
+    'get_message_attachments': (MESSAGE_ATTACHMENTS_SQL, (0,)),
+    'get_attachment': (ATTACHMENT_SQL, (0, 0)),
+}
+
+def connect(path=DATABASE_NAME, init_file=True):
+    """Open a connection tuned for concurrent readers and a single writer.
+
+    auto_vacuum and journal_mode are stored in the file, so they are only
+    set by the connection that sets up the schema (init_file).
+    """
+    conn = sqlite3.connect(
+        path, check_same_thread=False, timeout=DB_BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DB_STATEMENT_CACHE_SIZE
+    )
+    if init_file:
+        # Only takes effect on a new, empty database; see manage.py vacuum
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute(f'PRAGMA synchronous = {DB_SYNCHRONOUS}')
+    conn.execute(f'PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT_MS)}')
+    # Used by the search index triggers and views to read compressed bodies
+    conn.create_function('body_text', 2, decode_body, deterministic=True)
+    conn.create_function('owned_text', 2, owned_text, deterministic=True)
+    return conn
 
 class Database:
-    def __init__(self):
-        self.conn = sqlite3.connect(DATABASE_NAME, check_same_thread=False)
-        self.create_tables()
+    def __init__(self, path=DATABASE_NAME, init_schema=True):
+        self.conn = connect(path, init_file=init_schema)
+        if init_schema:
+            self.create_tables()
+
+    def close(self, checkpoint=False):
+        """Close the connection, first refreshing planner statistics for the
+        queries it ran. With checkpoint, the WAL is also copied back into the
+        database and truncated; that needs every other connection closed.
+        """
+        try:
+            self.conn.execute(f'PRAGMA analysis_limit = {int(DB_ANALYSIS_LIMIT)}')
+            self.conn.execute('PRAGMA optimize')
+            if checkpoint:
+                self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        except sqlite3.Error as e:
+            # Both are housekeeping; the data is already committed
+            logger.warning(f"Database housekeeping on close failed: {e}")
+        finally:
+            self.conn.close()
 
     def create_tables(self):
         cursor = self.conn.cursor()
@@ -61,6 +238,26 @@ class Database:
         ''')
         
         self.conn.commit()
+        apply_migrations(self.conn)
+
+    # Query plan inspection
+    def explain_query_plan(self, sql, params=()):
+        cursor = self.conn.cursor()
+        cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+        return [row[3] for row in cursor.fetchall()]
+
+    def find_table_scans(self, queries=None):
+        """Return {query name: plan steps} for hot queries that fall back to a SCAN"""
+        scans = {}
+        for name, (sql, params) in (queries or HOT_QUERIES).items():
+            steps = [
+                step for step in self.explain_query_plan(sql, params)
+                # an FTS5 MATCH is reported as a virtual table "scan" with an M constraint
+                if step.startswith('SCAN') and not re.search(r'VIRTUAL TABLE INDEX \d+:M', step)
+            ]
+            if steps:
+                scans[name] = steps
+        return scans
 
     # User management methods
     def get_user(self, user_id):
@@ -77,17 +274,33 @@ class Database:
             )
             self.conn.commit()
             return True
-        except:
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
             return False
 
-    def update_user_premium(self, user_id, is_premium=True, expiry_days=30):
+    def get_quota_state(self, user_id):
+        """Return (is_premium, active_email_count, premium_expiry) from the users row, or None"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT is_premium, active_email_count, premium_expiry FROM users WHERE user_id = ?', (user_id,))
+        return cursor.fetchone()
+
+    def get_premium_expiries(self):
+        """(user_id, premium_expiry) of every premium user, for the expiry scheduler"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT user_id, premium_expiry FROM users WHERE is_premium = 1 AND premium_expiry IS NOT NULL')
+        return cursor.fetchall()
+
+    def expire_premium(self, user_ids, cutoff):
+        """Downgrade those of user_ids whose premium ended by cutoff; returns their ids"""
         cursor = self.conn.cursor()
-        expiry_date = datetime.datetime.now() + datetime.timedelta(days=expiry_days)
         cursor.execute(
-            'UPDATE users SET is_premium = ?, premium_expiry = ? WHERE user_id = ?',
-            (1 if is_premium else 0, expiry_date, user_id)
+            f'UPDATE users SET is_premium = 0 WHERE user_id IN ({", ".join("?" * len(user_ids))}) '
+            'AND is_premium = 1 AND premium_expiry <= ? RETURNING user_id',
+            (*user_ids, cutoff)
         )
+        expired = [row[0] for row in cursor.fetchall()]
         self.conn.commit()
+        return expired
 
     # Fake email management methods
     def create_fake_email(self, user_id, email_address, password):
@@ -97,57 +310,183 @@ class Database:
                 'INSERT INTO fake_emails (user_id, email_address, password) VALUES (?, ?, ?)',
                 (user_id, email_address, password)
             )
+            # Keep the denormalized counter in the same transaction as the insert
+            cursor.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
+            cursor.execute(
+                'UPDATE users SET active_email_count = active_email_count + 1 WHERE user_id = ?',
+                (user_id,)
+            )
             self.conn.commit()
             return True
         except sqlite3.IntegrityError:
+            self.conn.rollback()
+            return False
+
+    def create_fake_emails(self, user_id, addresses):
+        """Insert (email_address, password) pairs in one transaction; all or nothing"""
+        cursor = self.conn.cursor()
+        try:
+            cursor.executemany(
+                'INSERT INTO fake_emails (user_id, email_address, password) VALUES (?, ?, ?)',
+                [(user_id, email_address, password) for email_address, password in addresses]
+            )
+            cursor.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
+            cursor.execute(
+                'UPDATE users SET active_email_count = active_email_count + ? WHERE user_id = ?',
+                (len(addresses), user_id)
+            )
+            self.conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
             return False
 
     def get_user_emails(self, user_id):
         cursor = self.conn.cursor()
-        cursor.execute(
-            'SELECT * FROM fake_emails WHERE user_id = ? AND is_active = 1 ORDER BY created_at DESC',
-            (user_id,)
-        )
+        cursor.execute(USER_EMAILS_SQL, (user_id,))
         return cursor.fetchall()
 
-    def get_email_count(self, user_id):
+    def get_email_page(self, user_id, cursor=None, limit=10, newer=False):
+        """Return up to `limit` (id, email_address) rows, newest first.
+
+        cursor is the id of the edge row of the current page; rows older
+        than it are returned, or newer ones when newer=True.
+        """
+        cursor_id = NEWEST_EMAIL_ID if cursor is None else cursor
         cursor = self.conn.cursor()
         cursor.execute(
-            'SELECT COUNT(*) FROM fake_emails WHERE user_id = ? AND is_active = 1',
-            (user_id,)
+            NEWER_EMAIL_PAGE_SQL if newer else OLDER_EMAIL_PAGE_SQL,
+            (user_id, cursor_id, limit)
         )
+        rows = cursor.fetchall()
+        return rows[::-1] if newer else rows
+
+    def get_email_count(self, user_id):
+        cursor = self.conn.cursor()
+        cursor.execute(EMAIL_COUNT_SQL, (user_id,))
         return cursor.fetchone()[0]
 
     def delete_fake_email(self, email_id, user_id):
+        """Deactivate an address; returns the address, or None if nothing matched"""
         cursor = self.conn.cursor()
         cursor.execute(
-            'UPDATE fake_emails SET is_active = 0 WHERE id = ? AND user_id = ?',
+            'UPDATE fake_emails SET is_active = 0 WHERE id = ? AND user_id = ? AND is_active = 1 RETURNING email_address',
             (email_id, user_id)
         )
+        row = cursor.fetchone()
+        if row:
+            cursor.execute(
+                'UPDATE users SET active_email_count = active_email_count - 1 WHERE user_id = ?',
+                (user_id,)
+            )
+            # The retention sweeper deletes its messages in the background
+            cursor.execute('INSERT OR IGNORE INTO address_purge_queue (email_address) VALUES (?)', (row[0],))
+        self.conn.commit()
+        return row[0] if row else None
+
+    def get_email_addresses_after(self, after_id, through_id, limit):
+        """Return (id, email_address) for addresses, active or not, with ids in (after_id, through_id]"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'SELECT id, email_address FROM fake_emails WHERE id > ? AND id <= ? ORDER BY id LIMIT ?',
+            (after_id, through_id, limit)
+        )
+        return cursor.fetchall()
+
+    # Address allocator sequence
+    def get_address_key(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT permutation_key FROM address_sequence WHERE id = 1')
+        return cursor.fetchone()[0]
+
+    def get_legacy_address_bound(self):
+        """Largest fake_emails id that may hold an address not made by the allocator"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT legacy_max_id FROM address_sequence WHERE id = 1')
+        return cursor.fetchone()[0]
+
+    def reserve_address_block(self, size):
+        """Reserve `size` sequence numbers; returns the first one"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'UPDATE address_sequence SET next_value = next_value + ? WHERE id = 1 RETURNING next_value',
+            (size,)
+        )
+        end = cursor.fetchone()[0]
         self.conn.commit()
-        return cursor.rowcount > 0
+        return end - size
+
+    def get_active_addresses(self):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT email_address, user_id FROM fake_emails WHERE is_active = 1')
+        return cursor.fetchall()
 
     # Premium code management methods
-    def create_premium_code(self, code, created_by):
+    def create_premium_code(self, code, created_by, duration_days=PREMIUM_CODE_DAYS):
         cursor = self.conn.cursor()
         try:
             cursor.execute(
-                'INSERT INTO premium_codes (code, created_by) VALUES (?, ?)',
-                (code, created_by)
+                'INSERT INTO premium_codes (code, created_by, duration_days) VALUES (?, ?, ?)',
+                (code, created_by, duration_days)
             )
             self.conn.commit()
             return True
         except sqlite3.IntegrityError:
+            self.conn.rollback()
             return False
 
-    def use_premium_code(self, code, used_by):
+    def create_premium_codes(self, codes, created_by, duration_days=PREMIUM_CODE_DAYS):
+        """Insert many codes in one transaction; all or nothing"""
         cursor = self.conn.cursor()
-        cursor.execute(
-            'UPDATE premium_codes SET used_by = ?, used_at = CURRENT_TIMESTAMP, is_active = 0 WHERE code = ? AND used_by IS NULL AND is_active = 1',
-            (used_by, code)
-        )
-        self.conn.commit()
-        return cursor.rowcount > 0
+        try:
+            cursor.executemany(
+                'INSERT INTO premium_codes (code, created_by, duration_days) VALUES (?, ?, ?)',
+                [(code, created_by, duration_days) for code in codes]
+            )
+            self.conn.commit()
+            return True
+        except sqlite3.IntegrityError:
+            self.conn.rollback()
+            return False
+
+    def redeem_premium_code(self, code, user_id):
+        """Use up a code and grant its premium time in one transaction.
+
+        Time is added to any premium the user still has. Returns
+        (duration_days, new expiry), or None if the code is unknown or used.
+        """
+        cursor = self.conn.cursor()
+        try:
+            cursor.execute(
+                'UPDATE premium_codes SET used_by = ?, used_at = CURRENT_TIMESTAMP, is_active = 0 '
+                'WHERE code = ? AND used_by IS NULL AND is_active = 1 RETURNING duration_days',
+                (user_id, code)
+            )
+            row = cursor.fetchone()
+            if row is None:
+                self.conn.rollback()
+                return None
+            duration_days = row[0]
+
+            cursor.execute('INSERT OR IGNORE INTO users (user_id) VALUES (?)', (user_id,))
+            cursor.execute('SELECT is_premium, premium_expiry FROM users WHERE user_id = ?', (user_id,))
+            is_premium, current_expiry = cursor.fetchone()
+            now = datetime.datetime.now().replace(microsecond=0)
+            start = now
+            if is_premium and current_expiry:
+                start = max(now, datetime.datetime.fromisoformat(str(current_expiry)))
+            expiry = start + datetime.timedelta(days=duration_days)
+            cursor.execute(
+                'UPDATE users SET is_premium = 1, premium_expiry = ? WHERE user_id = ?',
+                (expiry.strftime('%Y-%m-%d %H:%M:%S'), user_id)
+            )
+            self.conn.commit()
+        except Exception:
+            # Never leave the code marked used without the premium it grants,
+            # nor this pooled connection inside an open write transaction
+            self.conn.rollback()
+            raise
+        return duration_days, expiry
 
     def get_premium_code(self, code):
         cursor = self.conn.cursor()
@@ -156,27 +495,209 @@ class Database:
 
     # Inbox management methods
     def add_inbox_message(self, email_address, sender, subject, body):
+        self.add_inbox_messages([(email_address, sender, subject, body)])
+
+    def add_inbox_messages(self, messages):
+        """Insert (email_address, sender, subject, body) rows in a single transaction.
+
+        A row may carry a fifth item, its attachments as (filename,
+        content_type, size, hash) tuples of files already in the spool.
+        """
+        encoded = [encode_body(message[3]) for message in messages]
+        rows = [(message[0], message[0]) + tuple(message[1:3]) + (body[0],)
+                for message, body in zip(messages, encoded)]
+        attached = [len(message) > 4 and message[4] for message in messages]
         cursor = self.conn.cursor()
-        cursor.execute(
-            'INSERT INTO inbox_messages (email_address, sender, subject, body) VALUES (?, ?, ?, ?)',
-            (email_address, sender, subject, body)
+        cursor.executemany(
+            'INSERT INTO message_bodies (hash, codec, data, size) VALUES (?, ?, ?, ?) ON CONFLICT (hash) DO NOTHING',
+            encoded
         )
+        cursor.executemany(INSERT_MESSAGE_SQL, [row for row, attachments in zip(rows, attached) if not attachments])
+        # Messages with attachments need their ids, so they go one at a time
+        for row, attachments in zip(rows, attached):
+            if attachments:
+                cursor.execute(INSERT_MESSAGE_SQL, row)
+                message_id = cursor.lastrowid
+                cursor.executemany(
+                    'INSERT INTO message_attachments (message_id, filename, content_type, size, hash) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(message_id,) + tuple(attachment) for attachment in attachments]
+                )
         self.conn.commit()
+        return len(messages)
+
+    def get_body_storage_report(self):
+        """Compare stored body bytes with what inline, uncompressed storage would take"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT COUNT(*), COALESCE(SUM(refcount), 0), COALESCE(SUM(size * refcount), 0),
+                   COALESCE(SUM(size), 0), COALESCE(SUM(LENGTH(data)), 0)
+            FROM message_bodies
+        ''')
+        distinct_bodies, messages, inline_bytes, deduplicated_bytes, stored_bytes = cursor.fetchone()
+        return {
+            'messages': messages,
+            'distinct_bodies': distinct_bodies,
+            'inline_bytes': inline_bytes,
+            'deduplicated_bytes': deduplicated_bytes,
+            'stored_bytes': stored_bytes,
+            'saved_bytes': inline_bytes - stored_bytes,
+            'saved_ratio': 1 - stored_bytes / inline_bytes if inline_bytes else 0.0,
+        }
 
     def get_inbox_messages(self, email_address):
+        cursor = self.conn.cursor()
+        cursor.execute(INBOX_MESSAGES_SQL, (email_address,))
+        return cursor.fetchall()
+
+    def get_all_user_inbox(self, user_id):
+        cursor = self.conn.cursor()
+        cursor.execute(ALL_USER_INBOX_SQL, (user_id,))
+        return cursor.fetchall()
+
+    def get_inbox_page(self, user_id, cursor=None, limit=10, newer=False):
+        """Return up to `limit` message headers, newest first, next to a keyset cursor.
+
+        cursor is the (received_at, id) of the edge row of the current page;
+        rows older than it are returned, or newer ones when newer=True.
+        Headers are (id, email_address, sender, subject, received_at, is_read).
+        """
+        received_at, message_id = cursor or NEWEST_CURSOR
         cursor = self.conn.cursor()
         cursor.execute(
-            'SELECT * FROM inbox_messages WHERE email_address = ? ORDER BY received_at DESC',
-            (email_address,)
+            NEWER_INBOX_PAGE_SQL if newer else OLDER_INBOX_PAGE_SQL,
+            (user_id, received_at, message_id, limit, limit)
         )
+        rows = cursor.fetchall()
+        return rows[::-1] if newer else rows
+
+    def get_inbox_message(self, message_id, user_id):
+        """Load one full message owned by user_id and mark it read"""
+        cursor = self.conn.cursor()
+        cursor.execute(INBOX_MESSAGE_SQL, (message_id, user_id))
+        message = cursor.fetchone()
+        if message and not message[6]:
+            cursor.execute('UPDATE inbox_messages SET is_read = 1 WHERE id = ?', (message_id,))
+            self.conn.commit()
+        return message
+
+    # Attachment methods
+    def get_message_attachments(self, message_id):
+        """(id, filename, content_type, size) of every attachment of a message"""
+        cursor = self.conn.cursor()
+        cursor.execute(MESSAGE_ATTACHMENTS_SQL, (message_id,))
         return cursor.fetchall()
 
-    def get_all_user_inbox(self, user_id):
+    def get_attachment(self, attachment_id, user_id):
+        """(filename, content_type, size, hash) of an attachment user_id may read"""
+        cursor = self.conn.cursor()
+        cursor.execute(ATTACHMENT_SQL, (attachment_id, user_id))
+        return cursor.fetchone()
+
+    def get_referenced_attachments(self, hashes):
+        """The subset of spool hashes some message still refers to"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            f'SELECT DISTINCT hash FROM message_attachments WHERE hash IN ({", ".join("?" * len(hashes))})',
+            list(hashes)
+        )
+        return {row[0] for row in cursor.fetchall()}
+
+    # Full-text search methods
+    def search_inbox(self, user_id, terms, limit=10, offset=0, with_rank=False):
+        """Rank message headers matching every term, best match first.
+
+        with_rank=True appends each row's bm25 rank (lower is better), for
+        merging results from several databases.
+        """
+        query = build_match_query(terms, user_id)
+        if not query:
+            return []
+        cursor = self.conn.cursor()
+        cursor.execute(SEARCH_INBOX_SQL, (query, user_id, limit, offset))
+        rows = cursor.fetchall()
+        return rows if with_rank else [row[:-1] for row in rows]
+
+    def rebuild_search_index(self):
+        """Re-index every stored message and merge the index into one segment"""
+        cursor = self.conn.cursor()
+        cursor.execute("INSERT INTO inbox_fts (inbox_fts) VALUES ('rebuild')")
+        cursor.execute("INSERT INTO inbox_fts (inbox_fts) VALUES ('optimize')")
+        self.conn.commit()
+
+    # Retention methods
+    def purge_deactivated_messages(self, limit):
+        """Delete up to `limit` messages of deactivated addresses; returns the count"""
+        deleted = 0
+        while deleted < limit:
+            queued = self.get_purge_queue(1)
+            if not queued:
+                break
+            count = self.delete_address_messages(queued[0], limit - deleted)
+            deleted += count
+            if deleted < limit:
+                # Fewer rows than asked for: this address has nothing left
+                self.dequeue_purge(queued[0])
+        return deleted
+
+    def get_purge_queue(self, limit):
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT email_address FROM address_purge_queue LIMIT ?', (limit,))
+        return [row[0] for row in cursor.fetchall()]
+
+    def delete_address_messages(self, email_address, limit):
+        """Delete up to `limit` messages sent to email_address; returns the count"""
+        cursor = self.conn.cursor()
+        cursor.execute(
+            'DELETE FROM inbox_messages WHERE id IN (SELECT id FROM inbox_messages WHERE email_address = ? LIMIT ?)',
+            (email_address, limit)
+        )
+        self.conn.commit()
+        return cursor.rowcount
+
+    def dequeue_purge(self, email_address):
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM address_purge_queue WHERE email_address = ?', (email_address,))
+        self.conn.commit()
+
+    def delete_expired_messages(self, after, free_cutoff, premium_cutoff, limit):
+        """Delete expired messages among the next `limit` older than free_cutoff.
+
+        Walks idx_inbox_messages_received from the (received_at, id) cursor
+        `after`, or from the oldest message when it is None. Everything
+        older than premium_cutoff goes; messages between the two cutoffs go
+        unless their owner is premium. Returns
+        (deleted, next cursor), with a None cursor once the walk is done.
+        """
+        after = after or ('', 0)
         cursor = self.conn.cursor()
         cursor.execute('''
-            SELECT im.* FROM inbox_messages im
-            JOIN fake_emails fe ON im.email_address = fe.email_address
-            WHERE fe.user_id = ? AND fe.is_active = 1
-            ORDER BY im.received_at DESC
-        ''', (user_id,))
-        return cursor.fetchall()
\ No newline at end of file
+            SELECT im.id, im.received_at, u.is_premium
+            FROM inbox_messages im
+            LEFT JOIN fake_emails fe ON fe.email_address = im.email_address
+            LEFT JOIN users u ON u.user_id = fe.user_id
+            WHERE (im.received_at, im.id) > (?, ?) AND im.received_at < ?
+            ORDER BY im.received_at, im.id
+            LIMIT ?
+        ''', (after[0], after[1], free_cutoff, limit))
+        rows = cursor.fetchall()
+        expired = [(message_id,) for message_id, received_at, is_premium in rows
+                   if received_at < premium_cutoff or not is_premium]
+        if expired:
+            cursor.executemany('DELETE FROM inbox_messages WHERE id = ?', expired)
+            self.conn.commit()
+        next_cursor = (rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+        return len(expired), next_cursor
+
+    def incremental_vacuum(self, max_pages):
+        """Return up to max_pages free pages to the OS; reports (bytes released, bytes still free)"""
+        cursor = self.conn.cursor()
+        page_size = cursor.execute('PRAGMA page_size').fetchone()[0]
+        if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            return 0, cursor.execute('PRAGMA freelist_count').fetchone()[0] * page_size
+
+        before = cursor.execute('PRAGMA page_count').fetchone()[0]
+        # Frees one page per step; executescript steps the pragma to completion
+        self.conn.executescript(f'PRAGMA incremental_vacuum({int(max_pages)});')
+        after = cursor.execute('PRAGMA page_count').fetchone()[0]
+        return (before - after) * page_size, cursor.execute('PRAGMA freelist_count').fetchone()[0] * page_size
@@ -0,0 +1,157 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from config import INBOX_WRITER_MAX_BATCH, INBOX_WRITER_FLUSH_INTERVAL, INBOX_WRITER_MAX_PENDING
+
+logger = logging.getLogger(__name__)
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+class InboxWriter:
+    """Write-behind queue that group-commits inbound messages.
+
+    A batch is flushed with one executemany transaction as soon as it holds
+    max_batch messages or flush_interval seconds after its first message
+    arrived, whichever comes first, so a submitted message is durable within
+    roughly flush_interval plus one commit. At most max_pending messages may
+    wait in the queue; submit() blocks beyond that, pushing backpressure to
+    the SMTP sessions feeding it. on_commit, if given, is called with each
+    committed batch of (email_address, sender, subject, body, attachments)
+    tuples.
+    """
+
+    def __init__(self, db, max_batch=INBOX_WRITER_MAX_BATCH,
+                 flush_interval=INBOX_WRITER_FLUSH_INTERVAL, max_pending=INBOX_WRITER_MAX_PENDING,
+                 on_commit=None, metrics_window=1024):
+        self.db = db
+        self.on_commit = on_commit
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._queue = asyncio.Queue(maxsize=max_pending)
+        self._batch_ready = asyncio.Event()
+        self._closing = False
+        self._task = None
+
+        self.batches = 0
+        self.messages = 0
+        self.errors = 0
+        self._flush_latencies = deque(maxlen=metrics_window)
+        self._batch_sizes = deque(maxlen=metrics_window)
+        # Immutable copies of both windows, replaced on the loop after each flush;
+        # metrics() runs on the metrics server's thread and only reads these
+        self._recent = ((), ())
+
+    async def start(self):
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self, timeout=30):
+        """Stop accepting messages and flush everything already queued"""
+        if not self._task:
+            return
+        self._closing = True
+        await self._queue.put(None)
+        try:
+            await asyncio.wait_for(self._task, timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Inbox writer did not drain within {timeout}s; {self._queue.qsize()} messages dropped")
+        self._task = None
+
+    async def submit(self, email_address, sender, subject, body, attachments=(), wait=True):
+        """Queue a message; with wait=True, return only once it is committed"""
+        if self._closing:
+            raise RuntimeError("Inbox writer is shutting down")
+        future = asyncio.get_running_loop().create_future() if wait else None
+        await self._queue.put(((email_address, sender, subject, body, attachments), future))
+        if self._queue.qsize() >= self.max_batch:
+            self._batch_ready.set()
+        if wait:
+            await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                break
+            batch = [first]
+
+            # Linger until the batch is full or the oldest message hits its deadline
+            deadline = loop.time() + self.flush_interval
+            while not self._closing and self._queue.qsize() < self.max_batch - 1:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                self._batch_ready.clear()
+                try:
+                    await asyncio.wait_for(self._batch_ready.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+
+            stop = False
+            while len(batch) < self.max_batch and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self._flush(batch)
+            if stop:
+                break
+
+        # Anything still queued after the sentinel arrived before close
+        remaining = [item for item in self._drain() if item is not None]
+        for start in range(0, len(remaining), self.max_batch):
+            await self._flush(remaining[start:start + self.max_batch])
+
+    def _drain(self):
+        while not self._queue.empty():
+            yield self._queue.get_nowait()
+
+    async def _flush(self, batch):
+        started = time.perf_counter()
+        try:
+            await self.db.add_inbox_messages([message for message, _ in batch])
+        except Exception as e:
+            self.errors += 1
+            logger.error(f"Failed to store {len(batch)} inbox messages: {e}")
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.messages += len(batch)
+        self._flush_latencies.append(time.perf_counter() - started)
+        self._batch_sizes.append(len(batch))
+        self._recent = (tuple(self._flush_latencies), tuple(self._batch_sizes))
+        for _, future in batch:
+            if future is not None and not future.done():
+                future.set_result(None)
+
+        if self.on_commit:
+            try:
+                self.on_commit([message for message, _ in batch])
+            except Exception as e:
+                logger.error(f"Inbox commit listener failed: {e}")
+
+    def metrics(self):
+        """Queue depth plus flush latency (seconds) and batch size over recent flushes"""
+        flush_latencies, batch_sizes = self._recent
+        return {
+            'queue_depth': self._queue.qsize(),
+            'batches': self.batches,
+            'messages': self.messages,
+            'errors': self.errors,
+            'flush_latency_p50': percentile(flush_latencies, 0.50),
+            'flush_latency_p99': percentile(flush_latencies, 0.99),
+            'flush_latency_max': max(flush_latencies, default=0.0),
+            'batch_size_mean': sum(batch_sizes) / len(batch_sizes) if batch_sizes else 0.0,
+            'batch_size_max': max(batch_sizes, default=0),
+        }
@@ -1,69 +1,129 @@
+import base64
 import random
+import secrets
 import string
-from database import Database
-from config import DOMAIN
+from address_allocator import AddressAllocator
+from quota_cache import Quota, QuotaCache
+from page_cache import PageCache
+from config import FREE_USER_MAIL_LIMIT, PREMIUM_USER_MAIL_LIMIT
 
 class MailManager:
-    def __init__(self):
-        self.db = Database()
-
-    def generate_random_email(self):
-        """Generate a random email address with wizard.com domain"""
-        username_length = random.randint(6, 10)
-        username = ''.join(random.choices(string.ascii_lowercase, k=username_length))
-        return f"{username}@{DOMAIN}"
+    def __init__(self, db, recipients=None):
+        # The bot's storage handle; one pool of connections serves every component
+        self.db = db
+        # Shared address -> user_id map of deliverable addresses (see MailServer)
+        self.recipients = recipients if recipients is not None else {}
+        self.allocator = AddressAllocator(self.db)
+        self.quota_cache = QuotaCache()
+        # Rendered address-list pages; dropped whenever the user's addresses change
+        self.address_pages = PageCache()
 
     def generate_password(self):
         """Generate a random password"""
         return ''.join(random.choices(string.ascii_letters + string.digits, k=8))
 
-    def create_fake_email(self, user_id):
+    def generate_premium_code(self):
+        """Random 16-character code (80 bits) in base32, so it is easy to type"""
+        return base64.b32encode(secrets.token_bytes(10)).decode('ascii')
+
+    async def get_quota(self, user_id):
+        """Get the user's quota state, from the cache when possible"""
+        quota = self.quota_cache.get(user_id)
+        if quota is None:
+            generation = self.quota_cache.begin_load(user_id)
+            try:
+                state = await self.db.get_quota_state(user_id)
+                quota = Quota(*state) if state else Quota(False, 0)
+            finally:
+                # Not cached if premium changed or addresses were counted meanwhile
+                self.quota_cache.end_load(user_id, generation, quota)
+        return quota
+
+    def invalidate_user(self, user_id):
+        """Forget cached state after the user's premium status changed"""
+        self.quota_cache.invalidate(user_id)
+        self.address_pages.invalidate(user_id)
+
+    async def create_fake_email(self, user_id):
         """Create a new fake email for user"""
         # Check user's email limit
-        user = self.db.get_user(user_id)
-        email_count = self.db.get_email_count(user_id)
-        
-        is_premium = user[2] if user else False
-        limit = 500 if is_premium else 100
-        
-        if email_count >= limit:
-            return None, f"Limit reached! Free users: 100 emails, Premium: 500 emails. You have {email_count}/{limit}"
-
-        # Generate unique email
-        max_attempts = 10
-        for _ in range(max_attempts):
-            email = self.generate_random_email()
-            password = self.generate_password()
-            
-            if self.db.create_fake_email(user_id, email, password):
-                return email, password
-        
-        return None, "Failed to generate unique email. Please try again."
+        quota = await self.get_quota(user_id)
+        if quota.count >= quota.limit:
+            return None, (
+                f"Limit reached! Free users: {FREE_USER_MAIL_LIMIT} emails, Premium: {PREMIUM_USER_MAIL_LIMIT} emails. "
+                f"You have {quota.count}/{quota.limit}"
+            )
 
-    def get_user_emails_list(self, user_id):
-        """Get formatted list of user's fake emails"""
-        emails = self.db.get_user_emails(user_id)
-        email_list = []
-        
-        for i, email in enumerate(emails, 1):
-            email_list.append(f"{i}. {email[2]} | /delete_{email[0]}")
-        
-        return "\n".join(email_list) if email_list else "No fake emails created yet."
+        # The allocator guarantees uniqueness, so no retry loop is needed
+        email = await self.allocator.allocate()
+        password = self.generate_password()
+
+        if await self.db.create_fake_email(user_id, email, password):
+            self.recipients[email] = user_id
+            self.quota_cache.adjust(user_id, 1)
+            self.address_pages.invalidate(user_id)
+            return email, password
+
+        return None, "Failed to create email. Please try again."
+
+    async def create_fake_emails(self, user_id, count):
+        """Create `count` fake emails at once; returns ([(email, password)], None) or (None, error)"""
+        quota = await self.get_quota(user_id)
+        if count > quota.remaining:
+            return None, (
+                f"Not enough quota for {count} emails. You have {quota.count}/{quota.limit}, "
+                f"so you can create {quota.remaining} more."
+            )
+
+        emails = await self.allocator.allocate_many(count)
+        created = [(email, self.generate_password()) for email in emails]
+
+        if await self.db.create_fake_emails(user_id, created):
+            for email in emails:
+                self.recipients[email] = user_id
+            self.quota_cache.adjust(user_id, count)
+            self.address_pages.invalidate(user_id)
+            return created, None
+
+        return None, "Failed to create emails. Please try again."
+
+    async def create_premium_codes(self, created_by, count, duration_days):
+        """Mint `count` random codes in one transaction; returns them, or None on failure"""
+        # Colliding 80-bit codes are practically impossible, so one retry covers it
+        for _ in range(2):
+            codes = [self.generate_premium_code() for _ in range(count)]
+            if await self.db.create_premium_codes(codes, created_by, duration_days):
+                return codes
+        return None
+
+    async def redeem_premium_code(self, user_id, code):
+        """Redeem a code atomically; returns (duration_days, expiry) or None"""
+        redeemed = await self.db.redeem_premium_code(code, user_id)
+        if redeemed:
+            self.invalidate_user(user_id)
+        return redeemed
+
+    async def get_address_page(self, user_id, cursor=None, limit=10, newer=False):
+        """One keyset page of (id, email_address), newest first"""
+        return await self.db.get_email_page(user_id, cursor, limit, newer)
 
-    def delete_email(self, email_id, user_id):
+    async def delete_email(self, email_id, user_id):
         """Delete a fake email"""
-        return self.db.delete_fake_email(email_id, user_id)
+        email = await self.db.delete_fake_email(email_id, user_id)
+        if email:
+            self.recipients.pop(email, None)
+            self.quota_cache.adjust(user_id, -1)
+            self.address_pages.invalidate(user_id)
+        return email is not None
 
-    def get_user_stats(self, user_id):
+    async def get_user_stats(self, user_id):
         """Get user statistics"""
-        user = self.db.get_user(user_id)
-        email_count = self.db.get_email_count(user_id)
-        is_premium = user[2] if user else False
-        limit = 500 if is_premium else 100
+        quota = await self.get_quota(user_id)
         
         return {
-            'email_count': email_count,
-            'is_premium': is_premium,
-            'limit': limit,
-            'remaining': limit - email_count
+            'email_count': quota.count,
+            'is_premium': quota.is_premium,
+            'premium_expiry': quota.premium_expiry,
+            'limit': quota.limit,
+            'remaining': quota.remaining
         }
\ No newline at end of file
@@ -0,0 +1,137 @@
+"""Maintenance commands for the bot database.
+
+    python manage.py rebuild-search   # re-index all stored mail for /search
+    python manage.py body-report      # storage saved by compressed bodies
+    python manage.py vacuum           # compact the file and enable incremental vacuum
+    python manage.py shard-inbox      # move stored mail into the INBOX_SHARDS shard files
+
+Commands that touch mail cover the main file and every inbox shard.
+"""
+import argparse
+import contextlib
+import time
+from database import Database
+from sharded_database import InboxShard, shard_for, shard_paths, merge_body_reports
+from config import DATABASE_NAME, INBOX_SHARDS
+
+SHARD_CHUNK = 1000
+
+@contextlib.contextmanager
+def inbox_databases(db, args):
+    """The main database followed by every inbox shard"""
+    shards = [InboxShard(path, main_path=args.database) for path in shard_paths(args.database, args.shards)]
+    try:
+        yield [db] + shards
+    finally:
+        for shard in shards:
+            shard.close()
+
+def rebuild_search(db, args):
+    started = time.perf_counter()
+    count = 0
+    with inbox_databases(db, args) as databases:
+        for database in databases:
+            database.rebuild_search_index()
+            count += database.conn.execute('SELECT COUNT(*) FROM inbox_messages').fetchone()[0]
+    print(f"Indexed {count} messages in {time.perf_counter() - started:.1f}s")
+
+def body_report(db, args):
+    with inbox_databases(db, args) as databases:
+        report = merge_body_reports([database.get_body_storage_report() for database in databases])
+    print(f"Messages:           {report['messages']}")
+    print(f"Distinct bodies:    {report['distinct_bodies']}")
+    print(f"Inline size:        {report['inline_bytes']} bytes")
+    print(f"After dedup:        {report['deduplicated_bytes']} bytes")
+    print(f"Stored (dedup+zip): {report['stored_bytes']} bytes")
+    print(f"Saved:              {report['saved_bytes']} bytes ({report['saved_ratio']:.1%})")
+
+def vacuum(db, args):
+    # auto_vacuum can only be switched on an existing database by a full VACUUM
+    released = 0
+    with inbox_databases(db, args) as databases:
+        for database in databases:
+            conn = database.conn
+            size_before = conn.execute('PRAGMA page_count').fetchone()[0]
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            page_size, size_after = (conn.execute(f'PRAGMA {name}').fetchone()[0] for name in ('page_size', 'page_count'))
+            released += (size_before - size_after) * page_size
+    print(f"Released {released} bytes; incremental vacuum enabled")
+
+def shard_inbox(db, args):
+    # Messages get new ids in their shard, so links in old bot messages stop working.
+    # Each shard records the last main id it took over in the same transaction as
+    # the copy, so a run interrupted before the delete resumes without duplicates.
+    if not args.shards:
+        print("Set INBOX_SHARDS in config.py (or pass --shards) first")
+        return
+    started = time.perf_counter()
+    moved = 0
+    with inbox_databases(db, args) as databases:
+        shards = databases[1:]
+        moved_through = [shard.conn.execute('SELECT last_message_id FROM moved_from_main').fetchone()[0]
+                         for shard in shards]
+        while True:
+            rows = db.conn.execute('''
+                SELECT im.id, im.email_address, im.user_id, im.sender, im.subject, im.received_at, im.is_read,
+                       mb.hash, mb.codec, mb.data, mb.size
+                FROM inbox_messages im JOIN message_bodies mb ON mb.hash = im.body_hash
+                ORDER BY im.id LIMIT ?
+            ''', (SHARD_CHUNK,)).fetchall()
+            if not rows:
+                break
+            attachments = {}
+            for message_id, *attachment in db.conn.execute(
+                'SELECT message_id, filename, content_type, size, hash FROM message_attachments '
+                'WHERE message_id BETWEEN ? AND ?', (rows[0][0], rows[-1][0])
+            ):
+                attachments.setdefault(message_id, []).append(attachment)
+            for index, shard in enumerate(shards):
+                batch = [row for row in rows
+                         if row[0] > moved_through[index] and shard_for(row[1], args.shards) == index]
+                shard.conn.executemany(
+                    'INSERT INTO message_bodies (hash, codec, data, size) VALUES (?, ?, ?, ?) ON CONFLICT (hash) DO NOTHING',
+                    [row[7:] for row in batch]
+                )
+                for row in batch:
+                    cursor = shard.conn.execute(
+                        'INSERT INTO inbox_messages (email_address, user_id, sender, subject, received_at, is_read, body_hash) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?)', row[1:8]
+                    )
+                    shard.conn.executemany(
+                        'INSERT INTO message_attachments (message_id, filename, content_type, size, hash) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        [(cursor.lastrowid, *attachment) for attachment in attachments.get(row[0], ())]
+                    )
+                shard.conn.execute('UPDATE moved_from_main SET last_message_id = ?', (rows[-1][0],))
+                shard.conn.commit()
+                moved_through[index] = rows[-1][0]
+            db.conn.executemany('DELETE FROM inbox_messages WHERE id = ?', [(row[0],) for row in rows])
+            db.conn.commit()
+            moved += len(rows)
+    print(f"Moved {moved} messages into {args.shards} shards in {time.perf_counter() - started:.1f}s")
+
+COMMANDS = {
+    'rebuild-search': (rebuild_search, "Rebuild and optimize the full-text search index"),
+    'body-report': (body_report, "Report storage saved by compressed, deduplicated bodies"),
+    'vacuum': (vacuum, "Compact the database and enable incremental vacuum (stop the bot first)"),
+    'shard-inbox': (shard_inbox, "Move mail from the main database into the inbox shards (stop the bot first)"),
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Mail Bot maintenance")
+    parser.add_argument('--database', default=DATABASE_NAME)
+    parser.add_argument('--shards', type=int, default=INBOX_SHARDS, help="inbox shard files next to --database")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name, (_, help_text) in COMMANDS.items():
+        subparsers.add_parser(name, help=help_text)
+    args = parser.parse_args()
+
+    db = Database(args.database)
+    try:
+        COMMANDS[args.command][0](db, args)
+    finally:
+        db.close()
+
+if __name__ == '__main__':
+    main()
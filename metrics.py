@@ -0,0 +1,228 @@
+"""Latency histograms and counters exposed in Prometheus text format.
+
+Handlers are wrapped by FakeMailBot.setup_handlers and database calls by
+AsyncDatabase when METRICS_ENABLED is set; otherwise nothing is wrapped and
+the only cost is the check made once at startup. MetricsServer serves
+/metrics from a Flask app on its own thread, and /debug/profile when the
+sampling profiler is enabled.
+"""
+import bisect
+import collections
+import functools
+import logging
+import sys
+import threading
+import time
+from config import METRICS_HOST, METRICS_PORT, METRICS_SLOW_QUERY_MS, METRICS_PROFILER_ENABLED
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def rows_in(result):
+    """Rows a Database method returned: a fetchall list, one fetchone row, or none"""
+    if isinstance(result, list):
+        return len(result)
+    if isinstance(result, tuple):
+        return 1
+    return 0
+
+class Histogram:
+    __slots__ = ('counts', 'total', 'count')
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+class MetricsRegistry:
+    """Thread-safe store of per-label histograms and counters.
+
+    Metrics are keyed by (name, label value) with a single label per metric
+    family, which is all the bot needs. Collectors are callables returning a
+    dict of numbers (e.g. InboxWriter.metrics) and are read at scrape time.
+    """
+
+    def __init__(self, namespace='fakemail'):
+        self.namespace = namespace
+        self._lock = threading.Lock()
+        self._histograms = {}  # (family, label name) -> {label value: Histogram}
+        self._counters = {}  # (family, label name) -> {label value: number}
+        self._help = {}
+        self._collectors = {}
+
+    def describe(self, family, help_text):
+        self._help[family] = help_text
+
+    def observe(self, family, label, value, seconds):
+        with self._lock:
+            series = self._histograms.setdefault((family, label), {})
+            histogram = series.get(value)
+            if histogram is None:
+                histogram = series[value] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, family, label, value, amount=1):
+        with self._lock:
+            series = self._counters.setdefault((family, label), {})
+            series[value] = series.get(value, 0) + amount
+
+    def register_collector(self, prefix, collect):
+        self._collectors[prefix] = collect
+
+    def render(self):
+        """The whole registry in Prometheus text exposition format 0.0.4"""
+        lines = []
+        with self._lock:
+            histograms = {key: {v: (list(h.counts), h.total, h.count) for v, h in series.items()}
+                          for key, series in self._histograms.items()}
+            counters = {key: dict(series) for key, series in self._counters.items()}
+
+        for (family, label), series in sorted(histograms.items()):
+            name = f'{self.namespace}_{family}'
+            lines.append(f'# HELP {name} {self._help.get(family, family)}')
+            lines.append(f'# TYPE {name} histogram')
+            for value, (counts, total, count) in sorted(series.items()):
+                labels = f'{label}="{escape_label(value)}"'
+                cumulative = 0
+                for bound, bucket in zip(LATENCY_BUCKETS, counts):
+                    cumulative += bucket
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {count}')
+                lines.append(f'{name}_sum{{{labels}}} {total}')
+                lines.append(f'{name}_count{{{labels}}} {count}')
+
+        for (family, label), series in sorted(counters.items()):
+            name = f'{self.namespace}_{family}'
+            lines.append(f'# HELP {name} {self._help.get(family, family)}')
+            lines.append(f'# TYPE {name} counter')
+            for value, amount in sorted(series.items()):
+                lines.append(f'{name}{{{label}="{escape_label(value)}"}} {amount}')
+
+        for prefix, collect in sorted(self._collectors.items()):
+            try:
+                values = collect() or {}
+            except Exception as e:
+                logger.error(f"Metrics collector {prefix} failed: {e}")
+                continue
+            for key, value in sorted(values.items()):
+                if isinstance(value, bool):
+                    value = int(value)
+                if not isinstance(value, (int, float)):
+                    continue
+                name = f'{self.namespace}_{prefix}_{key}'
+                lines.append(f'# TYPE {name} gauge')
+                lines.append(f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+    # Instrumentation
+    def instrument_handler(self, name, callback, label_of=None):
+        """Wrap a PTB handler callback; label_of(update) can refine the label"""
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            label = label_of(update) if label_of else name
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                self.increment('handler_errors_total', 'handler', label)
+                raise
+            finally:
+                self.observe('handler_seconds', 'handler', label, time.perf_counter() - started)
+        return wrapper
+
+    def timed_call(self, method, call, slow_seconds=METRICS_SLOW_QUERY_MS / 1000):
+        """Run call() as Database.<method>, recording latency, rows and errors"""
+        started = time.perf_counter()
+        try:
+            result = call()
+        except Exception:
+            self.increment('db_errors_total', 'method', method)
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            self.observe('db_query_seconds', 'method', method, seconds)
+            if seconds >= slow_seconds:
+                logger.warning(f"Slow query: Database.{method} took {seconds * 1000:.1f} ms")
+        self.increment('db_rows_total', 'method', method, rows_in(result))
+        return result
+
+REGISTRY = MetricsRegistry()
+REGISTRY.describe('handler_seconds', "Time spent in each bot handler")
+REGISTRY.describe('handler_errors_total', "Exceptions raised out of bot handlers")
+REGISTRY.describe('db_query_seconds', "Time spent in each Database method on a pool worker")
+REGISTRY.describe('db_errors_total', "Exceptions raised by Database methods")
+REGISTRY.describe('db_rows_total', "Rows returned by Database methods")
+
+def sample_stacks(seconds, interval, exclude=()):
+    """Sample every thread's stack; returns collapsed stacks ("a;b;c count") hottest first"""
+    stacks = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id in exclude:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]}:{frame.f_lineno})')
+                frame = frame.f_back
+            stacks[';'.join(reversed(names))] += 1
+        time.sleep(interval)
+    return '\n'.join(f'{stack} {count}' for stack, count in stacks.most_common()) + '\n'
+
+class MetricsServer:
+    """Serves the registry (and optionally the profiler) over HTTP on a background thread"""
+
+    def __init__(self, registry=REGISTRY, host=METRICS_HOST, port=METRICS_PORT,
+                 profiler_enabled=METRICS_PROFILER_ENABLED):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.profiler_enabled = profiler_enabled
+        self._server = None
+        self._thread = None
+
+    def create_app(self):
+        from flask import Flask, Response, request
+
+        app = Flask(__name__)
+
+        @app.route('/metrics')
+        def metrics():
+            return Response(self.registry.render(), mimetype='text/plain; version=0.0.4')
+
+        if self.profiler_enabled:
+            @app.route('/debug/profile')
+            def profile():
+                # Blocks only this request's thread while sampling
+                seconds = min(float(request.args.get('seconds', 10)), 60)
+                interval = max(float(request.args.get('interval', 0.005)), 0.001)
+                stacks = sample_stacks(seconds, interval, exclude={threading.get_ident()})
+                return Response(stacks, mimetype='text/plain')
+
+        return app
+
+    def start(self):
+        from werkzeug.serving import make_server
+
+        self._server = make_server(self.host, self.port, self.create_app(), threaded=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics', daemon=True)
+        self._thread.start()
+        logger.info(f"Metrics available on http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._thread.join()
+            self._server = None
+            self._thread = None
@@ -0,0 +1,322 @@
+"""Versioned schema migrations applied in order at startup.
+
+Each migration is (version, description, steps), where a step is an SQL
+statement or a callable taking the connection. Applied versions are
+recorded in the schema_version table, so every step runs exactly once per
+database file. Append new migrations to the end of MIGRATIONS; never edit or
+reorder one that has shipped.
+"""
+from body_store import encode_body
+
+# Schema objects shared by MIGRATIONS and SHARD_MIGRATIONS
+INBOX_ADDRESS_INDEX = (
+    'CREATE INDEX IF NOT EXISTS idx_inbox_messages_address_received '
+    'ON inbox_messages (email_address, received_at)'
+)
+INBOX_RECEIVED_INDEX = 'CREATE INDEX IF NOT EXISTS idx_inbox_messages_received ON inbox_messages (received_at)'
+INBOX_BODY_HASH_INDEX = 'CREATE INDEX IF NOT EXISTS idx_inbox_messages_body_hash ON inbox_messages (body_hash)'
+MESSAGE_BODIES_TABLE = '''CREATE TABLE IF NOT EXISTS message_bodies (
+    hash TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    refcount INTEGER NOT NULL DEFAULT 0
+)'''
+SEARCH_CONTENT_VIEW = '''CREATE VIEW IF NOT EXISTS inbox_search_content AS
+    SELECT im.id, im.sender, im.subject, body_text(mb.codec, mb.data) AS body
+    FROM inbox_messages im LEFT JOIN message_bodies mb ON mb.hash = im.body_hash'''
+SEARCH_INDEX_TABLE = '''CREATE VIRTUAL TABLE IF NOT EXISTS inbox_fts USING fts5(
+    sender, subject, body,
+    content='inbox_search_content', content_rowid='id',
+    tokenize='unicode61 remove_diacritics 2'
+)'''
+# Reference counts and the search index follow message inserts and deletes
+MESSAGE_INSERT_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS inbox_messages_insert AFTER INSERT ON inbox_messages BEGIN
+    UPDATE message_bodies SET refcount = refcount + 1 WHERE hash = new.body_hash;
+    INSERT INTO inbox_fts (rowid, sender, subject, body) VALUES (
+        new.id, new.sender, new.subject,
+        (SELECT body_text(codec, data) FROM message_bodies WHERE hash = new.body_hash)
+    );
+END'''
+MESSAGE_DELETE_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS inbox_messages_delete AFTER DELETE ON inbox_messages BEGIN
+    INSERT INTO inbox_fts (inbox_fts, rowid, sender, subject, body) VALUES (
+        'delete', old.id, old.sender, old.subject,
+        (SELECT body_text(codec, data) FROM message_bodies WHERE hash = old.body_hash)
+    );
+    UPDATE message_bodies SET refcount = refcount - 1 WHERE hash = old.body_hash;
+    DELETE FROM message_bodies WHERE hash = old.body_hash AND refcount <= 0;
+END'''
+# Version 11 of the search index prefixes every word with its owner's user
+# id (see database.owned_text), so each indexed term holds one user's mail
+# and bm25 gathers its statistics from that user's messages alone
+OWNED_SEARCH_CONTENT_VIEW = '''CREATE VIEW IF NOT EXISTS inbox_search_content AS
+    SELECT im.id,
+           owned_text(im.user_id, im.sender) AS sender,
+           owned_text(im.user_id, im.subject) AS subject,
+           owned_text(im.user_id, body_text(mb.codec, mb.data)) AS body
+    FROM inbox_messages im LEFT JOIN message_bodies mb ON mb.hash = im.body_hash'''
+OWNED_MESSAGE_INSERT_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS inbox_messages_insert AFTER INSERT ON inbox_messages BEGIN
+    UPDATE message_bodies SET refcount = refcount + 1 WHERE hash = new.body_hash;
+    INSERT INTO inbox_fts (rowid, sender, subject, body) VALUES (
+        new.id, owned_text(new.user_id, new.sender), owned_text(new.user_id, new.subject),
+        (SELECT owned_text(new.user_id, body_text(codec, data)) FROM message_bodies WHERE hash = new.body_hash)
+    );
+END'''
+OWNED_MESSAGE_DELETE_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS inbox_messages_delete AFTER DELETE ON inbox_messages BEGIN
+    INSERT INTO inbox_fts (inbox_fts, rowid, sender, subject, body) VALUES (
+        'delete', old.id, owned_text(old.user_id, old.sender), owned_text(old.user_id, old.subject),
+        (SELECT owned_text(old.user_id, body_text(codec, data)) FROM message_bodies WHERE hash = old.body_hash)
+    );
+    UPDATE message_bodies SET refcount = refcount - 1 WHERE hash = old.body_hash;
+    DELETE FROM message_bodies WHERE hash = old.body_hash AND refcount <= 0;
+END'''
+# Shared by MIGRATIONS and SHARD_MIGRATIONS; a shard resolves fake_emails
+# in the attached main database
+SCOPE_SEARCH_BY_OWNER = [
+    'ALTER TABLE inbox_messages ADD COLUMN user_id INTEGER',
+    '''UPDATE inbox_messages SET user_id = (
+        SELECT user_id FROM fake_emails WHERE fake_emails.email_address = inbox_messages.email_address
+    )''',
+    'DROP TRIGGER IF EXISTS inbox_messages_insert',
+    'DROP TRIGGER IF EXISTS inbox_messages_delete',
+    'DROP TABLE IF EXISTS inbox_fts',
+    'DROP VIEW IF EXISTS inbox_search_content',
+    OWNED_SEARCH_CONTENT_VIEW,
+    SEARCH_INDEX_TABLE,
+    OWNED_MESSAGE_INSERT_TRIGGER,
+    OWNED_MESSAGE_DELETE_TRIGGER,
+    "INSERT INTO inbox_fts (inbox_fts) VALUES ('rebuild')",
+]
+# Attachment files live in the spool directory, keyed by their SHA-256
+ATTACHMENTS_TABLE = '''CREATE TABLE IF NOT EXISTS message_attachments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    message_id INTEGER NOT NULL,
+    filename TEXT NOT NULL,
+    content_type TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    hash TEXT NOT NULL
+)'''
+ATTACHMENT_MESSAGE_INDEX = (
+    'CREATE INDEX IF NOT EXISTS idx_message_attachments_message ON message_attachments (message_id)'
+)
+ATTACHMENT_HASH_INDEX = 'CREATE INDEX IF NOT EXISTS idx_message_attachments_hash ON message_attachments (hash)'
+ATTACHMENT_DELETE_TRIGGER = '''CREATE TRIGGER IF NOT EXISTS inbox_messages_delete_attachments
+AFTER DELETE ON inbox_messages BEGIN
+    DELETE FROM message_attachments WHERE message_id = old.id;
+END'''
+
+def move_bodies_out_of_line(conn, chunk_size=1000):
+    """Copy inline bodies into message_bodies, compressed and deduplicated"""
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            'SELECT id, body FROM inbox_messages WHERE id > ? ORDER BY id LIMIT ?', (last_id, chunk_size)
+        ).fetchall()
+        if not rows:
+            break
+        encoded = [(message_id, encode_body(body)) for message_id, body in rows]
+        conn.executemany(
+            'INSERT INTO message_bodies (hash, codec, data, size) VALUES (?, ?, ?, ?) ON CONFLICT (hash) DO NOTHING',
+            [body for _, body in encoded]
+        )
+        conn.executemany(
+            'UPDATE inbox_messages SET body_hash = ? WHERE id = ?',
+            [(body[0], message_id) for message_id, body in encoded]
+        )
+        last_id = rows[-1][0]
+
+    conn.execute('''
+        UPDATE message_bodies SET refcount = (
+            SELECT COUNT(*) FROM inbox_messages WHERE inbox_messages.body_hash = message_bodies.hash
+        )
+    ''')
+
+MIGRATIONS = [
+    (1, "Index active addresses per user", [
+        # get_user_emails / get_email_count; carrying email_address makes the
+        # user side of the get_all_user_inbox join index-only
+        'CREATE INDEX IF NOT EXISTS idx_fake_emails_user_active '
+        'ON fake_emails (user_id, is_active, created_at, email_address)',
+    ]),
+    (2, "Index inbox messages per address by arrival time", [
+        # get_inbox_messages and the message side of get_all_user_inbox
+        INBOX_ADDRESS_INDEX,
+    ]),
+    (3, "Add the address allocator sequence", [
+        # Single row: next unreserved sequence number and the permutation key
+        '''CREATE TABLE IF NOT EXISTS address_sequence (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            next_value INTEGER NOT NULL,
+            permutation_key BLOB NOT NULL
+        )''',
+        'INSERT OR IGNORE INTO address_sequence (id, next_value, permutation_key) VALUES (1, 0, randomblob(16))',
+    ]),
+    (4, "Denormalize each user's active address count", [
+        'ALTER TABLE users ADD COLUMN active_email_count INTEGER NOT NULL DEFAULT 0',
+        # Addresses created before /start never got a users row
+        'INSERT OR IGNORE INTO users (user_id) SELECT DISTINCT user_id FROM fake_emails',
+        '''UPDATE users SET active_email_count = (
+            SELECT COUNT(*) FROM fake_emails
+            WHERE fake_emails.user_id = users.user_id AND fake_emails.is_active = 1
+        )''',
+    ]),
+    (5, "Add full-text search over received mail", [
+        # External-content index: text lives once, in inbox_messages
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS inbox_fts USING fts5(
+            sender, subject, body,
+            content='inbox_messages', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )''',
+        '''CREATE TRIGGER IF NOT EXISTS inbox_fts_insert AFTER INSERT ON inbox_messages BEGIN
+            INSERT INTO inbox_fts (rowid, sender, subject, body)
+            VALUES (new.id, new.sender, new.subject, new.body);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS inbox_fts_delete AFTER DELETE ON inbox_messages BEGIN
+            INSERT INTO inbox_fts (inbox_fts, rowid, sender, subject, body)
+            VALUES ('delete', old.id, old.sender, old.subject, old.body);
+        END''',
+        '''CREATE TRIGGER IF NOT EXISTS inbox_fts_update AFTER UPDATE OF sender, subject, body ON inbox_messages BEGIN
+            INSERT INTO inbox_fts (inbox_fts, rowid, sender, subject, body)
+            VALUES ('delete', old.id, old.sender, old.subject, old.body);
+            INSERT INTO inbox_fts (rowid, sender, subject, body)
+            VALUES (new.id, new.sender, new.subject, new.body);
+        END''',
+        # Backfill messages stored before the index existed
+        "INSERT INTO inbox_fts (inbox_fts) VALUES ('rebuild')",
+    ]),
+    (6, "Move message bodies to compressed, deduplicated storage", [
+        MESSAGE_BODIES_TABLE,
+        'ALTER TABLE inbox_messages ADD COLUMN body_hash TEXT',
+        INBOX_BODY_HASH_INDEX,
+        move_bodies_out_of_line,
+        # The search index read bodies from inbox_messages; rebuild it over a
+        # view that decompresses them with the body_text() function
+        'DROP TRIGGER IF EXISTS inbox_fts_insert',
+        'DROP TRIGGER IF EXISTS inbox_fts_delete',
+        'DROP TRIGGER IF EXISTS inbox_fts_update',
+        'DROP TABLE IF EXISTS inbox_fts',
+        'ALTER TABLE inbox_messages DROP COLUMN body',
+        SEARCH_CONTENT_VIEW,
+        SEARCH_INDEX_TABLE,
+        MESSAGE_INSERT_TRIGGER,
+        MESSAGE_DELETE_TRIGGER,
+        "INSERT INTO inbox_fts (inbox_fts) VALUES ('rebuild')",
+    ]),
+    (7, "Support the retention sweeper", [
+        # Expiry walks messages oldest first
+        INBOX_RECEIVED_INDEX,
+        # Deactivated addresses whose messages still have to be deleted
+        '''CREATE TABLE IF NOT EXISTS address_purge_queue (
+            email_address TEXT PRIMARY KEY,
+            queued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',
+        'INSERT OR IGNORE INTO address_purge_queue (email_address) SELECT email_address FROM fake_emails WHERE is_active = 0',
+    ]),
+    (8, "Index active addresses per user in creation order", [
+        # ids are AUTOINCREMENT, so id order is creation order; pages of the
+        # address list read straight off this index without sorting
+        'CREATE INDEX IF NOT EXISTS idx_fake_emails_user_active_id ON fake_emails (user_id, is_active, id, email_address)',
+    ]),
+    (9, "Record message attachments", [
+        ATTACHMENTS_TABLE,
+        ATTACHMENT_MESSAGE_INDEX,
+        # Spool garbage collection looks files up by hash
+        ATTACHMENT_HASH_INDEX,
+        ATTACHMENT_DELETE_TRIGGER,
+    ]),
+    (10, "Store the premium time each code grants", [
+        # Every code minted so far granted 30 days
+        'ALTER TABLE premium_codes ADD COLUMN duration_days INTEGER NOT NULL DEFAULT 30',
+    ]),
+    (11, "Scope full-text search to the owner of each message", SCOPE_SEARCH_BY_OWNER),
+    (12, "Record which addresses predate the address allocator", [
+        # Permuted addresses never collide with each other, so only rows up to
+        # here need the allocator's filter. Upgrades from before version 3 get
+        # the exact boundary; later databases also include some permuted ones.
+        'ALTER TABLE address_sequence ADD COLUMN legacy_max_id INTEGER NOT NULL DEFAULT 0',
+        'UPDATE address_sequence SET legacy_max_id = (SELECT COALESCE(MAX(id), 0) FROM fake_emails)',
+    ]),
+]
+
+# Inbox shard files (see sharded_database.py) hold only the message tables,
+# already in their current shape; accounts stay in the main database
+SHARD_MIGRATIONS = [
+    (1, "Create the inbox shard schema", [
+        '''CREATE TABLE IF NOT EXISTS inbox_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            email_address TEXT,
+            sender TEXT,
+            subject TEXT,
+            received_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            is_read INTEGER DEFAULT 0,
+            body_hash TEXT
+        )''',
+        INBOX_ADDRESS_INDEX,
+        INBOX_RECEIVED_INDEX,
+        INBOX_BODY_HASH_INDEX,
+        MESSAGE_BODIES_TABLE,
+        SEARCH_CONTENT_VIEW,
+        SEARCH_INDEX_TABLE,
+        MESSAGE_INSERT_TRIGGER,
+        MESSAGE_DELETE_TRIGGER,
+    ]),
+    (2, "Record message attachments", [
+        ATTACHMENTS_TABLE,
+        ATTACHMENT_MESSAGE_INDEX,
+        ATTACHMENT_HASH_INDEX,
+        ATTACHMENT_DELETE_TRIGGER,
+    ]),
+    (3, "Scope full-text search to the owner of each message", SCOPE_SEARCH_BY_OWNER),
+    (4, "Track mail moved in from the main database", [
+        # Highest main-database message id this shard has taken over; see manage.py shard-inbox
+        '''CREATE TABLE IF NOT EXISTS moved_from_main (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_message_id INTEGER NOT NULL
+        )''',
+        'INSERT OR IGNORE INTO moved_from_main (id, last_message_id) VALUES (1, 0)',
+    ]),
+]
+
+def get_schema_version(conn):
+    row = conn.execute('SELECT MAX(version) FROM schema_version').fetchone()
+    return row[0] or 0
+
+def apply_migrations(conn, migrations=MIGRATIONS):
+    """Apply all pending migrations, each in its own transaction"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    conn.commit()
+
+    applied = []
+    for version, description, steps in migrations:
+        if version <= get_schema_version(conn):
+            continue
+
+        # IMMEDIATE takes the write lock up front; re-check so a second
+        # process starting at the same time does not apply the step twice
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            if version <= get_schema_version(conn):
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(
+                'INSERT INTO schema_version (version, description) VALUES (?, ?)',
+                (version, description)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+
+    return applied
@@ -0,0 +1,256 @@
+"""Incremental RFC 822 / MIME parsing for inbound mail.
+
+MessageParser is fed a message one line at a time while it is still
+arriving over SMTP. The first text/plain part (or the first text/html part
+when there is no plain one) becomes the body, capped at MAIL_BODY_MAX_SIZE.
+Every other leaf part is decoded straight into the AttachmentSpool. Only
+header blocks, the capped body, the current line and one spool buffer are
+ever held in memory, so a 10 MB message costs no more than a 10 KB one.
+"""
+import binascii
+import logging
+import mimetypes
+from email import policy
+from email.parser import BytesParser
+from config import MAIL_HEADER_MAX_SIZE, MAIL_BODY_MAX_SIZE, ATTACHMENT_MAX_COUNT
+
+logger = logging.getLogger(__name__)
+
+HEADER_PARSER = BytesParser(policy=policy.default)
+
+def split_line_ending(line):
+    content = line.rstrip(b'\r\n')
+    return content, line[len(content):]
+
+def default_filename(content_type, number):
+    return f'attachment-{number}{mimetypes.guess_extension(content_type) or ".bin"}'
+
+# Decoders turn one line (without its ending) into (data, separator): the
+# separator is written before the next line's data, so the line break that
+# precedes a MIME boundary never ends up in the part.
+class IdentityDecoder:
+    def decode(self, content, ending):
+        return content, ending
+
+    def flush(self):
+        return b''
+
+class QuotedPrintableDecoder:
+    def decode(self, content, ending):
+        content = content.rstrip(b' \t')
+        if content.endswith(b'='):
+            # Soft line break: the next line continues this one
+            return binascii.a2b_qp(content[:-1]), b''
+        return binascii.a2b_qp(content), ending
+
+    def flush(self):
+        return b''
+
+class Base64Decoder:
+    def __init__(self):
+        self._carry = b''
+
+    def decode(self, content, ending):
+        data = self._carry + content.translate(None, b' \t')
+        whole = len(data) - len(data) % 4
+        self._carry = data[whole:]
+        try:
+            return binascii.a2b_base64(data[:whole]), b''
+        except binascii.Error:
+            return b'', b''
+
+    def flush(self):
+        carry, self._carry = self._carry, b''
+        if not carry:
+            return b''
+        try:
+            return binascii.a2b_base64(carry + b'=' * (-len(carry) % 4))
+        except binascii.Error:
+            return b''
+
+DECODERS = {'quoted-printable': QuotedPrintableDecoder, 'base64': Base64Decoder}
+
+class TextSink:
+    """Keeps the first `limit` bytes of a body part"""
+
+    def __init__(self, charset, limit):
+        self.charset = charset
+        self.limit = limit
+        self.data = bytearray()
+
+    def write(self, data):
+        self.data += data[:self.limit - len(self.data)]
+
+    def text(self):
+        try:
+            text = self.data.decode(self.charset, 'replace')
+        except LookupError:
+            text = self.data.decode('utf-8', 'replace')
+        return text.replace('\r\n', '\n')
+
+class MessageParser:
+    """Line-at-a-time MIME parser that spools attachments to disk.
+
+    Call feed() with each line of the message (dot-unstuffed, line ending
+    included), then close() for (sender, subject, body, attachments), where
+    attachments are (filename, content_type, size, sha256) tuples of
+    committed spool files. abort() drops a message that will not be stored.
+
+    feed() never touches the disk. Whenever needs_drain is set afterwards,
+    await drain(), which writes out the spool buffer and commits finished
+    attachments on worker threads; close() and abort() are awaitable too.
+    """
+
+    def __init__(self, spool, body_limit=MAIL_BODY_MAX_SIZE, header_limit=MAIL_HEADER_MAX_SIZE,
+                 max_attachments=ATTACHMENT_MAX_COUNT):
+        self.spool = spool
+        self.body_limit = body_limit
+        self.header_limit = header_limit
+        self.max_attachments = max_attachments
+        self.sender = ''
+        self.subject = ''
+        self.plain = None
+        self.html = None
+        self.attachments = []
+        self.dropped = 0
+
+        self._boundaries = []  # (delimiter, multipart subtype), innermost last
+        self._in_headers = True
+        self._is_top = True
+        self._headers = []
+        self._header_size = 0
+        self._parts = 0
+        self._sink = None
+        self._decoder = None
+        self._separator = b''
+        self._attachment = None  # (filename, content_type) while a spool file is open
+        self._finished = []  # (spool file, (filename, content_type)) awaiting commit
+
+    def feed(self, line):
+        if self._in_headers:
+            if line in (b'\r\n', b'\n'):
+                self._start_part()
+            elif self._header_size < self.header_limit:
+                self._headers.append(line)
+                self._header_size += len(line)
+            return
+
+        if self._boundaries and line.startswith(b'--'):
+            marker = line.rstrip()
+            for depth in range(len(self._boundaries) - 1, -1, -1):
+                delimiter = self._boundaries[depth][0]
+                if marker == delimiter:
+                    self._end_part()
+                    del self._boundaries[depth + 1:]
+                    self._in_headers = True
+                    return
+                if marker == delimiter + b'--':
+                    # Anything up to an enclosing boundary is epilogue
+                    self._end_part()
+                    del self._boundaries[depth:]
+                    return
+
+        if self._sink is not None:
+            data, separator = self._decoder.decode(*split_line_ending(line))
+            if self._separator or data:
+                self._sink.write(self._separator + data)
+            self._separator = separator
+
+    @property
+    def needs_drain(self):
+        return bool(self._finished) or (self._attachment is not None and self._sink.full)
+
+    async def drain(self):
+        if self._attachment is not None and self._sink.full:
+            await self._sink.flush()
+        while self._finished:
+            spool_file, (filename, content_type) = self._finished.pop(0)
+            digest = await spool_file.commit()
+            if digest:
+                self.attachments.append((filename, content_type, spool_file.size, digest))
+            else:
+                self.dropped += 1
+
+    async def close(self):
+        if self._in_headers:
+            self._start_part()
+        self._end_part()
+        await self.drain()
+        body = self.plain or self.html
+        return self.sender, self.subject, body.text() if body else '', self.attachments
+
+    async def abort(self):
+        if self._attachment is not None:
+            self._finished.append((self._sink, self._attachment))
+        self._sink = None
+        self._attachment = None
+        finished, self._finished = self._finished, []
+        for spool_file, _ in finished:
+            await spool_file.discard()
+
+    def _start_part(self):
+        self._in_headers = False
+        self._sink = None
+        self._attachment = None
+        headers = HEADER_PARSER.parsebytes(b''.join(self._headers), headersonly=True)
+        self._headers = []
+        self._header_size = 0
+        try:
+            self._open_part(headers)
+        except Exception as e:
+            # Unparseable headers only cost this part, not the message
+            logger.warning(f"Skipping MIME part with bad headers: {e}")
+            self._sink = None
+            self._attachment = None
+
+    def _open_part(self, headers):
+        if self._is_top:
+            self._is_top = False
+            self.sender = str(headers.get('From', ''))
+            self.subject = str(headers.get('Subject', ''))
+
+        content_type = headers.get_content_type()
+        if headers.get_content_maintype() == 'multipart':
+            boundary = headers.get_boundary()
+            if boundary:
+                # The preamble before the first boundary is ignored
+                self._boundaries.append((b'--' + boundary.encode('utf-8', 'surrogateescape'),
+                                         headers.get_content_subtype()))
+                return
+
+        self._decoder = DECODERS.get(str(headers.get('Content-Transfer-Encoding', '')).strip().lower(),
+                                     IdentityDecoder)()
+        self._separator = b''
+        filename = headers.get_filename()
+        if content_type in ('text/plain', 'text/html') and not filename \
+                and headers.get_content_disposition() != 'attachment':
+            charset = headers.get_content_charset() or 'utf-8'
+            if content_type == 'text/plain' and self.plain is None:
+                self.plain = self._sink = TextSink(charset, self.body_limit)
+                return
+            if content_type == 'text/html' and self.html is None:
+                self.html = self._sink = TextSink(charset, self.body_limit)
+                return
+            if self._boundaries and self._boundaries[-1][1] == 'alternative':
+                # Another rendering of a body that is already kept
+                return
+
+        self._parts += 1
+        pending = sum(not spool_file.oversized for spool_file, _ in self._finished)
+        if len(self.attachments) + pending >= self.max_attachments:
+            self.dropped += 1
+            return
+        self._attachment = (filename or default_filename(content_type, self._parts), content_type)
+        self._sink = self.spool.create()
+
+    def _end_part(self):
+        if self._sink is None:
+            return
+        tail = self._decoder.flush()
+        if tail:
+            self._sink.write(tail)
+        if self._attachment is not None:
+            # Committed by the next drain(), off the event loop
+            self._finished.append((self._sink, self._attachment))
+        self._sink = None
+        self._attachment = None
@@ -0,0 +1,164 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.error import Forbidden, BadRequest, RetryAfter
+from inbox_writer import percentile
+from token_bucket import TokenBucket
+from config import (
+    NOTIFY_GLOBAL_RATE, NOTIFY_CHAT_INTERVAL, NOTIFY_COALESCE_DELAY,
+    NOTIFY_WORKERS, NOTIFY_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+class NotificationDispatcher:
+    """Pushes "new mail" notices to Telegram without tripping flood control.
+
+    Notices for the same chat are coalesced: the first one waits
+    coalesce_delay (and at least chat_interval since the last send to that
+    chat) and everything that arrives meanwhile goes out as a single
+    "N new messages" update. Sends share a global token bucket; a 429
+    pauses the bucket for the requested time and the notice is retried with
+    jitter, and other transient failures back off exponentially.
+    """
+
+    def __init__(self, bot, global_rate=NOTIFY_GLOBAL_RATE, chat_interval=NOTIFY_CHAT_INTERVAL,
+                 coalesce_delay=NOTIFY_COALESCE_DELAY, workers=NOTIFY_WORKERS,
+                 max_retries=NOTIFY_MAX_RETRIES, clock=time.monotonic, metrics_window=1024):
+        self.bot = bot
+        self.bucket = TokenBucket(global_rate, clock=clock)
+        self.chat_interval = chat_interval
+        self.coalesce_delay = coalesce_delay
+        self.workers = workers
+        self.max_retries = max_retries
+        self.clock = clock
+
+        self._pending = {}  # chat_id -> messages not yet announced
+        self._attempts = {}
+        self._last_sent = {}
+        self._ready = asyncio.Queue()
+        self._tasks = []
+
+        self.sent = 0
+        self.retries = 0
+        self.dropped = 0
+        self._send_latencies = deque(maxlen=metrics_window)
+        # Replaced on the loop after each send; metrics() runs on another thread
+        self._recent_latencies = ()
+
+    async def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self, chat_id, count=1):
+        """Record `count` new messages for chat_id; sends are coalesced"""
+        first = chat_id not in self._pending
+        self._pending[chat_id] = self._pending.get(chat_id, 0) + count
+        if first:
+            next_allowed = self._last_sent.get(chat_id, float('-inf')) + self.chat_interval
+            self._schedule(chat_id, max(self.coalesce_delay, next_allowed - self.clock()))
+
+    def _schedule(self, chat_id, delay):
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._ready.put_nowait, chat_id)
+        else:
+            self._ready.put_nowait(chat_id)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            count = self._pending.get(chat_id)
+            if not count:
+                continue
+            await self.bucket.acquire()
+            # Anything that arrived while waiting for a token rides along
+            count = self._pending.pop(chat_id)
+            await self._send(chat_id, count)
+
+    async def _send(self, chat_id, count):
+        started = time.perf_counter()
+        try:
+            await self.bot.send_message(
+                chat_id=chat_id,
+                text=f"📬 You have {count} new message{'s' if count != 1 else ''}!",
+                reply_markup=InlineKeyboardMarkup(
+                    [[InlineKeyboardButton("📨 Check Inbox", callback_data="check_inbox")]]
+                )
+            )
+        except RetryAfter as e:
+            retry_after = float(e.retry_after)
+            self.bucket.pause(retry_after)
+            self._retry(chat_id, count, retry_after * random.uniform(1.0, 1.2))
+            return
+        except (Forbidden, BadRequest) as e:
+            # Blocked the bot or chat is gone; retrying cannot help
+            self.dropped += 1
+            self._attempts.pop(chat_id, None)
+            logger.info(f"Dropping notification for {chat_id}: {e}")
+            return
+        except Exception as e:
+            attempt = self._attempts.get(chat_id, 0)
+            self._retry(chat_id, count, min(60, 2 ** attempt) * random.uniform(0.5, 1.5))
+            logger.warning(f"Notification to {chat_id} failed (attempt {attempt + 1}): {e}")
+            return
+
+        self.sent += 1
+        self._attempts.pop(chat_id, None)
+        now = self.clock()
+        self._last_sent[chat_id] = now
+        self._send_latencies.append(time.perf_counter() - started)
+        self._recent_latencies = tuple(self._send_latencies)
+        if len(self._last_sent) > 10000:
+            # Only sends within the last chat_interval still constrain anything
+            self._last_sent = {
+                chat: sent_at for chat, sent_at in self._last_sent.items() if now - sent_at < self.chat_interval
+            }
+
+    async def send_notice(self, chat_id, text, reply_markup=None):
+        """Send a one-off message within the global rate; failures are logged, not retried"""
+        await self.bucket.acquire()
+        try:
+            await self.bot.send_message(chat_id=chat_id, text=text, reply_markup=reply_markup)
+        except RetryAfter as e:
+            self.bucket.pause(float(e.retry_after))
+            self.dropped += 1
+            logger.warning(f"Dropping notice for {chat_id}: flood control")
+            return
+        except Exception as e:
+            self.dropped += 1
+            logger.info(f"Dropping notice for {chat_id}: {e}")
+            return
+        self.sent += 1
+
+    def _retry(self, chat_id, count, delay):
+        attempt = self._attempts.get(chat_id, 0) + 1
+        if attempt > self.max_retries:
+            self.dropped += 1
+            self._attempts.pop(chat_id, None)
+            logger.error(f"Giving up on notification for {chat_id} after {self.max_retries} retries")
+            return
+        self.retries += 1
+        self._attempts[chat_id] = attempt
+        first = chat_id not in self._pending
+        self._pending[chat_id] = self._pending.get(chat_id, 0) + count
+        if first:
+            self._schedule(chat_id, delay)
+
+    def metrics(self):
+        """Queue depth (chats waiting) plus send outcomes and latency in seconds"""
+        return {
+            'queue_depth': len(self._pending),
+            'sent': self.sent,
+            'retries': self.retries,
+            'dropped': self.dropped,
+            'send_latency_p50': percentile(self._recent_latencies, 0.50),
+            'send_latency_p99': percentile(self._recent_latencies, 0.99),
+        }
@@ -0,0 +1,37 @@
+from collections import OrderedDict
+from config import ADDRESS_PAGE_CACHE_USERS, ADDRESS_PAGE_CACHE_PAGES
+
+class PageCache:
+    """Bounded LRU of rendered pages, grouped by user.
+
+    Pages are keyed by whatever identifies them (e.g. a keyset cursor and
+    direction). Anything that changes what a user's pages show drops all of
+    that user's pages at once with invalidate().
+    """
+
+    def __init__(self, capacity=ADDRESS_PAGE_CACHE_USERS, pages_per_user=ADDRESS_PAGE_CACHE_PAGES):
+        self.capacity = capacity
+        self.pages_per_user = pages_per_user
+        self._users = OrderedDict()
+
+    def get(self, user_id, key):
+        pages = self._users.get(user_id)
+        if pages is None:
+            return None
+        self._users.move_to_end(user_id)
+        return pages.get(key)
+
+    def put(self, user_id, key, page):
+        pages = self._users.get(user_id)
+        if pages is None or len(pages) >= self.pages_per_user:
+            pages = self._users[user_id] = {}
+        pages[key] = page
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.capacity:
+            self._users.popitem(last=False)
+
+    def invalidate(self, user_id):
+        self._users.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._users)
@@ -0,0 +1,127 @@
+import asyncio
+import datetime
+import heapq
+import logging
+import time
+from config import PREMIUM_EXPIRY_MAX_SLEEP
+
+logger = logging.getLogger(__name__)
+
+def expiry_timestamp(value):
+    """premium_expiry as stored (local time, optionally with microseconds) to epoch seconds"""
+    return datetime.datetime.fromisoformat(str(value)).timestamp()
+
+def expiry_cutoff(timestamp):
+    # Microseconds included so both stored formats compare correctly as text
+    return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S.%f')
+
+class PremiumExpiryScheduler:
+    """Downgrades premium users the moment their premium runs out.
+
+    Upcoming expiries sit in a min-heap of (timestamp, user_id), loaded from
+    the users table at startup and pushed to by schedule() whenever premium
+    is granted. One task sleeps until the earliest expiry, or until
+    something earlier is scheduled, then downgrades every user due in a
+    single UPDATE and passes the downgraded ids to on_expired. A heap entry
+    replaced by a later expiry (premium extended) is skipped when popped.
+    The clock is injectable so expiry can be driven without waiting.
+    """
+
+    def __init__(self, db, on_expired=None, clock=time.time, max_sleep=PREMIUM_EXPIRY_MAX_SLEEP,
+                 retry_delay=5.0):
+        self.db = db
+        self.on_expired = on_expired
+        self.clock = clock
+        self.max_sleep = max_sleep
+        self.retry_delay = retry_delay
+        self._heap = []
+        self._expiries = {}  # user_id -> timestamp of the live heap entry
+        self._changed = asyncio.Event()
+        self._task = None
+        self.expired = 0
+
+    async def start(self):
+        await self.load()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def load(self):
+        self._heap.clear()
+        self._expiries.clear()
+        for user_id, premium_expiry in await self.db.get_premium_expiries():
+            try:
+                self._expiries[user_id] = expiry_timestamp(premium_expiry)
+            except ValueError:
+                logger.error(f"User {user_id} has an unreadable premium expiry: {premium_expiry!r}")
+        self._heap = [(expiry, user_id) for user_id, expiry in self._expiries.items()]
+        heapq.heapify(self._heap)
+        logger.info(f"Loaded {len(self._heap)} premium expiries")
+
+    def schedule(self, user_id, expiry):
+        """Expire user_id's premium at `expiry` (epoch seconds), replacing any earlier schedule"""
+        self._expiries[user_id] = expiry
+        heapq.heappush(self._heap, (expiry, user_id))
+        if self._heap[0] == (expiry, user_id):
+            self._changed.set()
+
+    def next_expiry(self):
+        return self._heap[0][0] if self._heap else None
+
+    async def expire_due(self):
+        """Downgrade everyone whose premium has lapsed; returns their user ids"""
+        now = self.clock()
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            expiry, user_id = heapq.heappop(self._heap)
+            if self._expiries.get(user_id) == expiry:
+                due.append((expiry, user_id))
+        if not due:
+            return []
+
+        try:
+            # The cutoff re-checks the stored expiry, so a concurrent extension wins
+            expired = await self.db.expire_premium([user_id for _, user_id in due], expiry_cutoff(now))
+        except Exception:
+            for entry in due:
+                heapq.heappush(self._heap, entry)
+            raise
+        for expiry, user_id in due:
+            if self._expiries.get(user_id) == expiry:
+                del self._expiries[user_id]
+        self.expired += len(expired)
+        if expired:
+            logger.info(f"Premium expired for {len(expired)} users")
+            if self.on_expired:
+                try:
+                    self.on_expired(expired)
+                except Exception as e:
+                    logger.error(f"Premium expiry listener failed: {e}")
+        return expired
+
+    async def _run(self):
+        while True:
+            try:
+                await self.expire_due()
+            except Exception as e:
+                logger.error(f"Premium expiry failed: {e}")
+                await asyncio.sleep(self.retry_delay)
+                continue
+            self._changed.clear()
+            next_expiry = self.next_expiry()
+            delay = self.max_sleep if next_expiry is None else min(self.max_sleep, next_expiry - self.clock())
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    def metrics(self):
+        return {'scheduled': len(self._expiries), 'expired': self.expired}
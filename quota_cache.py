@@ -0,0 +1,79 @@
+from collections import OrderedDict
+from config import FREE_USER_MAIL_LIMIT, PREMIUM_USER_MAIL_LIMIT, QUOTA_CACHE_SIZE
+
+class Quota:
+    __slots__ = ('is_premium', 'limit', 'count', 'premium_expiry')
+
+    def __init__(self, is_premium, count, premium_expiry=None):
+        self.is_premium = bool(is_premium)
+        self.limit = PREMIUM_USER_MAIL_LIMIT if is_premium else FREE_USER_MAIL_LIMIT
+        self.count = count
+        # As stored; only displayed, expiry itself is enforced by PremiumExpiryScheduler
+        self.premium_expiry = premium_expiry
+
+    @property
+    def remaining(self):
+        return max(self.limit - self.count, 0)
+
+class QuotaCache:
+    """Bounded LRU of per-user quota state.
+
+    Counts are adjusted in place when addresses are created or deleted, so
+    they never need recounting; an entry is dropped whenever the user's
+    premium status changes (redeemed or expired) and reloaded on next use.
+
+    Loads are bracketed by begin_load/end_load. Invalidating or adjusting a
+    user bumps their generation, and a load that started in an older
+    generation is not cached, so a read racing a change cannot reinstate
+    stale state. Generations are only kept while a load is in flight.
+    """
+
+    def __init__(self, capacity=QUOTA_CACHE_SIZE):
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        self._loads = {}  # user_id -> [generation, loads in flight]
+
+    def get(self, user_id):
+        quota = self._entries.get(user_id)
+        if quota is not None:
+            self._entries.move_to_end(user_id)
+        return quota
+
+    def put(self, user_id, quota):
+        self._entries[user_id] = quota
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def begin_load(self, user_id):
+        """Note that user_id's quota is being read; returns the generation to pass to end_load"""
+        load = self._loads.setdefault(user_id, [0, 0])
+        load[1] += 1
+        return load[0]
+
+    def end_load(self, user_id, generation, quota=None):
+        """Cache the loaded quota unless the user changed since begin_load"""
+        load = self._loads[user_id]
+        load[1] -= 1
+        if not load[1]:
+            del self._loads[user_id]
+        if quota is not None and load[0] == generation:
+            self.put(user_id, quota)
+
+    def _bump(self, user_id):
+        load = self._loads.get(user_id)
+        if load is not None:
+            load[0] += 1
+
+    def adjust(self, user_id, delta):
+        self._bump(user_id)
+        quota = self._entries.get(user_id)
+        if quota is not None:
+            quota.count = max(quota.count + delta, 0)
+
+    def invalidate(self, user_id):
+        self._bump(user_id)
+        self._entries.pop(user_id, None)
+
+    def __len__(self):
+        return len(self._entries)
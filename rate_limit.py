@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from token_bucket import TokenBucket
+from config import RATE_LIMITS, RATE_LIMIT_PREMIUM_MULTIPLIER, RATE_LIMIT_IDLE_SECONDS
+
+class UserRateLimiter:
+    """Per-user token buckets, one per action, in front of expensive handlers.
+
+    Budgets are (actions per minute, burst) per action; premium users get
+    premium_multiplier times both. Actions without a budget are never
+    limited, so UserRateLimiter(budgets={}) turns limiting off.
+
+    Buckets are kept in least recently used order, so each check drops idle
+    ones from the front in amortized O(1) and memory follows the users
+    active within idle_seconds. A bucket is only dropped once it would have
+    refilled completely, so forgetting it never hands anyone extra actions.
+    """
+
+    def __init__(self, budgets=RATE_LIMITS, premium_multiplier=RATE_LIMIT_PREMIUM_MULTIPLIER,
+                 idle_seconds=RATE_LIMIT_IDLE_SECONDS, clock=time.monotonic):
+        self.budgets = {action: (per_minute / 60, burst) for action, (per_minute, burst) in budgets.items()}
+        self.premium_multiplier = premium_multiplier
+        # Time for an empty bucket to refill, which premium scaling leaves unchanged
+        self.idle_seconds = max([idle_seconds] + [burst / rate for rate, burst in self.budgets.values()])
+        self.clock = clock
+        self._buckets = OrderedDict()  # (user_id, action) -> TokenBucket
+        self.throttled = 0
+
+    def check(self, user_id, action, premium=False):
+        """Spend one of the user's actions; returns 0, or the seconds until one is available"""
+        budget = self.budgets.get(action)
+        if budget is None:
+            return 0
+        now = self.clock()
+        while self._buckets:
+            oldest = next(iter(self._buckets.values()))
+            if now - oldest.updated < self.idle_seconds:
+                break
+            self._buckets.popitem(last=False)
+
+        rate, burst = budget
+        if premium:
+            rate, burst = rate * self.premium_multiplier, burst * self.premium_multiplier
+        key = (user_id, action)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst, clock=self.clock)
+        else:
+            self._buckets.move_to_end(key)
+            # Premium may have started or ended since the bucket was made
+            bucket.rate, bucket.capacity = rate, burst
+
+        wait = bucket.try_acquire()
+        if wait:
+            self.throttled += 1
+        return wait
+
+    def metrics(self):
+        return {'buckets': len(self._buckets), 'throttled': self.throttled}
+
+    def __len__(self):
+        return len(self._buckets)
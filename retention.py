@@ -0,0 +1,121 @@
+import asyncio
+import datetime
+import logging
+import time
+from config import (
+    FREE_RETENTION_DAYS, PREMIUM_RETENTION_DAYS, RETENTION_SWEEP_INTERVAL,
+    RETENTION_CHUNK_SIZE, RETENTION_CYCLE_BUDGET, RETENTION_VACUUM_PAGES, ATTACHMENT_ORPHAN_AGE
+)
+
+logger = logging.getLogger(__name__)
+
+def timestamp_cutoff(days, now=None):
+    """Format now - days the way CURRENT_TIMESTAMP stores received_at (UTC)"""
+    now = now or datetime.datetime.now(datetime.timezone.utc)
+    return (now - datetime.timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+
+class RetentionSweeper:
+    """Deletes expired mail in the background, one small transaction at a time.
+
+    Each sweep first purges messages of deactivated addresses, then walks
+    the oldest messages and drops those past their owner's retention window
+    (FREE_RETENTION_DAYS, or PREMIUM_RETENTION_DAYS for premium users).
+    Work happens on the database pool in chunks of chunk_size rows and stops
+    once cycle_budget seconds are spent, so ingest and handlers are never
+    locked out for long. A walk cut short by the budget resumes where it
+    stopped on the next sweep and only starts over from the oldest message
+    once it has reached the end. Freed pages are then released with an incremental
+    vacuum, and attachment files no message refers to any more are removed
+    from the spool.
+    """
+
+    def __init__(self, db, spool=None, interval=RETENTION_SWEEP_INTERVAL, chunk_size=RETENTION_CHUNK_SIZE,
+                 cycle_budget=RETENTION_CYCLE_BUDGET, vacuum_pages=RETENTION_VACUUM_PAGES,
+                 orphan_age=ATTACHMENT_ORPHAN_AGE):
+        self.db = db
+        self.spool = spool
+        self.orphan_age = orphan_age
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.cycle_budget = cycle_budget
+        self.vacuum_pages = vacuum_pages
+        self.last_cycle = None
+        # Where the expiry walk stopped; opaque, see sweep()
+        self._expiry_cursor = None
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Retention sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    async def sweep(self):
+        """Run one time-boxed retention cycle and return its statistics"""
+        started = time.perf_counter()
+        deadline = started + self.cycle_budget
+
+        purged = 0
+        while time.perf_counter() < deadline:
+            deleted = await self.db.purge_deactivated_messages(self.chunk_size)
+            purged += deleted
+            if deleted < self.chunk_size:
+                break
+
+        expired = 0
+        free_cutoff = timestamp_cutoff(FREE_RETENTION_DAYS)
+        premium_cutoff = timestamp_cutoff(PREMIUM_RETENTION_DAYS)
+        # The cursor is opaque: a (received_at, id) pair, or one per inbox shard
+        completed = False
+        while not completed and time.perf_counter() < deadline:
+            deleted, self._expiry_cursor = await self.db.delete_expired_messages(
+                self._expiry_cursor, free_cutoff, premium_cutoff, self.chunk_size
+            )
+            expired += deleted
+            completed = self._expiry_cursor is None
+
+        bytes_released, bytes_free = await self.db.incremental_vacuum(self.vacuum_pages)
+        attachments_removed = await self.collect_attachments() if self.spool else 0
+
+        self.last_cycle = {
+            'purged_messages': purged,
+            'expired_messages': expired,
+            'attachments_removed': attachments_removed,
+            'bytes_released': bytes_released,
+            'bytes_free': bytes_free,
+            'seconds': time.perf_counter() - started,
+            'completed': completed,
+        }
+        if purged or expired or bytes_released or attachments_removed:
+            logger.info(
+                f"Retention sweep: {purged} purged, {expired} expired, "
+                f"{attachments_removed} attachments removed, "
+                f"{bytes_released} bytes released in {self.last_cycle['seconds']:.2f}s"
+            )
+        return self.last_cycle
+
+    async def collect_attachments(self):
+        """Remove spool files that no stored message refers to"""
+        candidates = await asyncio.to_thread(self.spool.collectable, self.orphan_age)
+        removed = 0
+        for start in range(0, len(candidates), self.chunk_size):
+            chunk = candidates[start:start + self.chunk_size]
+            referenced = await self.db.get_referenced_attachments(chunk)
+            orphans = [digest for digest in chunk if digest not in referenced]
+            await asyncio.to_thread(self.spool.remove, orphans)
+            removed += len(orphans)
+        return removed
@@ -0,0 +1,192 @@
+"""Inbox storage spread over several SQLite files.
+
+SQLite admits one writer per file, so with INBOX_SHARDS > 0 mail moves out
+of DATABASE_NAME into INBOX_SHARDS shard files, each with its own writer
+and reader pool. A message lives in the shard its address hashes to.
+Users, addresses and premium codes stay in the main file, which every
+shard connection attaches, so the inbox queries of Database that join
+fake_emails or users run unchanged on a shard.
+
+Message and attachment ids are global: local id * shard count + shard.
+They stay unique and keep their order within a shard, so keyset cursors
+still work.
+Reads spanning shards are sent to every shard at once and merged by
+(received_at, id), or by bm25 rank for search.
+
+The shard count must not change once mail is stored; see
+manage.py shard-inbox for moving an unsharded inbox into shards.
+"""
+import asyncio
+import heapq
+import itertools
+import os
+import zlib
+from async_database import AsyncDatabase
+from database import Database, connect
+from migrations import apply_migrations, SHARD_MIGRATIONS
+from config import DATABASE_NAME, DB_POOL_SIZE, INBOX_SHARDS, INBOX_SHARD_POOL_SIZE, METRICS_ENABLED
+
+def shard_for(email_address, shard_count):
+    return zlib.crc32(email_address.lower().encode('utf-8')) % shard_count
+
+def shard_paths(path, shard_count):
+    root, extension = os.path.splitext(path)
+    return [f'{root}.inbox{index}{extension}' for index in range(shard_count)]
+
+def merge_body_reports(reports):
+    """Add up get_body_storage_report results from several files"""
+    totals = {key: sum(report[key] for report in reports)
+              for key in ('messages', 'distinct_bodies', 'inline_bytes', 'deduplicated_bytes',
+                          'stored_bytes', 'saved_bytes')}
+    totals['saved_ratio'] = totals['saved_bytes'] / totals['inline_bytes'] if totals['inline_bytes'] else 0.0
+    return totals
+
+class InboxShard(Database):
+    """One shard file, with the main database attached for accounts and addresses"""
+
+    def __init__(self, path, init_schema=True, main_path=DATABASE_NAME):
+        self.conn = connect(path, init_file=init_schema)
+        # Unqualified fake_emails and users resolve to the attached file,
+        # for queries and for migrations that read them
+        self.conn.execute('ATTACH DATABASE ? AS accounts', (main_path,))
+        if init_schema:
+            self.create_tables()
+
+    def create_tables(self):
+        apply_migrations(self.conn, SHARD_MIGRATIONS)
+
+class ShardedAsyncDatabase(AsyncDatabase):
+    """AsyncDatabase whose inbox methods are routed to per-address shards.
+
+    Everything else runs on the main database exactly as before. A batch
+    of messages is split by shard and the parts commit concurrently, each
+    in its own transaction, so a failed batch may be partly stored.
+    """
+
+    def __init__(self, path=DATABASE_NAME, pool_size=DB_POOL_SIZE, shard_count=INBOX_SHARDS,
+                 shard_pool_size=INBOX_SHARD_POOL_SIZE, instrument=METRICS_ENABLED):
+        super().__init__(path, pool_size, instrument)
+        self.shard_count = shard_count
+
+        def open_shard(shard_path, init_schema=True):
+            return InboxShard(shard_path, init_schema, main_path=path)
+
+        self.shards = [AsyncDatabase(shard_path, shard_pool_size, instrument, open_database=open_shard)
+                       for shard_path in shard_paths(path, shard_count)]
+
+    def close(self):
+        for shard in self.shards:
+            shard.close()
+        super().close()
+
+    def _global_rows(self, rows, index):
+        return [(row[0] * self.shard_count + index,) + tuple(row[1:]) for row in rows]
+
+    def _local_id(self, message_id, index, newer):
+        """The local id bound in shard `index` equivalent to a global id bound"""
+        if newer:
+            return (message_id - index) // self.shard_count
+        return -((index - message_id) // self.shard_count)
+
+    async def _scatter(self, method, *args):
+        """Run a method on every shard; returns each shard's rows with global ids"""
+        results = await asyncio.gather(*(shard.run(method, *args) for shard in self.shards))
+        return [self._global_rows(rows, index) for index, rows in enumerate(results)]
+
+    # Inbox management methods
+    async def add_inbox_message(self, email_address, sender, subject, body):
+        return await self.add_inbox_messages([(email_address, sender, subject, body)])
+
+    async def add_inbox_messages(self, messages):
+        batches = {}
+        for message in messages:
+            batches.setdefault(shard_for(message[0], self.shard_count), []).append(message)
+        counts = await asyncio.gather(*(
+            self.shards[index].add_inbox_messages(batch) for index, batch in batches.items()
+        ))
+        return sum(counts)
+
+    async def get_body_storage_report(self):
+        reports = await asyncio.gather(*(shard.get_body_storage_report() for shard in self.shards))
+        return merge_body_reports(reports)
+
+    async def get_inbox_messages(self, email_address):
+        index = shard_for(email_address, self.shard_count)
+        rows = await self.shards[index].get_inbox_messages(email_address)
+        return self._global_rows(rows, index)
+
+    async def get_all_user_inbox(self, user_id):
+        results = await self._scatter('get_all_user_inbox', user_id)
+        return list(heapq.merge(*results, key=lambda row: row[5], reverse=True))
+
+    async def get_inbox_page(self, user_id, cursor=None, limit=10, newer=False):
+        pages = await asyncio.gather(*(
+            shard.get_inbox_page(
+                user_id, cursor and (cursor[0], self._local_id(cursor[1], index, newer)), limit, newer
+            )
+            for index, shard in enumerate(self.shards)
+        ))
+        merged = list(heapq.merge(
+            *(self._global_rows(rows, index) for index, rows in enumerate(pages)),
+            key=lambda row: (row[4], row[0]), reverse=True
+        ))
+        # Newest first either way; newer pages are the rows closest to the cursor
+        return merged[-limit:] if newer else merged[:limit]
+
+    async def get_inbox_message(self, message_id, user_id):
+        index, local_id = message_id % self.shard_count, message_id // self.shard_count
+        message = await self.shards[index].get_inbox_message(local_id, user_id)
+        return message and self._global_rows([message], index)[0]
+
+    # Attachment methods
+    async def get_message_attachments(self, message_id):
+        index, local_id = message_id % self.shard_count, message_id // self.shard_count
+        return self._global_rows(await self.shards[index].get_message_attachments(local_id), index)
+
+    async def get_attachment(self, attachment_id, user_id):
+        index, local_id = attachment_id % self.shard_count, attachment_id // self.shard_count
+        return await self.shards[index].get_attachment(local_id, user_id)
+
+    async def get_referenced_attachments(self, hashes):
+        results = await asyncio.gather(*(shard.get_referenced_attachments(hashes) for shard in self.shards))
+        return set().union(*results)
+
+    # Full-text search methods
+    async def search_inbox(self, user_id, terms, limit=10, offset=0, with_rank=False):
+        """Best matches across shards; bm25 statistics are per shard, which hashing keeps alike"""
+        results = await self._scatter('search_inbox', user_id, terms, offset + limit, 0, True)
+        rows = list(itertools.islice(heapq.merge(*results, key=lambda row: row[-1]), offset, offset + limit))
+        return rows if with_rank else [row[:-1] for row in rows]
+
+    async def rebuild_search_index(self):
+        await asyncio.gather(*(shard.rebuild_search_index() for shard in self.shards))
+
+    # Retention methods
+    async def purge_deactivated_messages(self, limit):
+        """The purge queue is kept in the main file; messages are deleted from their shard"""
+        deleted = 0
+        while deleted < limit:
+            queued = await self.get_purge_queue(1)
+            if not queued:
+                break
+            shard = self.shards[shard_for(queued[0], self.shard_count)]
+            deleted += await shard.delete_address_messages(queued[0], limit - deleted)
+            if deleted < limit:
+                await self.dequeue_purge(queued[0])
+        return deleted
+
+    async def delete_expired_messages(self, after, free_cutoff, premium_cutoff, limit):
+        """Walk every shard in step; the cursor maps each unfinished shard to its own cursor"""
+        pending = after if after is not None else dict.fromkeys(range(self.shard_count))
+        results = await asyncio.gather(*(
+            self.shards[index].delete_expired_messages(cursor, free_cutoff, premium_cutoff, limit)
+            for index, cursor in pending.items()
+        ))
+        next_cursors = {index: cursor for index, (_, cursor) in zip(pending, results) if cursor is not None}
+        return sum(deleted for deleted, _ in results), next_cursors or None
+
+    async def incremental_vacuum(self, max_pages):
+        results = await asyncio.gather(
+            super().incremental_vacuum(max_pages), *(shard.incremental_vacuum(max_pages) for shard in self.shards)
+        )
+        return sum(released for released, _ in results), sum(free for _, free in results)
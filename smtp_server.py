@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import re
+from attachment_spool import AttachmentSpool
+from mime_stream import MessageParser
+from config import DOMAIN, SMTP_HOST, SMTP_PORT, SMTP_MAX_MESSAGE_SIZE, SMTP_IDLE_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+PATH_RE = re.compile(r'^(?:FROM|TO):\s*<([^>]*)>', re.IGNORECASE)
+
+class SMTPSession:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.mail_from = None
+        # Insertion-ordered set: a repeated RCPT TO must not deliver twice
+        self.rcpt_to = {}
+
+class MailServer:
+    """Asyncio SMTP listener that delivers mail for active fake addresses.
+
+    Recipients are checked against an in-memory map of active addresses
+    (address -> user_id), so unknown recipients are refused at RCPT time
+    without touching the database. Accepted messages are handed to the
+    InboxWriter and acknowledged once committed. Messages are parsed as
+    they arrive, with attachments decoded into the spool.
+    """
+
+    def __init__(self, db, writer, recipients=None, spool=None, domain=DOMAIN,
+                 max_message_size=SMTP_MAX_MESSAGE_SIZE, idle_timeout=SMTP_IDLE_TIMEOUT):
+        self.db = db
+        self.writer = writer
+        self.recipients = recipients if recipients is not None else {}
+        self.spool = spool or AttachmentSpool()
+        self.domain = domain
+        self.max_message_size = max_message_size
+        self.idle_timeout = idle_timeout
+        self.server = None
+
+    async def load_recipients(self):
+        self.recipients.clear()
+        self.recipients.update(await self.db.get_active_addresses())
+        logger.info(f"Loaded {len(self.recipients)} active addresses for SMTP delivery")
+
+    async def start(self, host=SMTP_HOST, port=SMTP_PORT):
+        await self.load_recipients()
+        self.server = await asyncio.start_server(self.handle_client, host, port)
+        logger.info(f"SMTP server listening on {host}:{port}")
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    async def handle_client(self, reader, writer):
+        session = SMTPSession()
+        try:
+            await self._reply(writer, f'220 {self.domain} ESMTP ready')
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                if not line:
+                    break
+                if not await self._handle_command(line.decode('utf-8', 'replace').strip(), session, reader, writer):
+                    break
+        except asyncio.TimeoutError:
+            await self._reply(writer, '421 4.4.2 Idle timeout, closing connection')
+        except ValueError:
+            # StreamReader line limit exceeded
+            await self._reply(writer, '500 5.5.2 Line too long')
+        except ConnectionError:
+            pass
+        except Exception as e:
+            logger.error(f"Error in SMTP session: {e}")
+        finally:
+            writer.close()
+
+    async def _handle_command(self, line, session, reader, writer):
+        verb, _, arg = line.partition(' ')
+        verb = verb.upper()
+
+        if verb == 'EHLO':
+            session.reset()
+            await self._reply(writer, f'250-{self.domain}', f'250-SIZE {self.max_message_size}',
+                              '250-8BITMIME', '250 PIPELINING')
+        elif verb == 'HELO':
+            session.reset()
+            await self._reply(writer, f'250 {self.domain}')
+        elif verb == 'MAIL':
+            match = PATH_RE.match(arg)
+            if not match:
+                await self._reply(writer, '501 5.5.4 Syntax: MAIL FROM:<address>')
+            elif session.mail_from is not None:
+                await self._reply(writer, '503 5.5.1 Nested MAIL command')
+            else:
+                session.mail_from = match.group(1)
+                await self._reply(writer, '250 2.1.0 OK')
+        elif verb == 'RCPT':
+            match = PATH_RE.match(arg)
+            if session.mail_from is None:
+                await self._reply(writer, '503 5.5.1 Need MAIL command')
+            elif not match:
+                await self._reply(writer, '501 5.5.4 Syntax: RCPT TO:<address>')
+            elif match.group(1).lower() not in self.recipients:
+                await self._reply(writer, '550 5.1.1 No such user here')
+            else:
+                session.rcpt_to[match.group(1).lower()] = None
+                await self._reply(writer, '250 2.1.5 OK')
+        elif verb == 'DATA':
+            if not session.rcpt_to:
+                await self._reply(writer, '503 5.5.1 Need RCPT command')
+            else:
+                await self._reply(writer, '354 End data with <CR><LF>.<CR><LF>')
+                await self._reply(writer, await self._receive_data(session, reader))
+                session.reset()
+        elif verb == 'RSET':
+            session.reset()
+            await self._reply(writer, '250 2.0.0 OK')
+        elif verb == 'NOOP':
+            await self._reply(writer, '250 2.0.0 OK')
+        elif verb == 'VRFY':
+            await self._reply(writer, '252 2.1.5 Cannot VRFY user')
+        elif verb == 'QUIT':
+            await self._reply(writer, '221 2.0.0 Bye')
+            return False
+        else:
+            await self._reply(writer, '502 5.5.2 Command not implemented')
+        return True
+
+    async def _receive_data(self, session, reader):
+        parser = MessageParser(self.spool)
+        size = 0
+        try:
+            while True:
+                line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+                if not line:
+                    raise ConnectionError("Connection closed during DATA")
+                if line in (b'.\r\n', b'.\n'):
+                    break
+                if line.startswith(b'.'):
+                    line = line[1:]
+                size += len(line)
+                if size <= self.max_message_size:
+                    parser.feed(line)
+                    if parser.needs_drain:
+                        await parser.drain()
+        except BaseException:
+            await parser.abort()
+            raise
+
+        if size > self.max_message_size:
+            await parser.abort()
+            return '552 5.3.4 Message too big'
+
+        try:
+            sender, subject, body, attachments = await parser.close()
+        except BaseException:
+            await parser.abort()
+            raise
+        try:
+            await asyncio.gather(*[
+                self.writer.submit(address, sender, subject, body, attachments) for address in session.rcpt_to
+            ])
+        except Exception as e:
+            logger.error(f"Failed to deliver message from {session.mail_from}: {e}")
+            return '451 4.3.0 Temporary failure, try again later'
+        return '250 2.0.0 Message accepted for delivery'
+
+    async def _reply(self, writer, *lines):
+        writer.write(''.join(f'{line}\r\n' for line in lines).encode())
+        await writer.drain()
@@ -0,0 +1,51 @@
+import asyncio
+from address_allocator import AddressAllocator, FeistelPermutation, ADDRESS_SPACE, encode_local_part
+from async_database import AsyncDatabase
+from config import DOMAIN
+from database import Database
+
+def test_only_addresses_before_the_sequence_are_filtered(tmp_path):
+    path = str(tmp_path / 'test.db')
+    db = Database(path)
+    permutation = FeistelPermutation(ADDRESS_SPACE, db.get_address_key())
+    first = f"{encode_local_part(permutation(0))}@{DOMAIN}"
+    # A random address from before the sequence that equals the first permuted one
+    assert db.create_fake_email(1, first, 'secret')
+    db.conn.execute('UPDATE address_sequence SET legacy_max_id = (SELECT MAX(id) FROM fake_emails)')
+    db.conn.commit()
+    assert db.create_fake_email(1, f'later@{DOMAIN}', 'secret')
+    db.close()
+
+    async def scenario():
+        async_db = AsyncDatabase(path, pool_size=1, instrument=False)
+        try:
+            allocator = AddressAllocator(async_db, filter_capacity=100)
+            await allocator.load()
+            assert allocator.filter.count == 1
+            assert f'later@{DOMAIN}' not in allocator.filter
+
+            addresses = await allocator.allocate_many(3)
+            assert first not in addresses
+            assert allocator.skipped == 1
+            assert len(set(addresses)) == 3
+        finally:
+            async_db.close()
+
+    asyncio.run(scenario())
+
+def test_new_database_loads_nothing(tmp_path):
+    async def scenario():
+        db = AsyncDatabase(str(tmp_path / 'test.db'), pool_size=1, instrument=False)
+        try:
+            allocator = AddressAllocator(db)
+            email = await allocator.allocate()
+            await db.create_fake_email(1, email, 'secret')
+            assert await db.get_legacy_address_bound() == 0
+
+            restarted = AddressAllocator(db)
+            await restarted.load()
+            assert restarted.filter.count == 0
+        finally:
+            db.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,27 @@
+import asyncio
+from async_database import AsyncDatabase
+from database import Database
+
+class FailingDatabase(Database):
+    def add_user_then_fail(self, user_id):
+        self.conn.execute('INSERT INTO users (user_id, username) VALUES (?, ?)', (user_id, 'half'))
+        raise RuntimeError('failed after writing')
+
+def test_failed_call_rolls_back_its_transaction(tmp_path):
+    async def scenario(instrument):
+        db = AsyncDatabase(str(tmp_path / f'{instrument}.db'), pool_size=1, instrument=instrument,
+                           open_database=FailingDatabase)
+        try:
+            try:
+                await db.run('add_user_then_fail', 1)
+            except RuntimeError:
+                pass
+            # The next write on the same worker must not commit the half-written row
+            await db.create_user(2, 'user')
+            assert await db.run('get_user', 1) is None
+            assert await db.run('get_user', 2) is not None
+        finally:
+            db.close()
+
+    asyncio.run(scenario(False))
+    asyncio.run(scenario(True))
@@ -0,0 +1,34 @@
+import sqlite3
+from types import SimpleNamespace
+import manage
+from database import Database
+from sharded_database import shard_paths
+
+def test_interrupted_shard_inbox_resumes_without_duplicates(tmp_path, monkeypatch):
+    path = str(tmp_path / 'test.db')
+    db = Database(path)
+    for n in range(30):
+        db.create_fake_email(n % 3, f'user{n}@wizard.com', 'secret')
+    db.add_inbox_messages([(f'user{n % 30}@wizard.com', 'sender', f'Subject {n}', f'Body {n}') for n in range(250)])
+    args = SimpleNamespace(database=path, shards=3)
+    monkeypatch.setattr(manage, 'SHARD_CHUNK', 100)
+
+    # Fail the first delete from the main database, after the shards committed their copies
+    db.conn.execute("CREATE TEMP TRIGGER crash BEFORE DELETE ON inbox_messages BEGIN SELECT RAISE(ABORT, 'crash'); END")
+    try:
+        manage.shard_inbox(db, args)
+    except sqlite3.IntegrityError:
+        db.conn.rollback()
+    else:
+        raise AssertionError('expected the delete to fail')
+    db.conn.execute('DROP TRIGGER crash')
+
+    manage.shard_inbox(db, args)
+    assert db.conn.execute('SELECT COUNT(*) FROM inbox_messages').fetchone()[0] == 0
+    sharded = 0
+    for shard_path in shard_paths(path, 3):
+        conn = sqlite3.connect(shard_path)
+        sharded += conn.execute('SELECT COUNT(*) FROM inbox_messages').fetchone()[0]
+        conn.close()
+    db.close()
+    assert sharded == 250
@@ -0,0 +1,86 @@
+import asyncio
+from async_database import AsyncDatabase
+from mail_manager import MailManager
+from premium_expiry import PremiumExpiryScheduler
+
+USER_ID = 7
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def run_with_bot_parts(tmp_path, scenario):
+    """Run scenario(manager, scheduler, clock) against a fresh database, wired up as FakeMailBot does"""
+    async def main():
+        db = AsyncDatabase(str(tmp_path / 'test.db'), pool_size=2, instrument=False)
+        manager = MailManager(db)
+        clock = FakeClock()
+
+        def on_expired(user_ids):
+            for user_id in user_ids:
+                manager.invalidate_user(user_id)
+
+        scheduler = PremiumExpiryScheduler(db, on_expired=on_expired, clock=clock)
+        try:
+            await db.create_user(USER_ID, 'user')
+            await scenario(manager, scheduler, clock)
+        finally:
+            db.close()
+
+    asyncio.run(main())
+
+async def redeem(manager, scheduler, code, days):
+    await manager.db.create_premium_codes([code], 1, days)
+    _, expiry = await manager.redeem_premium_code(USER_ID, code)
+    scheduler.schedule(USER_ID, expiry.timestamp())
+    return expiry.timestamp()
+
+def test_premium_expires_at_the_deadline(tmp_path):
+    async def scenario(manager, scheduler, clock):
+        expiry = await redeem(manager, scheduler, 'CODE1', 30)
+
+        clock.now = expiry - 1
+        assert await scheduler.expire_due() == []
+        assert (await manager.get_quota(USER_ID)).is_premium
+
+        clock.now = expiry
+        assert await scheduler.expire_due() == [USER_ID]
+        assert scheduler.next_expiry() is None
+        assert scheduler.metrics() == {'scheduled': 0, 'expired': 1}
+
+    run_with_bot_parts(tmp_path, scenario)
+
+def test_redeeming_again_reschedules_expiry(tmp_path):
+    async def scenario(manager, scheduler, clock):
+        first = await redeem(manager, scheduler, 'CODE1', 30)
+        second = await redeem(manager, scheduler, 'CODE2', 10)
+        # The new code extends the running premium rather than restarting it
+        assert second == first + 10 * 86400
+
+        # The replaced heap entry comes due first and must be skipped
+        clock.now = first
+        assert await scheduler.expire_due() == []
+        assert (await manager.get_quota(USER_ID)).is_premium
+        assert scheduler.next_expiry() == second
+
+        clock.now = second
+        assert await scheduler.expire_due() == [USER_ID]
+
+    run_with_bot_parts(tmp_path, scenario)
+
+def test_expiry_invalidates_cached_quota(tmp_path):
+    async def scenario(manager, scheduler, clock):
+        expiry = await redeem(manager, scheduler, 'CODE1', 30)
+        quota = await manager.get_quota(USER_ID)
+        assert quota.is_premium
+        assert manager.quota_cache.get(USER_ID) is quota
+
+        clock.now = expiry
+        await scheduler.expire_due()
+        assert manager.quota_cache.get(USER_ID) is None
+        assert not (await manager.get_quota(USER_ID)).is_premium
+
+    run_with_bot_parts(tmp_path, scenario)
@@ -0,0 +1,16 @@
+from database import Database
+
+def test_hot_queries_use_indexes(tmp_path):
+    db = Database(str(tmp_path / 'test.db'))
+    try:
+        assert db.find_table_scans() == {}
+    finally:
+        db.close()
+
+def test_unindexed_query_is_reported(tmp_path):
+    db = Database(str(tmp_path / 'test.db'))
+    try:
+        scans = db.find_table_scans({'by_username': ('SELECT * FROM users WHERE username = ?', ('user',))})
+        assert list(scans) == ['by_username']
+    finally:
+        db.close()
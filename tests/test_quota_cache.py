@@ -0,0 +1,68 @@
+import asyncio
+from mail_manager import MailManager
+
+class SlowDatabase:
+    """get_quota_state returns the state as it was when called, once released"""
+
+    def __init__(self):
+        self.is_premium = False
+        self.count = 0
+        self.release = asyncio.Event()
+
+    async def get_quota_state(self, user_id):
+        state = (self.is_premium, self.count, None)
+        await self.release.wait()
+        return state
+
+def test_invalidation_during_load_is_not_overwritten():
+    async def scenario():
+        db = SlowDatabase()
+        manager = MailManager(db)
+        load = asyncio.create_task(manager.get_quota(1))
+        await asyncio.sleep(0)
+
+        # Premium is redeemed while the old state is being read
+        db.is_premium = True
+        manager.invalidate_user(1)
+        db.release.set()
+
+        assert not (await load).is_premium
+        assert manager.quota_cache.get(1) is None
+        assert (await manager.get_quota(1)).is_premium
+        assert manager.quota_cache.get(1) is not None
+        assert not manager.quota_cache._loads
+
+    asyncio.run(scenario())
+
+def test_adjustment_during_load_is_not_lost():
+    async def scenario():
+        db = SlowDatabase()
+        manager = MailManager(db)
+        load = asyncio.create_task(manager.get_quota(1))
+        await asyncio.sleep(0)
+
+        db.count = 1
+        manager.quota_cache.adjust(1, 1)
+        db.release.set()
+        await load
+
+        assert manager.quota_cache.get(1) is None
+        assert (await manager.get_quota(1)).count == 1
+
+    asyncio.run(scenario())
+
+def test_failed_load_is_forgotten():
+    class FailingDatabase:
+        async def get_quota_state(self, user_id):
+            raise RuntimeError('database is locked')
+
+    async def scenario():
+        manager = MailManager(FailingDatabase())
+        try:
+            await manager.get_quota(1)
+        except RuntimeError:
+            pass
+        assert not manager.quota_cache._loads
+        assert len(manager.quota_cache) == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,37 @@
+import asyncio
+import retention
+from retention import RetentionSweeper
+
+class FakeDatabase:
+    """Pretends to hold `rows` expired messages in received order"""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.starts = []
+        self.clock = 0.0
+
+    async def purge_deactivated_messages(self, limit):
+        return 0
+
+    async def delete_expired_messages(self, after, free_cutoff, premium_cutoff, limit):
+        start = after or 0
+        self.starts.append(start)
+        # Each chunk uses up a whole sweep's time budget
+        self.clock += 1.0
+        end = min(start + limit, self.rows)
+        return end - start, end if end < self.rows else None
+
+    async def incremental_vacuum(self, max_pages):
+        return 0, 0
+
+def test_expiry_walk_resumes_across_sweeps(monkeypatch):
+    db = FakeDatabase(rows=10)
+    monkeypatch.setattr(retention.time, 'perf_counter', lambda: db.clock)
+
+    async def scenario():
+        sweeper = RetentionSweeper(db, chunk_size=4, cycle_budget=1.0)
+        cycles = [await sweeper.sweep() for _ in range(4)]
+        assert db.starts == [0, 4, 8, 0]
+        assert [cycle['completed'] for cycle in cycles] == [False, False, True, False]
+
+    asyncio.run(scenario())
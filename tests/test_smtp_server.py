@@ -0,0 +1,65 @@
+import asyncio
+import smtplib
+from email.message import EmailMessage
+from attachment_spool import AttachmentSpool
+from smtp_server import MailServer
+
+class FakeWriter:
+    def __init__(self):
+        self.messages = []
+
+    async def submit(self, email_address, sender, subject, body, attachments=()):
+        self.messages.append((email_address, sender, subject, body, attachments))
+
+def deliver(tmp_path, send):
+    """Run a MailServer on a local port and call send(port) from a thread; returns what was submitted"""
+    async def scenario():
+        writer = FakeWriter()
+        recipients = {'alice@wizard.com': 1, 'bob@wizard.com': 2}
+        server = MailServer(None, writer, recipients, AttachmentSpool(str(tmp_path / 'attachments')))
+        server.server = await asyncio.start_server(server.handle_client, '127.0.0.1', 0)
+        try:
+            port = server.server.sockets[0].getsockname()[1]
+            await asyncio.to_thread(send, port)
+        finally:
+            await server.stop()
+        return writer.messages
+
+    return asyncio.run(scenario())
+
+def message(recipients):
+    mail = EmailMessage()
+    mail['From'] = 'sender@example.com'
+    mail['To'] = ', '.join(recipients)
+    mail['Subject'] = 'Hello'
+    mail.set_content('First line\n.Leading dot\n')
+    mail.add_attachment(b'\x00\x01' * 1000, maintype='application', subtype='octet-stream', filename='data.bin')
+    return mail
+
+def test_delivers_to_each_recipient_once(tmp_path):
+    def send(port):
+        with smtplib.SMTP('127.0.0.1', port) as client:
+            refused = client.send_message(message(['alice@wizard.com', 'Alice@wizard.com', 'bob@wizard.com']))
+            assert refused == {}
+
+    messages = deliver(tmp_path, send)
+    assert [m[0] for m in messages] == ['alice@wizard.com', 'bob@wizard.com']
+    _, sender, subject, body, attachments = messages[0]
+    assert (sender, subject) == ('sender@example.com', 'Hello')
+    assert body == 'First line\n.Leading dot\n'
+    assert [(name, size) for name, _, size, _ in attachments] == [('data.bin', 2000)]
+
+def test_unknown_recipient_is_refused(tmp_path):
+    def send(port):
+        with smtplib.SMTP('127.0.0.1', port) as client:
+            refused = client.send_message(message(['alice@wizard.com', 'nobody@wizard.com']))
+            assert refused['nobody@wizard.com'][0] == 550
+        with smtplib.SMTP('127.0.0.1', port) as client:
+            try:
+                client.send_message(message(['nobody@wizard.com']))
+            except smtplib.SMTPRecipientsRefused:
+                pass
+            else:
+                raise AssertionError('expected the only recipient to be refused')
+
+    assert [m[0] for m in deliver(tmp_path, send)] == ['alice@wizard.com']
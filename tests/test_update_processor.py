@@ -0,0 +1,67 @@
+import asyncio
+from types import SimpleNamespace
+from update_processor import PerUserUpdateProcessor
+
+def update_from(user_id):
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id))
+
+def test_busy_user_does_not_block_others():
+    async def scenario():
+        processor = PerUserUpdateProcessor(2)
+        release = asyncio.Event()
+        finished = []
+
+        async def handler(name, blocked=False):
+            if blocked:
+                await release.wait()
+            finished.append(name)
+
+        # User 1's first update blocks; its followers queue behind it
+        busy = [asyncio.create_task(processor.process_update(update_from(1), handler('a0', blocked=True)))]
+        busy += [asyncio.create_task(processor.process_update(update_from(1), handler(f'a{n}')))
+                 for n in range(1, 5)]
+        await asyncio.sleep(0)
+
+        await asyncio.wait_for(processor.process_update(update_from(2), handler('b')), timeout=1)
+        assert finished == ['b']
+
+        release.set()
+        await asyncio.gather(*busy)
+        assert finished == ['b', 'a0', 'a1', 'a2', 'a3', 'a4']
+        assert not processor._locks
+
+    asyncio.run(scenario())
+
+def test_updates_from_one_user_run_one_at_a_time():
+    async def scenario():
+        processor = PerUserUpdateProcessor(8)
+        running, most = 0, 0
+
+        async def handler():
+            nonlocal running, most
+            running += 1
+            most = max(most, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update(update_from(1), handler()) for _ in range(10)))
+        assert most == 1
+
+    asyncio.run(scenario())
+
+def test_concurrency_limit_applies_across_users():
+    async def scenario():
+        processor = PerUserUpdateProcessor(2)
+        running, most = 0, 0
+
+        async def handler():
+            nonlocal running, most
+            running += 1
+            most = max(most, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+
+        await asyncio.gather(*(processor.process_update(update_from(user_id), handler()) for user_id in range(8)))
+        assert most == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,43 @@
+import asyncio
+import time
+
+class TokenBucket:
+    """Classic token bucket; acquire() waits until a token is available"""
+
+    # One bucket per active user and action in UserRateLimiter
+    __slots__ = ('rate', 'capacity', 'clock', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.paused_until = 0.0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def try_acquire(self):
+        """Take a token; returns 0 on success or the seconds to wait before retrying"""
+        now = self._refill()
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """Hand out nothing for `seconds`, e.g. after a flood-control 429"""
+        self.paused_until = max(self.paused_until, self.clock() + seconds)
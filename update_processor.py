@@ -0,0 +1,61 @@
+import asyncio
+import sys
+from telegram.ext import BaseUpdateProcessor
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Runs updates concurrently but never two from the same user at once.
+
+    Updates from different users proceed in parallel up to
+    max_concurrent_updates; updates from one user queue on a per-user lock
+    in arrival order, so two quick clicks on "Create Fake Mail" cannot race
+    each other past the quota check. Locks exist only while a user has
+    updates in flight, so memory stays proportional to active users.
+
+    The per-user lock is taken before a concurrency slot, so updates
+    waiting behind their user's earlier one hold no slot and a single busy
+    user cannot starve everyone else. The base class's semaphore would be
+    taken first, so it is sized to never bind and this class enforces
+    max_concurrent_updates with its own.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(sys.maxsize)
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        self.concurrency_limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        self._locks = {}  # user_id -> [lock, updates holding or waiting on it]
+
+    @staticmethod
+    def ordering_key(update):
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, 'effective_chat', None)
+        return chat.id if chat is not None else None
+
+    async def do_process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass